@@ -1,13 +1,16 @@
 import os
 import json
 import logging
+import threading
 from pathlib import Path
 from typing import Dict, List, Optional, Union
 from pydantic import BaseModel, Field
-from fastapi import FastAPI, HTTPException, Query, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, Depends, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from ivas_integration import IVASVideoProcessor
+from src.modules.amh.material_repository import MaterialRepository
+from src.modules.amh.archive_export import FORMATS, parse_range
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -36,6 +39,21 @@ except Exception as e:
 DOWNLOADS_DIR = Path(__file__).parent / "downloads"
 DOWNLOADS_DIR.mkdir(exist_ok=True)
 
+# 广告素材库目录
+AMH_BASE_DIR = os.environ.get("AMH_BASE_DIR", str(Path(__file__).parent / "data" / "materials"))
+material_repo = None
+# 同步接口在线程池中执行，并发的首次请求只能打开一个素材库实例
+material_repo_lock = threading.Lock()
+
+def get_material_repo() -> MaterialRepository:
+    """首次使用时打开素材库"""
+    global material_repo
+    if material_repo is None:
+        with material_repo_lock:
+            if material_repo is None:
+                material_repo = MaterialRepository(AMH_BASE_DIR)
+    return material_repo
+
 # 检查API密钥配置
 if not BIBIGPT_API_KEY:
     logger.warning("BibiGPT API密钥未配置，将使用模拟摘要功能")
@@ -187,6 +205,67 @@ async def download_file(filename: str):
         media_type="video/mp4"
     )
 
+@app.get("/api/materials/export")
+def export_materials(
+    request: Request,
+    format: str = Query("zip", description="归档格式: zip(不压缩)/tar"),
+    category: Optional[str] = Query(None, description="素材分类"),
+    query: Optional[str] = Query(None, description="搜索关键词"),
+    material_type: Optional[str] = Query(None, description="素材类型: video/image/audio/segment"),
+    tags: Optional[List[str]] = Query(None, description="标签(与关系)"),
+    ids: Optional[str] = Query(None, description="逗号分隔的素材ID，指定时忽略搜索条件")
+):
+    """流式打包下载素材(包含manifest.json)，支持Range断点续传"""
+    # 同步函数由线程池执行，打包过程中读取文件不阻塞事件循环
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的归档格式: {format}")
+    repo = get_material_repo()
+    if ids:
+        archive = repo.build_archive(format, material_ids=[i for i in ids.split(",") if i])
+    else:
+        search = {k: v for k, v in {"query": query, "material_type": material_type, "tags": tags}.items() if v}
+        archive = repo.build_archive(format, category=category, search=search or None)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{archive.etag}"',
+        "Content-Disposition": f'attachment; filename="materials-{archive.etag[:8]}.{format}"'
+    }
+    start, end, status_code = 0, archive.size, 200
+    # If-Range与当前归档不一致(素材有变化)时返回完整内容
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range.strip('"') == archive.etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), archive.size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{archive.size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{archive.size}"
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(
+        archive.iter_bytes(start, end), status_code=status_code, media_type=archive.media_type, headers=headers
+    )
+
+@app.get("/api/materials/facets")
+def material_facets(
+    facets: List[str] = Query(["type", "category", "tags"], description="分面: type/category/tags/metadata.<路径>"),
+    category: Optional[str] = Query(None, description="素材分类"),
+    query: Optional[str] = Query(None, description="搜索关键词"),
+    material_type: Optional[str] = Query(None, description="素材类型: video/image/audio/segment"),
+    tags: Optional[List[str]] = Query(None, description="标签(与关系)"),
+    limit: int = Query(10, ge=1, le=1000, description="每个分面返回的取值数量")
+):
+    """当前过滤条件下各分面的素材数量(类型、分类、标签、元数据取值)"""
+    filters = {k: v for k, v in {
+        "category": category, "query": query, "material_type": material_type, "tags": tags
+    }.items() if v}
+    try:
+        return get_material_repo().facet_counts(filters, facets=facets, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/api/search/videos")
 async def search_videos(params: VideoSearchParams):
     """搜索视频"""
@@ -3,6 +3,6 @@ AMH模块 - Advertising Material Hub
 负责结构化存储可复用片段
 """
  
-__all__ = ["material_repository", "segment_manager", "asset_indexer"] 
+__all__ = ["material_repository", "storage_backend", "inverted_index", "text_index", "secondary_index", "query_planner", "pagination", "content_hash", "ingest_strategy", "storage_layout", "index_stream", "index_snapshot", "process_lock", "relation_graph", "tier_manager", "segment_manager", "asset_indexer", "scrubber", "garbage_collector", "media_probe", "archive_export"] 
  
  
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+素材访问时间跟踪器
+在内存中缓冲last_accessed更新，并在后台按固定间隔合并写入
+"""
+import atexit
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AccessTracker:
+    """访问时间跟踪器，同一素材在一个刷新周期内的多次访问只写入一次"""
+
+    def __init__(self,
+                 flush_fn: Callable[[Dict[str, str]], None],
+                 flush_interval: Optional[float] = 5.0):
+        """
+        初始化访问时间跟踪器
+
+        Args:
+            flush_fn: 刷新回调，参数为{素材ID: 最后访问时间}
+            flush_interval: 后台刷新间隔(秒)，为None或不大于0时只在flush()/close()时写入
+        """
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval
+
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        if flush_interval and flush_interval > 0:
+            self._thread = threading.Thread(
+                target=self._run,
+                name='amh-access-tracker',
+                daemon=True
+            )
+            self._thread.start()
+
+        # 进程退出时写入尚未刷新的访问时间
+        atexit.register(self.close)
+
+    def record(self, material_id: str, accessed_at: str):
+        """
+        记录一次访问
+
+        Args:
+            material_id: 素材ID
+            accessed_at: 访问时间(ISO格式)
+        """
+        with self._pending_lock:
+            self._pending[material_id] = accessed_at
+
+    def discard(self, material_id: str):
+        """丢弃素材尚未写入的访问记录(例如素材已被删除)"""
+        with self._pending_lock:
+            self._pending.pop(material_id, None)
+
+    @property
+    def pending_count(self) -> int:
+        """尚未写入的素材数量"""
+        with self._pending_lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """
+        立即写入缓冲的访问时间
+
+        Returns:
+            写入的素材数量
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                updates, self._pending = self._pending, {}
+
+            if not updates:
+                return 0
+
+            try:
+                self.flush_fn(updates)
+            except Exception as e:
+                logger.error(f"写入素材访问时间失败: {str(e)}")
+                # 放回缓冲区，已有更新的访问时间优先
+                with self._pending_lock:
+                    for material_id, accessed_at in updates.items():
+                        self._pending.setdefault(material_id, accessed_at)
+                return 0
+
+            return len(updates)
+
+    def close(self):
+        """停止后台刷新并写入剩余的访问时间"""
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        atexit.unregister(self.close)
+
+    def _run(self):
+        """后台刷新循环"""
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
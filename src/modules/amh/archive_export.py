@@ -0,0 +1,364 @@
+"""
+素材打包导出
+把一组素材(搜索结果或分类)流式打包为ZIP(存储方式，不重新压缩)或TAR，直接写入文件或HTTP响应；
+归档的字节布局只由条目的名称、大小和修改时间决定，可以预先算出总大小并从任意偏移开始生成，
+用于Range断点续传；不生成临时副本，内存占用与素材文件大小无关
+"""
+import os
+import json
+import time
+import zlib
+import bisect
+import struct
+import sqlite3
+import hashlib
+import tarfile
+import logging
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from .content_hash import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 支持的归档格式 -> MIME类型
+FORMATS = {'zip': 'application/zip', 'tar': 'application/x-tar'}
+
+# 归档中的清单文件名
+MANIFEST_NAME = 'manifest.json'
+
+# ZIP: 通用标志位3(CRC和大小写在数据之后的描述符中)和11(文件名为UTF-8)
+_ZIP_FLAGS = 0x08 | 0x800
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_MARKER = 0xFFFFFFFF
+_ZIP_MAX_ENTRIES = 0xFFFF
+_TAR_BLOCK = tarfile.BLOCKSIZE
+
+
+def _dos_datetime(mtime: float) -> Tuple[int, int]:
+    """转换为ZIP的DOS时间和日期(早于1980年的按1980-01-01)"""
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析HTTP Range请求头(只支持单个范围)
+
+    Args:
+        header: Range请求头，例如 "bytes=100-"、"bytes=0-99"、"bytes=-500"
+        size: 资源总大小
+
+    Returns:
+        [开始, 结束)字节范围，没有Range头或格式不支持时返回None(按完整响应处理)
+
+    Raises:
+        ValueError: 范围无法满足(应返回416)
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, sep, last = header[len('bytes='):].strip().partition('-')
+    if not sep or (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+    if not first:
+        # 后缀范围: 最后N个字节
+        if int(last) == 0:
+            raise ValueError(f"无法满足的范围: {header}")
+        return max(size - int(last), 0), size
+    start = int(first)
+    end = int(last) + 1 if last else size
+    if start >= size or end <= start:
+        raise ValueError(f"无法满足的范围: {header}")
+    return start, min(end, size)
+
+
+class CrcCache:
+    """ZIP条目CRC32的持久缓存，按(设备, inode, 大小, 修改时间)索引，线程安全"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS crcs (device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, '
+            'crc INTEGER NOT NULL, PRIMARY KEY (device, inode, size, mtime_ns))'
+        )
+
+    def get(self, key: Tuple[int, int, int, int]) -> Optional[int]:
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT crc FROM crcs WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?', key
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, key: Tuple[int, int, int, int], crc: int):
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO crcs VALUES (?, ?, ?, ?, ?)', key + (crc,))
+
+    def close(self):
+        self.conn.close()
+
+
+def file_entry(name: str, path: str) -> Dict:
+    """
+    生成文件条目(记录当前的大小和修改时间，生成归档时文件被修改会报错)
+
+    Args:
+        name: 归档中的路径
+        path: 文件路径
+    """
+    stat = os.stat(path)
+    return {
+        'name': name,
+        'path': path,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'key': (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    }
+
+
+def data_entry(name: str, data: bytes, mtime: float) -> Dict:
+    """生成内存数据条目(例如清单)"""
+    return {'name': name, 'data': data, 'size': len(data), 'mtime': mtime, 'key': None}
+
+
+class MaterialArchive:
+    """
+    按条目列表描述的归档，可计算总大小并生成任意字节范围
+
+    归档由若干段组成：头部字节、文件数据、ZIP数据描述符和ZIP中央目录；
+    文件数据在读取时才打开文件，描述符和中央目录需要的CRC32按需计算并缓存。
+    """
+
+    def __init__(self, entries: List[Dict], fmt: str = 'zip', crc_cache: Optional[CrcCache] = None):
+        """
+        初始化归档
+
+        Args:
+            entries: file_entry/data_entry生成的条目，按归档中的顺序排列
+            fmt: 'zip'或'tar'
+            crc_cache: ZIP条目CRC32的持久缓存
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"不支持的归档格式: {fmt}")
+        names = [entry['name'] for entry in entries]
+        if len(set(names)) != len(names):
+            raise ValueError("归档中存在重复的文件名")
+        self.entries = entries
+        self.format = fmt
+        self.media_type = FORMATS[fmt]
+        self.crc_cache = crc_cache
+        self._crcs = {}
+
+        # 段: (类型, 长度, 参数)，类型为 'bytes'、'file'、'descriptor' 或 'central'
+        self._segments = []
+        if fmt == 'zip':
+            self._layout_zip()
+        else:
+            self._layout_tar()
+        self._offsets = []
+        offset = 0
+        for _, length, _ in self._segments:
+            self._offsets.append(offset)
+            offset += length
+        self.size = offset
+
+        digest = hashlib.sha1(fmt.encode())
+        for entry in entries:
+            digest.update(json.dumps([entry['name'], entry['size'], entry['mtime'], entry['key']]).encode())
+            if 'data' in entry:
+                digest.update(entry['data'])
+        self.etag = digest.hexdigest()
+
+    def _layout_zip(self):
+        offset = 0
+        self._central_size = 0
+        for i, entry in enumerate(self.entries):
+            entry['header_offset'] = offset
+            header = self._zip_local_header(entry)
+            descriptor = 24 if entry['size'] >= _ZIP64_LIMIT else 16
+            self._segments += [
+                ('bytes', len(header), header), ('file', entry['size'], i), ('descriptor', descriptor, i)
+            ]
+            offset += len(header) + entry['size'] + descriptor
+            self._central_size += 46 + len(entry['name'].encode()) + len(self._zip64_extra(entry))
+        self._central_offset = offset
+        count = len(self.entries)
+        self._zip64_end = (count >= _ZIP_MAX_ENTRIES or self._central_size >= _ZIP64_LIMIT
+                           or offset >= _ZIP64_LIMIT)
+        end_size = 22 + (56 + 20 if self._zip64_end else 0)
+        self._segments.append(('central', self._central_size + end_size, None))
+
+    def _layout_tar(self):
+        for i, entry in enumerate(self.entries):
+            info = tarfile.TarInfo(entry['name'])
+            info.size = entry['size']
+            info.mtime = int(entry['mtime'])
+            info.mode = 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            padding = -entry['size'] % _TAR_BLOCK
+            self._segments += [('bytes', len(header), header), ('file', entry['size'], i)]
+            if padding:
+                self._segments.append(('bytes', padding, b'\0' * padding))
+        self._segments.append(('bytes', _TAR_BLOCK * 2, b'\0' * (_TAR_BLOCK * 2)))
+
+    @staticmethod
+    def _zip_local_header(entry: Dict) -> bytes:
+        name = entry['name'].encode()
+        zip64 = entry['size'] >= _ZIP64_LIMIT
+        # 使用数据描述符时本地头中的CRC和大小为0；ZIP64条目的大小在扩展字段中
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if zip64 else b''
+        size = _ZIP64_MARKER if zip64 else 0
+        dos_time, dos_date = _dos_datetime(entry['mtime'])
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, _ZIP_FLAGS, 0, dos_time, dos_date,
+            0, size, size, len(name), len(extra)
+        ) + name + extra
+
+    @staticmethod
+    def _zip64_fields(entry: Dict) -> List[int]:
+        fields = []
+        if entry['size'] >= _ZIP64_LIMIT:
+            fields += [entry['size'], entry['size']]
+        if entry['header_offset'] >= _ZIP64_LIMIT:
+            fields.append(entry['header_offset'])
+        return fields
+
+    def _zip64_extra(self, entry: Dict) -> bytes:
+        fields = self._zip64_fields(entry)
+        if not fields:
+            return b''
+        return struct.pack('<HH', 1, 8 * len(fields)) + struct.pack(f'<{len(fields)}Q', *fields)
+
+    def _zip_descriptor(self, i: int) -> bytes:
+        entry = self.entries[i]
+        if entry['size'] >= _ZIP64_LIMIT:
+            return struct.pack('<IIQQ', 0x08074b50, self._crc(i), entry['size'], entry['size'])
+        return struct.pack('<IIII', 0x08074b50, self._crc(i), entry['size'], entry['size'])
+
+    def _zip_central(self) -> bytes:
+        """中央目录和目录结束记录"""
+        parts = []
+        for i, entry in enumerate(self.entries):
+            name = entry['name'].encode()
+            extra = self._zip64_extra(entry)
+            version = 45 if extra else 20
+            dos_time, dos_date = _dos_datetime(entry['mtime'])
+            size = _ZIP64_MARKER if entry['size'] >= _ZIP64_LIMIT else entry['size']
+            header_offset = _ZIP64_MARKER if entry['header_offset'] >= _ZIP64_LIMIT else entry['header_offset']
+            parts.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, _ZIP_FLAGS, 0,
+                dos_time, dos_date, self._crc(i), size, size, len(name), len(extra), 0, 0, 0,
+                0o100644 << 16, header_offset
+            ) + name + extra)
+
+        count = len(self.entries)
+        if self._zip64_end:
+            zip64_end_offset = self._central_offset + self._central_size
+            parts.append(struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, self._central_size, self._central_offset
+            ))
+            parts.append(struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1))
+        parts.append(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, *([_ZIP_MAX_ENTRIES if self._zip64_end else count] * 2),
+            _ZIP64_MARKER if self._zip64_end else self._central_size,
+            _ZIP64_MARKER if self._zip64_end else self._central_offset, 0
+        ))
+        return b''.join(parts)
+
+    def _crc(self, i: int) -> int:
+        """条目的CRC32：依次查找本次已计算的值、持久缓存，都没有时读取文件计算"""
+        crc = self._crcs.get(i)
+        if crc is not None:
+            return crc
+        entry = self.entries[i]
+        if 'data' in entry:
+            crc = zlib.crc32(entry['data'])
+        else:
+            crc = self.crc_cache.get(entry['key']) if self.crc_cache is not None else None
+            if crc is None:
+                crc = 0
+                for chunk in self._read_file(entry, 0, entry['size']):
+                    crc = zlib.crc32(chunk, crc)
+                self._store_crc(i, crc)
+        self._crcs[i] = crc
+        return crc
+
+    def _store_crc(self, i: int, crc: int):
+        self._crcs[i] = crc
+        if self.crc_cache is not None and self.entries[i]['key'] is not None:
+            self.crc_cache.put(self.entries[i]['key'], crc)
+
+    @staticmethod
+    def _read_file(entry: Dict, start: int, end: int) -> Iterator[bytes]:
+        """读取文件的[start, end)部分，文件在打包期间被修改时抛出IOError"""
+        with open(entry['path'], 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns) != tuple(entry['key']):
+                raise IOError(f"素材文件在打包期间被修改: {entry['path']}")
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise IOError(f"素材文件在打包期间被截断: {entry['path']}")
+                remaining -= len(chunk)
+                yield chunk
+
+    def iter_bytes(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        生成归档的[start, end)字节范围
+
+        从头完整读取某个文件时顺便计算它的CRC32，顺序下载不需要额外读取文件。
+
+        Args:
+            start: 起始偏移
+            end: 结束偏移(不含)，None表示到末尾
+        """
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return
+        index = bisect.bisect_right(self._offsets, start) - 1
+        while index < len(self._segments) and self._offsets[index] < end:
+            kind, length, arg = self._segments[index]
+            offset = self._offsets[index]
+            lo, hi = max(start, offset) - offset, min(end, offset + length) - offset
+            if kind == 'file':
+                entry = self.entries[arg]
+                if 'data' in entry:
+                    yield entry['data'][lo:hi]
+                elif lo == 0 and hi == length and arg not in self._crcs:
+                    crc = 0
+                    for chunk in self._read_file(entry, lo, hi):
+                        crc = zlib.crc32(chunk, crc)
+                        yield chunk
+                    self._store_crc(arg, crc)
+                else:
+                    yield from self._read_file(entry, lo, hi)
+            elif kind == 'bytes':
+                yield arg[lo:hi]
+            elif kind == 'descriptor':
+                yield self._zip_descriptor(arg)[lo:hi]
+            else:
+                yield self._zip_central()[lo:hi]
+            index += 1
+
+    def write_to(self, f: BinaryIO, start: int = 0) -> int:
+        """
+        写入文件对象
+
+        Args:
+            f: 可写的二进制文件对象
+            start: 起始偏移(续写中断的输出文件时使用)
+
+        Returns:
+            写入的字节数
+        """
+        written = 0
+        for chunk in self.iter_bytes(start):
+            f.write(chunk)
+            written += len(chunk)
+        return written
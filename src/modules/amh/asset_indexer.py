@@ -0,0 +1,448 @@
+"""
+资源索引器
+监视投放目录(Linux上使用inotify，其他平台或inotify不可用时轮询)，
+等待文件写完后分批并行导入素材仓库；目录和文件的检查点保存在metadata/asset_indexer.db，
+重启时只重新列出修改时间发生变化的目录
+"""
+import os
+import sys
+import json
+import time
+import errno
+import select
+import struct
+import sqlite3
+import logging
+import datetime
+import threading
+import collections
+import ctypes
+import ctypes.util
+from typing import Dict, Iterable, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# 扩展名 -> 素材类型
+EXTENSION_TYPES = {
+    '.mp4': 'video', '.mov': 'video', '.mkv': 'video', '.webm': 'video', '.avi': 'video', '.flv': 'video',
+    '.jpg': 'image', '.jpeg': 'image', '.png': 'image', '.webp': 'image', '.gif': 'image',
+    '.mp3': 'audio', '.wav': 'audio', '.aac': 'audio', '.m4a': 'audio', '.flac': 'audio',
+}
+
+# 下载或写入中的临时文件
+IGNORED_SUFFIXES = ('.part', '.partial', '.tmp', '.crdownload', '.download')
+
+# inotify事件
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """通过ctypes调用libc的inotify接口"""
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify只在Linux上可用')
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'libc不支持inotify')
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1失败')
+        self._paths = {}
+        self.watched = set()
+
+    def add_watch(self, path: str) -> int:
+        """监视目录(不递归)，失败时抛出OSError(例如超出max_user_watches时为ENOSPC)"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+        self._paths[wd] = path
+        self.watched.add(path)
+        return wd
+
+    def read(self, timeout: float) -> List[tuple]:
+        """
+        读取事件
+
+        Args:
+            timeout: 没有事件时最多等待的秒数
+
+        Returns:
+            (所在目录, 文件名, 事件掩码)列表；队列溢出时文件名为None
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 1024 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_IGNORED:
+                    self.watched.discard(self._paths.pop(wd, None))
+                    continue
+                events.append((self._paths.get(wd), os.fsdecode(name) if name else None, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class AssetIndexer:
+    """投放目录索引器"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            subdirs TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            material_id TEXT,
+            error TEXT,
+            indexed_at TEXT NOT NULL
+        );
+    """
+
+    def __init__(self,
+                 repository,
+                 drop_dirs: Union[Iterable[str], Dict[str, Dict]],
+                 move_file: bool = True,
+                 settle_seconds: float = 2.0,
+                 batch_size: int = 200,
+                 workers: int = 4,
+                 poll_interval: float = 10.0,
+                 use_inotify: bool = True):
+        """
+        初始化索引器
+
+        Args:
+            repository: 素材仓库
+            drop_dirs: 投放目录列表，或 {目录: {'material_type', 'tags', 'category', 'metadata'}}，
+                未指定material_type时按扩展名判断
+            move_file: 是否把文件移动到仓库(为False时复制，源文件保留并记入检查点)
+            settle_seconds: 文件大小和修改时间保持不变多久后才视为写完
+            batch_size: 每批导入的最大文件数
+            workers: add_materials_bulk的并行线程数
+            poll_interval: 轮询模式的扫描间隔(秒)；inotify模式下也按此间隔补扫一次，覆盖丢失的事件
+            use_inotify: 是否尝试使用inotify
+        """
+        self.repository = repository
+        if not isinstance(drop_dirs, dict):
+            drop_dirs = {path: {} for path in drop_dirs}
+        self.drop_dirs = {os.path.abspath(path): options or {} for path, options in drop_dirs.items()}
+        self.move_file = move_file
+        self.settle_seconds = settle_seconds
+        self.batch_size = batch_size
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(
+            os.path.join(repository.base_dir, 'metadata', 'asset_indexer.db'),
+            timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+
+        # 等待写完的文件: 路径 -> [大小, 修改时间, 开始保持不变的时刻]
+        self._pending = {}
+        # 每个目录中尚未处理完的文件数；目录的检查点在其中文件全部处理完后才写入
+        self._dir_counts = collections.Counter()
+        self._dir_listings = {}
+
+        self._inotify = None
+        self._stop_event = threading.Event()
+        self._threads = []
+        # 累计计数，扫描线程和监视线程都会更新，读写都在self._lock内
+        self.stats = {'scanned_dirs': 0, 'skipped_dirs': 0, 'offered': 0, 'ingested': 0, 'failed': 0}
+
+    @property
+    def mode(self) -> str:
+        """当前的监视方式('inotify'或'polling')"""
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    def start(self):
+        """启动监视线程和导入线程"""
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify()
+            except OSError as e:
+                logger.warning(f"inotify不可用，改为轮询: {str(e)}")
+        self._stop_event.clear()
+        for target, name in ((self._watch_loop, 'amh-indexer-watch'), (self._ingest_loop, 'amh-indexer-ingest')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"资源索引器已启动({self.mode}): {list(self.drop_dirs)}")
+
+    def stop(self):
+        """停止后台线程并关闭检查点数据库(尚未导入的文件在下次启动时重新发现)"""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self.conn.close()
+
+    def run_once(self) -> Dict:
+        """
+        同步执行一轮：增量扫描全部投放目录，并导入已写完的文件
+
+        Returns:
+            本轮的 {'ingested', 'failed', 'pending'}
+        """
+        for root in self.drop_dirs:
+            self.scan(root)
+        ingested = failed = 0
+        while True:
+            batch = self._collect_ready(time.monotonic())
+            if not batch:
+                break
+            report = self._ingest(batch)
+            ingested += report['ingested']
+            failed += report['failed']
+        with self._lock:
+            pending = len(self._pending)
+        return {'ingested': ingested, 'failed': failed, 'pending': pending}
+
+    def _watch_loop(self):
+        """监视线程：首次增量扫描，之后处理inotify事件或定期轮询"""
+        next_scan = 0.0
+        while not self._stop_event.is_set():
+            try:
+                if time.monotonic() >= next_scan:
+                    for root in self.drop_dirs:
+                        self.scan(root)
+                    next_scan = time.monotonic() + self.poll_interval
+                if self._inotify is None:
+                    self._stop_event.wait(max(next_scan - time.monotonic(), 0))
+                    continue
+                for directory, name, mask in self._inotify.read(timeout=0.5):
+                    if mask & IN_Q_OVERFLOW:
+                        # 事件队列溢出(突发大量文件)，立即补扫
+                        logger.warning("inotify事件队列溢出，重新扫描投放目录")
+                        next_scan = 0.0
+                    elif directory is None or name is None:
+                        continue
+                    elif mask & IN_ISDIR:
+                        self.scan(os.path.join(directory, name))
+                    else:
+                        self._offer(os.path.join(directory, name))
+            except Exception as e:
+                logger.error(f"监视投放目录失败: {str(e)}")
+                self._stop_event.wait(1.0)
+
+    def _ingest_loop(self):
+        """导入线程：定期收集已写完的文件并分批导入，与事件读取互不阻塞"""
+        while not self._stop_event.is_set():
+            try:
+                batch = self._collect_ready(time.monotonic())
+                if batch:
+                    self._ingest(batch)
+                    continue
+            except Exception as e:
+                logger.error(f"导入投放文件失败: {str(e)}")
+            self._stop_event.wait(min(0.5, self.settle_seconds or 0.5))
+
+    def scan(self, root: str):
+        """
+        增量扫描目录树：修改时间与检查点相同的目录不重新列出，直接沿用记录的子目录
+
+        Args:
+            root: 目录路径
+        """
+        stack = [os.path.abspath(root)]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            with self._lock:
+                row = self.conn.execute('SELECT mtime_ns, subdirs FROM dirs WHERE path = ?', (directory,)).fetchone()
+                unchanged = row is not None and row[0] == mtime_ns
+                if unchanged:
+                    self.stats['skipped_dirs'] += 1
+            self._watch(directory)
+            if unchanged:
+                stack.extend(json.loads(row[1]))
+                continue
+
+            subdirs = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            self._offer(entry.path)
+            except OSError as e:
+                logger.warning(f"列出投放目录失败: {directory}, {str(e)}")
+                continue
+            with self._lock:
+                self.stats['scanned_dirs'] += 1
+                self._dir_listings[directory] = (mtime_ns, subdirs)
+                self._flush_dir(directory)
+            stack.extend(subdirs)
+
+    def _watch(self, directory: str):
+        """为目录添加inotify监视，超出系统限制时退回轮询"""
+        if self._inotify is None or directory in self._inotify.watched:
+            return
+        try:
+            self._inotify.add_watch(directory)
+        except OSError as e:
+            logger.warning(f"添加inotify监视失败，改为轮询: {directory}, {str(e)}")
+            self._inotify.close()
+            self._inotify = None
+
+    def _offer(self, path: str):
+        """发现文件：跳过临时文件和检查点中未变化的文件，其余进入等待写完的队列"""
+        name = os.path.basename(path)
+        if name.startswith('.') or name.lower().endswith(IGNORED_SUFFIXES):
+            return
+        if self._material_type(path) is None:
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            if path in self._pending:
+                return
+            row = self.conn.execute('SELECT size, mtime_ns FROM files WHERE path = ?', (path,)).fetchone()
+            if row is not None and row == (stat.st_size, stat.st_mtime_ns):
+                return
+            self._pending[path] = [stat.st_size, stat.st_mtime_ns, time.monotonic()]
+            self._dir_counts[os.path.dirname(path)] += 1
+            self.stats['offered'] += 1
+
+    def _resolve(self, path: str):
+        """文件处理完毕(导入、失败或消失)，目录中没有待处理文件时写入目录检查点"""
+        self._pending.pop(path, None)
+        directory = os.path.dirname(path)
+        self._dir_counts[directory] -= 1
+        if self._dir_counts[directory] <= 0:
+            del self._dir_counts[directory]
+            self._flush_dir(directory)
+
+    def _flush_dir(self, directory: str):
+        listing = self._dir_listings.get(directory)
+        if listing is None or self._dir_counts.get(directory):
+            return
+        del self._dir_listings[directory]
+        self.conn.execute(
+            'INSERT INTO dirs(path, mtime_ns, subdirs) VALUES(?, ?, ?) '
+            'ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns, subdirs = excluded.subdirs',
+            (directory, listing[0], json.dumps(listing[1], ensure_ascii=False))
+        )
+
+    def _collect_ready(self, now: float) -> List[Dict]:
+        """收集大小和修改时间已保持settle_seconds不变的文件，最多batch_size个"""
+        ready = []
+        with self._lock:
+            for path, state in list(self._pending.items()):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    self._resolve(path)
+                    continue
+                if (stat.st_size, stat.st_mtime_ns) != (state[0], state[1]):
+                    state[:] = [stat.st_size, stat.st_mtime_ns, now]
+                elif now - state[2] >= self.settle_seconds:
+                    ready.append({'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+                    if len(ready) >= self.batch_size:
+                        break
+        return ready
+
+    def _drop_dir(self, path: str) -> Optional[str]:
+        for root in self.drop_dirs:
+            if path.startswith(root + os.sep):
+                return root
+        return None
+
+    def _material_type(self, path: str) -> Optional[str]:
+        root = self._drop_dir(path)
+        configured = self.drop_dirs.get(root, {}).get('material_type') if root else None
+        return configured or EXTENSION_TYPES.get(os.path.splitext(path)[1].lower())
+
+    def _ingest(self, batch: List[Dict]) -> Dict:
+        """通过add_materials_bulk并行导入一批文件，并记录检查点"""
+        items = []
+        for entry in batch:
+            root = self._drop_dir(entry['path'])
+            options = self.drop_dirs.get(root, {})
+            metadata = dict(options.get('metadata') or {})
+            metadata.setdefault('source_path', entry['path'])
+            items.append({
+                'file_path': entry['path'],
+                'material_type': self._material_type(entry['path']),
+                'metadata': metadata,
+                'tags': list(options.get('tags') or []),
+                'category': options.get('category'),
+                'move_file': self.move_file
+            })
+
+        results = self.repository.add_materials_bulk(items, workers=self.workers)
+        now = datetime.datetime.now().isoformat()
+        report = {'ingested': 0, 'failed': 0}
+        with self._lock:
+            rows = []
+            for entry, result in zip(batch, results):
+                if result['error']:
+                    report['failed'] += 1
+                    logger.warning(f"导入投放文件失败: {entry['path']}, {result['error']}")
+                else:
+                    report['ingested'] += 1
+                # 移动模式下成功导入的文件已离开投放目录，不需要检查点
+                if result['error'] or not self.move_file:
+                    rows.append((entry['path'], entry['size'], entry['mtime_ns'],
+                                 result['material_id'], result['error'], now))
+            self.conn.executemany(
+                'INSERT INTO files(path, size, mtime_ns, material_id, error, indexed_at) VALUES(?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, '
+                'material_id = excluded.material_id, error = excluded.error, indexed_at = excluded.indexed_at',
+                rows
+            )
+            for entry in batch:
+                self._resolve(entry['path'])
+            self.stats['ingested'] += report['ingested']
+            self.stats['failed'] += report['failed']
+        logger.info(f"导入投放文件: 成功{report['ingested']}个, 失败{report['failed']}个")
+        return report
+
+    def get_status(self) -> Dict:
+        """
+        索引器状态
+
+        Returns:
+            监视方式、等待写完的文件数和累计计数
+        """
+        with self._lock:
+            return dict(self.stats, mode=self.mode, pending=len(self._pending))
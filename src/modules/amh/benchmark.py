@@ -0,0 +1,673 @@
+"""
+素材仓库性能基准
+用法: python -m src.modules.amh.benchmark [--count 10000] [--backend sqlite]
+      python -m src.modules.amh.benchmark --no-ingest --scale 10000 --scale 100000 --scale 1000000 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import uuid
+import argparse
+import platform
+import datetime
+import itertools
+import subprocess
+import logging
+from typing import Callable, Dict, Iterable, List
+
+from .ingest_strategy import StrategyUnavailable, copy_file, ingest_file
+from .material_repository import MaterialRepository
+from .storage_backend import create_backend
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _make_placeholder_files(directory: str, count: int, size: int = 64) -> List[str]:
+    """生成占位媒体文件(内容各不相同，避免被去重)"""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"clip_{i:07d}.mp4")
+        with open(path, 'wb') as f:
+            header = f"{i:016d}".encode()
+            f.write(header + b'\0' * max(size - len(header), 0))
+        paths.append(path)
+    return paths
+
+
+def _ingest(repo: MaterialRepository, paths: List[str], other_id: str = None):
+    """模拟导入一次爬取会话：添加素材、补充标签、设置分类并建立关联"""
+    previous = other_id
+    for i, path in enumerate(paths):
+        material_id = repo.add_material(
+            path, 'video',
+            {'source': 'benchmark', 'platform': ('douyin', 'tiktok', 'weibo')[i % 3]},
+            tags=[f"tag_{i % 50}"]
+        )
+        repo.update_material_tags(material_id, [f"topic_{i % 7}"])
+        repo.set_material_category(material_id, f"category_{i % 10}")
+        if previous:
+            repo.link_materials(material_id, previous)
+        previous = material_id
+
+
+def bench_bulk_ingest(count: int = 10000, backend: str = 'sqlite', batch: bool = True) -> Dict:
+    """
+    测量批量导入的耗时
+
+    Args:
+        count: 导入的素材数量
+        backend: 存储后端名称
+        batch: 是否在batch()中导入
+
+    Returns:
+        基准结果字典
+    """
+    work_dir = tempfile.mkdtemp(prefix='amh_bench_')
+    try:
+        paths = _make_placeholder_files(os.path.join(work_dir, 'incoming'), count)
+        repo = MaterialRepository(os.path.join(work_dir, 'repo'), backend=backend)
+        try:
+            start = time.perf_counter()
+            if batch:
+                with repo.batch():
+                    _ingest(repo, paths)
+            else:
+                _ingest(repo, paths)
+            elapsed = time.perf_counter() - start
+        finally:
+            repo.close()
+
+        return {
+            'benchmark': 'bulk_ingest',
+            'backend': backend,
+            'batch': batch,
+            'count': count,
+            'seconds': round(elapsed, 4),
+            'materials_per_second': round(count / elapsed, 1) if elapsed else None
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_parallel_ingest(count: int = 1000,
+                          file_size: int = 4 * 1024 * 1024,
+                          workers: int = 4,
+                          backend: str = 'sqlite') -> Dict:
+    """
+    测量add_materials_bulk的并行导入吞吐
+
+    Args:
+        count: 导入的文件数量
+        file_size: 单个文件大小(字节)
+        workers: 并行线程数
+        backend: 存储后端名称
+
+    Returns:
+        基准结果字典
+    """
+    work_dir = tempfile.mkdtemp(prefix='amh_bench_')
+    try:
+        paths = _make_placeholder_files(os.path.join(work_dir, 'incoming'), count, file_size)
+        repo = MaterialRepository(os.path.join(work_dir, 'repo'), backend=backend)
+        try:
+            items = [{'file_path': path, 'material_type': 'video', 'metadata': {}, 'move_file': False}
+                     for path in paths]
+            start = time.perf_counter()
+            results = repo.add_materials_bulk(items, workers=workers)
+            elapsed = time.perf_counter() - start
+        finally:
+            repo.close()
+
+        return {
+            'benchmark': 'parallel_ingest',
+            'backend': backend,
+            'workers': workers,
+            'count': count,
+            'file_size': file_size,
+            'failed': sum(1 for r in results if r['error']),
+            'seconds': round(elapsed, 4),
+            'megabytes_per_second': round(count * file_size / elapsed / 1024 / 1024, 1) if elapsed else None
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_ingest_strategies(file_size: int = 512 * 1024 * 1024,
+                            count: int = 3,
+                            work_dir: str = None) -> List[Dict]:
+    """
+    比较各导入策略在大文件上的耗时(包括计算内容哈希)
+
+    Args:
+        file_size: 单个文件大小(字节)
+        count: 每种策略导入的文件数量
+        work_dir: 工作目录，应与素材库位于同一文件系统(默认系统临时目录)
+
+    Returns:
+        每种策略一条基准结果，不可用的策略标记available为False
+    """
+    work_dir = tempfile.mkdtemp(prefix='amh_bench_', dir=work_dir)
+    try:
+        paths = _make_placeholder_files(os.path.join(work_dir, 'incoming'), count, file_size)
+        target_dir = os.path.join(work_dir, 'target')
+        os.makedirs(target_dir)
+
+        results = []
+        for strategy in ('reflink', 'hardlink', 'copy_file_range', 'sendfile', 'buffered', 'rename'):
+            start = time.perf_counter()
+            available = True
+            try:
+                for i, path in enumerate(paths):
+                    target = os.path.join(target_dir, f"{strategy}_{i}.mp4")
+                    if strategy == 'rename':
+                        ingest_file(path, target, move=True)
+                        # 移回原处供后续轮次使用(不计入下一策略的耗时)
+                        os.rename(target, path)
+                    else:
+                        copy_file(path, target, [strategy])
+            except StrategyUnavailable:
+                available = False
+            elapsed = time.perf_counter() - start
+            for name in os.listdir(target_dir):
+                os.remove(os.path.join(target_dir, name))
+
+            results.append({
+                'benchmark': 'ingest_strategy',
+                'strategy': strategy,
+                'available': available,
+                'count': count,
+                'file_size': file_size,
+                'seconds': round(elapsed, 4) if available else None,
+                'megabytes_per_second': round(count * file_size / elapsed / 1024 / 1024, 1)
+                if available and elapsed else None
+            })
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存(MB)，平台不支持时为None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _write_synthetic_index(repo_dir: str, count: int):
+    """直接通过存储后端写入合成素材索引(不生成媒体文件)"""
+    metadata_dir = os.path.join(repo_dir, 'metadata')
+    os.makedirs(metadata_dir, exist_ok=True)
+    now = datetime.datetime.now()
+    materials = {}
+    for i in range(count):
+        material_id = str(uuid.uuid4())
+        added_at = (now - datetime.timedelta(seconds=count - i)).isoformat()
+        materials[material_id] = {
+            'id': material_id,
+            'type': 'video',
+            'file_path': os.path.join(repo_dir, 'videos', f"{material_id}.mp4"),
+            'original_filename': f"clip_{i:07d}.mp4",
+            'content_hash': f"{i:064x}",
+            'file_size': 1024,
+            'added_at': added_at,
+            'last_accessed': added_at,
+            'metadata': {'title': f"素材{i}", 'platform': ('douyin', 'tiktok', 'weibo')[i % 3], 'duration': i % 600},
+            'tags': [f"tag_{i % 50}"],
+            'category': f"category_{i % 20}",
+            'related_materials': []
+        }
+    backend = create_backend('sqlite', metadata_dir)
+    try:
+        backend.replace_all({
+            'version': '1.0',
+            'created_at': now.isoformat(),
+            'last_updated': now.isoformat(),
+            'total_materials': count,
+            'secondary_indexes': {},
+            'layout': {'levels': 0, 'width': 2},
+            'categories': {f"category_{i}": {} for i in range(min(count, 20))},
+            'materials': materials
+        })
+    finally:
+        backend.close()
+    return next(iter(materials))
+
+
+def _startup_probe(repo_dir: str, material_id: str) -> Dict:
+    """在独立进程中打开素材库，测量启动耗时、首次查询耗时和峰值内存"""
+    start = time.perf_counter()
+    repo = MaterialRepository(repo_dir, access_flush_interval=None)
+    opened = time.perf_counter()
+    repo.get_material(material_id)
+    got = time.perf_counter()
+    _, total = repo.search_materials(tags=['tag_7'], limit=20)
+    searched = time.perf_counter()
+    result = {
+        'snapshot': repo._snapshot is not None,
+        'startup_seconds': round(opened - start, 4),
+        'first_get_seconds': round(got - opened, 4),
+        'first_search_seconds': round(searched - got, 4),
+        'search_total': total,
+        'peak_rss_mb': _peak_rss_mb()
+    }
+    # 关闭时写入快照，不计入测量
+    repo.close()
+    return result
+
+
+def _run_self(*args: str) -> Dict:
+    """在新进程中以模块方式运行本基准(用python -m执行时__name__为__main__，取模块的完整名称)"""
+    module = __spec__.name if __spec__ is not None else __name__
+    package = module.rsplit('.', 1)[0]
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), *([os.pardir] * package.count('.')), os.pardir))
+    output = subprocess.run(
+        [sys.executable, '-m', module, *args],
+        cwd=root, check=True, stdout=subprocess.PIPE
+    ).stdout
+    return json.loads(output)
+
+
+def _run_probe(repo_dir: str, material_id: str) -> Dict:
+    return _run_self('--startup-probe', repo_dir, material_id)
+
+
+def bench_startup(count: int = 100000, work_dir: str = None) -> Dict:
+    """
+    比较完整加载索引与从二进制快照启动的耗时和内存(各自在新进程中测量)
+
+    Args:
+        count: 合成素材数量
+        work_dir: 工作目录(默认系统临时目录)
+
+    Returns:
+        基准结果
+    """
+    work_dir = tempfile.mkdtemp(prefix='amh_bench_', dir=work_dir)
+    try:
+        start = time.perf_counter()
+        material_id = _write_synthetic_index(work_dir, count)
+        generate_seconds = time.perf_counter() - start
+
+        # 第一次启动没有快照(完整加载)，关闭时写入快照；第二次从快照启动
+        full = _run_probe(work_dir, material_id)
+        snapshot_path = os.path.join(work_dir, 'metadata', 'material_index.snapshot')
+        snapshot = _run_probe(work_dir, material_id)
+        return {
+            'benchmark': 'startup',
+            'count': count,
+            'generate_seconds': round(generate_seconds, 4),
+            'snapshot_bytes': os.path.getsize(snapshot_path),
+            'full_load': full,
+            'snapshot_load': snapshot,
+            'startup_speedup': round(full['startup_seconds'] / snapshot['startup_seconds'], 1)
+            if snapshot['startup_seconds'] else None
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# 规模基准的合成数据分布：标签和分类服从Zipf分布(少数热门、长尾)，其余字段按常见投放素材的比例
+SCALE_TAGS = 1000
+SCALE_CATEGORIES = 50
+SCALE_ZIPF_EXPONENT = 1.1
+SCALE_TYPES = (('video', 0.7), ('image', 0.25), ('audio', 0.05))
+SCALE_PLATFORMS = (('douyin', 0.5), ('tiktok', 0.3), ('weibo', 0.15), ('bilibili', 0.05))
+SCALE_RESOLUTIONS = ((1080, 1920), (720, 1280), (1920, 1080), (1080, 1080))
+SCALE_KEYWORDS = ('春节', '促销', '美妆', '开箱', '测评', '教程', '直播', '新品', '限时', '爆款',
+                  'vlog', 'unboxing', 'review', 'sale', 'tutorial', 'launch')
+
+
+def _cum_weights(weights: Iterable[float]) -> List[float]:
+    return list(itertools.accumulate(weights))
+
+
+def _synthetic_materials(repo_dir: str, count: int, seed: int = 0) -> Iterable[Dict]:
+    """
+    按固定种子生成合成素材记录(相同参数得到相同数据，文件不实际存在)
+
+    Args:
+        repo_dir: 素材库目录
+        count: 素材数量
+        seed: 随机种子
+
+    Returns:
+        素材记录迭代器
+    """
+    rng = random.Random(seed)
+    tag_weights = _cum_weights(1 / (k + 1) ** SCALE_ZIPF_EXPONENT for k in range(SCALE_TAGS))
+    category_weights = _cum_weights(1 / (k + 1) ** SCALE_ZIPF_EXPONENT for k in range(SCALE_CATEGORIES))
+    type_weights = _cum_weights(w for _, w in SCALE_TYPES)
+    platform_weights = _cum_weights(w for _, w in SCALE_PLATFORMS)
+    start = datetime.datetime(2024, 1, 1)
+
+    for i in range(count):
+        material_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        material_type = rng.choices(SCALE_TYPES, cum_weights=type_weights)[0][0]
+        added_at = (start + datetime.timedelta(seconds=i * 30)).isoformat()
+        width, height = rng.choice(SCALE_RESOLUTIONS)
+        tags = set(rng.choices(range(SCALE_TAGS), cum_weights=tag_weights, k=rng.randint(1, 5)))
+        title = ' '.join(rng.sample(SCALE_KEYWORDS, 3)) + f" {i}"
+        yield {
+            'id': material_id,
+            'type': material_type,
+            'file_path': os.path.join(repo_dir, f"{material_type}s", f"{material_id}.bin"),
+            'original_filename': f"clip_{i:07d}.bin",
+            'content_hash': f"{i:064x}",
+            'file_size': rng.randint(64, 4096),
+            'added_at': added_at,
+            'last_accessed': added_at,
+            'metadata': {
+                'title': title,
+                'platform': rng.choices(SCALE_PLATFORMS, cum_weights=platform_weights)[0][0],
+                'duration': round(rng.lognormvariate(3, 0.8), 2),
+                'width': width,
+                'height': height,
+                'likes': int(rng.paretovariate(1.2) * 100)
+            },
+            'tags': [f"tag_{k}" for k in sorted(tags)],
+            'category': f"category_{rng.choices(range(SCALE_CATEGORIES), cum_weights=category_weights)[0]}",
+            'related_materials': []
+        }
+
+
+def _populate(repo_dir: str, count: int, seed: int = 0, chunk_size: int = 10000) -> List[str]:
+    """
+    分块通过SQLite后端写入合成素材索引(内存占用与素材数量无关)
+
+    Returns:
+        写入的素材ID
+    """
+    metadata_dir = os.path.join(repo_dir, 'metadata')
+    os.makedirs(metadata_dir, exist_ok=True)
+    now = datetime.datetime.now().isoformat()
+    meta = {
+        'version': '1.0',
+        'created_at': now,
+        'last_updated': now,
+        'total_materials': count,
+        'secondary_indexes': {'duration': 'number'},
+        'layout': {'levels': 0, 'width': 2}
+    }
+    material_ids = []
+    backend = create_backend('sqlite', metadata_dir)
+    try:
+        backend.replace_all(dict(meta, categories={f"category_{k}": {} for k in range(SCALE_CATEGORIES)},
+                                 materials={}))
+        records = _synthetic_materials(repo_dir, count, seed)
+        while True:
+            chunk = {m['id']: m for m in itertools.islice(records, chunk_size)}
+            if not chunk:
+                break
+            backend.apply(dict(meta, materials=chunk), materials=list(chunk))
+            material_ids.extend(chunk)
+    finally:
+        backend.close()
+    return material_ids
+
+
+def _time_calls(fn: Callable, args: Iterable) -> Dict:
+    """
+    逐次调用并统计耗时
+
+    Returns:
+        {'ops', 'seconds', 'ops_per_second', 'first_ms'(首次调用，可能包含按需构建索引), 'p50_ms', 'p95_ms', 'max_ms',
+         'peak_rss_mb'(执行后的进程峰值内存)}
+    """
+    durations = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(*arg)
+        durations.append(time.perf_counter() - start)
+    if not durations:
+        return {'ops': 0}
+    total = sum(durations)
+    ordered = sorted(durations)
+    return {
+        'ops': len(durations),
+        'seconds': round(total, 4),
+        'ops_per_second': round(len(durations) / total, 1) if total else None,
+        'first_ms': round(durations[0] * 1000, 3),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p95_ms': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'peak_rss_mb': _peak_rss_mb()
+    }
+
+
+def _scale_probe(work_dir: str, seed: int, ops: int, adds: int, bulk: int) -> Dict:
+    """在独立进程中对已写入合成索引的素材库执行各项操作，返回耗时和峰值内存"""
+    repo_dir = os.path.join(work_dir, 'repo')
+    rng = random.Random(seed + 1)
+    results = {}
+    options = {'access_flush_interval': None, 'media_probe': False, 'gc': False}
+
+    start = time.perf_counter()
+    repo = MaterialRepository(repo_dir, **options)
+    results['open'] = {'seconds': round(time.perf_counter() - start, 4), 'snapshot': repo._snapshot is not None,
+                       'peak_rss_mb': _peak_rss_mb()}
+    try:
+        material_ids = sorted(repo.index['materials'].keys())
+        sample = lambda n: [(rng.choice(material_ids),) for _ in range(n)]
+        popular_tags = [f"tag_{k}" for k in range(20)]
+        tail_tags = [f"tag_{k}" for k in range(SCALE_TAGS // 2, SCALE_TAGS)]
+
+        results['get_material'] = _time_calls(repo.get_material, sample(ops))
+        results['search_tag'] = _time_calls(
+            lambda tag: repo.search_materials(tags=[tag], limit=20),
+            [(rng.choice(popular_tags if i % 2 else tail_tags),) for i in range(ops // 10)]
+        )
+        results['search_category'] = _time_calls(
+            lambda name: repo.search_materials(category=name, limit=20),
+            [(f"category_{rng.randrange(SCALE_CATEGORIES)}",) for _ in range(ops // 10)]
+        )
+        results['search_metadata'] = _time_calls(
+            lambda low: repo.search_materials(metadata_filters={'duration': {'$gte': low, '$lte': low + 5}}, limit=20),
+            [(rng.uniform(5, 60),) for _ in range(ops // 10)]
+        )
+        results['search_keyword'] = _time_calls(
+            lambda word: repo.search_materials(query=word, limit=20),
+            [(rng.choice(SCALE_KEYWORDS),) for _ in range(ops // 10)]
+        )
+        results['search_combined'] = _time_calls(
+            lambda tag, name: repo.search_materials(
+                tags=[tag], category=name, metadata_filters={'platform': 'douyin'}, limit=20
+            ),
+            [(rng.choice(popular_tags), f"category_{rng.randrange(5)}") for _ in range(ops // 10)]
+        )
+        results['get_statistics'] = _time_calls(repo.get_statistics, [()])
+        results['get_statistics_cached'] = _time_calls(repo.get_statistics, [()] * 10)
+
+        results['link_materials'] = _time_calls(
+            repo.link_materials, [(rng.choice(material_ids), rng.choice(material_ids), 'related')
+                                  for _ in range(ops // 10)]
+        )
+        paths = _make_placeholder_files(os.path.join(work_dir, 'incoming'), adds + bulk)
+        results['add_material'] = _time_calls(
+            lambda path: repo.add_material(path, 'video', {'source': 'benchmark'}, tags=['tag_0']),
+            [(path,) for path in paths[:adds]]
+        )
+        items = [{'file_path': path, 'material_type': 'video', 'metadata': {}} for path in paths[adds:]]
+        start = time.perf_counter()
+        repo.add_materials_bulk(items, workers=4)
+        elapsed = time.perf_counter() - start
+        results['bulk_ingest'] = {
+            'ops': len(items),
+            'seconds': round(elapsed, 4),
+            'ops_per_second': round(len(items) / elapsed, 1) if elapsed else None,
+            'peak_rss_mb': _peak_rss_mb()
+        }
+
+        export_path = os.path.join(work_dir, 'export.ndjson')
+        start = time.perf_counter()
+        repo.export_ndjson(export_path)
+        results['export_ndjson'] = {'seconds': round(time.perf_counter() - start, 4),
+                                    'bytes': os.path.getsize(export_path)}
+    finally:
+        repo.close()
+
+    imported = MaterialRepository(os.path.join(work_dir, 'imported'), **options)
+    try:
+        start = time.perf_counter()
+        report = imported.import_ndjson(export_path, merge_policy='replace')
+        results['import_ndjson'] = {'seconds': round(time.perf_counter() - start, 4),
+                                    'imported': report.get('imported')}
+    finally:
+        imported.close()
+
+    return {'operations': results, 'peak_rss_mb': _peak_rss_mb()}
+
+
+def _run_scale_probe(work_dir: str, seed: int, ops: int, adds: int, bulk: int) -> Dict:
+    return _run_self('--scale-probe', work_dir, str(seed), str(ops), str(adds), str(bulk))
+
+
+def bench_scale(count: int,
+                seed: int = 0,
+                ops: int = 10000,
+                adds: int = 500,
+                bulk: int = 5000,
+                work_dir: str = None) -> Dict:
+    """
+    在给定规模的合成素材库上测量各项操作(SQLite后端)
+
+    先分块写入合成索引，再分别在新进程中测量冷启动(完整加载和快照加载)与各项操作，
+    因此峰值内存(peak_rss_mb)只反映该规模下素材库本身的占用。
+
+    Args:
+        count: 素材数量
+        seed: 合成数据的随机种子
+        ops: get_material的调用次数，各类搜索和关联的次数为其1/10
+        adds: 逐条add_material的次数(每次单独提交)
+        bulk: add_materials_bulk导入的文件数
+        work_dir: 工作目录(默认系统临时目录)
+
+    Returns:
+        基准结果
+    """
+    work_dir = tempfile.mkdtemp(prefix='amh_bench_', dir=work_dir)
+    try:
+        start = time.perf_counter()
+        material_ids = _populate(os.path.join(work_dir, 'repo'), count, seed)
+        populate_seconds = time.perf_counter() - start
+
+        # 第一次启动完整加载，关闭时写入快照；第二次从快照启动
+        repo_dir = os.path.join(work_dir, 'repo')
+        full = _run_probe(repo_dir, material_ids[count // 2])
+        snapshot = _run_probe(repo_dir, material_ids[count // 2])
+        probe = _run_scale_probe(work_dir, seed, ops, adds, bulk)
+        return {
+            'benchmark': 'scale',
+            'backend': 'sqlite',
+            'count': count,
+            'seed': seed,
+            'populate_seconds': round(populate_seconds, 4),
+            'index_bytes': os.path.getsize(os.path.join(repo_dir, 'metadata', 'material_index.db')),
+            'cold_startup': {'full_load': full, 'snapshot_load': snapshot},
+            'operations': probe['operations'],
+            'peak_rss_mb': probe['peak_rss_mb']
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _environment() -> Dict:
+    """运行环境信息，便于对比不同版本的结果"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'generated_at': datetime.datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='素材仓库性能基准')
+    parser.add_argument('--count', type=int, default=10000, help='导入的素材数量')
+    parser.add_argument('--backend', action='append', choices=['sqlite', 'json'],
+                        help='存储后端(可重复指定)，默认同时测试sqlite和json')
+    parser.add_argument('--json-unbatched-count', type=int, default=1000,
+                        help='json后端逐条写入时的素材数量(每次写入重写整个索引，耗时随数量平方增长)')
+    parser.add_argument('--bulk-workers', type=int, action='append',
+                        help='测试add_materials_bulk并行导入的线程数(可重复指定)')
+    parser.add_argument('--bulk-count', type=int, default=200, help='并行导入的文件数量')
+    parser.add_argument('--bulk-file-size', type=int, default=4 * 1024 * 1024, help='并行导入的单个文件大小(字节)')
+    parser.add_argument('--strategy-file-size', type=int, default=0,
+                        help='比较导入策略时的单个文件大小(字节)，为0时不测试')
+    parser.add_argument('--strategy-dir', help='比较导入策略的工作目录(应与素材库位于同一文件系统)')
+    parser.add_argument('--startup-count', type=int, action='append',
+                        help='比较完整加载与快照启动时的素材数量(可重复指定)')
+    parser.add_argument('--no-ingest', action='store_true', help='不执行默认的逐条/批量导入对比')
+    parser.add_argument('--scale', type=int, action='append',
+                        help='在该规模的合成素材库上测量各项操作和峰值内存(可重复指定，例如10000、100000、1000000)')
+    parser.add_argument('--scale-ops', type=int, default=10000, help='规模基准中get_material的调用次数')
+    parser.add_argument('--scale-adds', type=int, default=500, help='规模基准中逐条add_material的次数')
+    parser.add_argument('--scale-bulk', type=int, default=5000, help='规模基准中add_materials_bulk导入的文件数')
+    parser.add_argument('--seed', type=int, default=0, help='合成数据的随机种子')
+    parser.add_argument('--output', help='将结果和运行环境写入JSON文件')
+    parser.add_argument('--startup-probe', nargs=2, metavar=('REPO_DIR', 'MATERIAL_ID'), help=argparse.SUPPRESS)
+    parser.add_argument('--scale-probe', nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.startup_probe:
+        print(json.dumps(_startup_probe(*args.startup_probe)))
+        return 0
+    if args.scale_probe:
+        work_dir, *numbers = args.scale_probe
+        print(json.dumps(_scale_probe(work_dir, *map(int, numbers))))
+        return 0
+
+    results = []
+    for backend in [] if args.no_ingest else args.backend or ['sqlite', 'json']:
+        for batch in (False, True):
+            count = args.count
+            if backend == 'json' and not batch:
+                count = min(count, args.json_unbatched_count)
+            results.append(bench_bulk_ingest(count, backend, batch))
+            print(json.dumps(results[-1], ensure_ascii=False), file=sys.stderr)
+
+    if args.strategy_file_size:
+        for result in bench_ingest_strategies(args.strategy_file_size, work_dir=args.strategy_dir):
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+
+    for count in args.startup_count or ():
+        results.append(bench_startup(count))
+        print(json.dumps(results[-1], ensure_ascii=False), file=sys.stderr)
+
+    for workers in args.bulk_workers or ():
+        results.append(bench_parallel_ingest(args.bulk_count, args.bulk_file_size, workers))
+        print(json.dumps(results[-1], ensure_ascii=False), file=sys.stderr)
+
+    for count in args.scale or ():
+        results.append(bench_scale(count, args.seed, args.scale_ops, args.scale_adds, args.scale_bulk))
+        print(json.dumps(results[-1], ensure_ascii=False), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'environment': _environment(), 'results': results}, f, ensure_ascii=False, indent=2)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+素材库维护命令行工具
+用法: python -m src.modules.amh.cli <命令> <素材库目录> [选项]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+
+from .material_repository import MaterialRepository
+from .asset_indexer import AssetIndexer
+from .scrubber import IntegrityScrubber
+from .index_stream import MERGE_POLICIES
+from .storage_backend import migrate_json_index
+
+logger = logging.getLogger(__name__)
+
+
+def cmd_migrate(args) -> int:
+    """将旧的material_index.json迁移到SQLite后端"""
+    metadata_dir = os.path.join(args.base_dir, 'metadata')
+    json_path = os.path.join(metadata_dir, 'material_index.json')
+    db_path = os.path.join(metadata_dir, 'material_index.db')
+
+    if os.path.exists(db_path) and not args.force:
+        print(f"索引数据库已存在: {db_path} (使用 --force 覆盖)")
+        return 1
+
+    count = migrate_json_index(json_path, db_path)
+    print(f"迁移完成: {count}个素材 -> {db_path}")
+    return 0
+
+
+def cmd_repair(args) -> int:
+    """检查并修复倒排索引、分类登记和素材总数"""
+    repo = MaterialRepository(args.base_dir, backend=args.backend)
+    try:
+        report = repo.check_indexes(repair=not args.check_only)
+    finally:
+        repo.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report['consistent'] or report['repaired'] else 1
+
+
+def cmd_dedup(args) -> int:
+    """为旧素材补算内容哈希并合并重复文件，或只输出去重报告"""
+    repo = MaterialRepository(args.base_dir, backend=args.backend)
+    try:
+        report = repo.get_dedup_report() if args.report_only else repo.deduplicate_existing()
+    finally:
+        repo.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def cmd_reshard(args) -> int:
+    """将素材文件迁移到新的分层目录布局，可在素材库运行时执行，中断后重新执行即可继续"""
+    repo = MaterialRepository(args.base_dir, backend=args.backend)
+    try:
+        report = repo.reshard(
+            {'levels': args.levels, 'width': args.width},
+            batch_size=args.batch_size,
+            progress_callback=lambda done, total: print(f"迁移进度: {done}/{total}", file=sys.stderr)
+        )
+    finally:
+        repo.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if not report['failed'] else 1
+
+
+def cmd_export(args) -> int:
+    """流式导出素材索引(NDJSON)"""
+    repo = MaterialRepository(args.base_dir, backend=args.backend)
+    try:
+        path = repo.export_ndjson(args.output)
+    finally:
+        repo.close()
+
+    print(f"导出完成: {path}")
+    return 0
+
+
+def cmd_import(args) -> int:
+    """流式导入素材索引(NDJSON)，中断后重新执行相同命令即可继续"""
+    repo = MaterialRepository(args.base_dir, backend=args.backend)
+    try:
+        report = repo.import_ndjson(
+            args.input, merge_policy=args.merge_policy, resume=not args.restart, batch_size=args.batch_size
+        )
+    finally:
+        repo.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report['complete'] else 1
+
+
+def cmd_watch(args) -> int:
+    """监视投放目录并导入新文件，--once时只扫描导入一轮"""
+    repo = MaterialRepository(args.base_dir, backend=args.backend)
+    indexer = AssetIndexer(
+        repo, args.drop_dirs, move_file=not args.copy, settle_seconds=args.settle,
+        batch_size=args.batch_size, workers=args.workers, poll_interval=args.poll_interval,
+        use_inotify=not args.poll
+    )
+    try:
+        if args.once:
+            print(json.dumps(indexer.run_once(), ensure_ascii=False, indent=2))
+            return 0
+        indexer.start()
+        while True:
+            time.sleep(60)
+            logger.info(f"资源索引器状态: {indexer.get_status()}")
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        indexer.stop()
+        repo.close()
+
+
+def cmd_scrub(args) -> int:
+    """从上次停止的位置继续巡检素材文件，输出修复队列"""
+    repo = MaterialRepository(args.base_dir, backend=args.backend)
+    scrubber = IntegrityScrubber(
+        repo, chunk_size=args.chunk_size, hash_sample_rate=args.hash_sample_rate,
+        max_bytes_per_second=args.max_mb_per_second * 1024 * 1024 if args.max_mb_per_second else None
+    )
+    try:
+        report = scrubber.run_once(max_chunks=args.max_chunks)
+        report['repairs'] = scrubber.get_repair_queue(limit=args.limit)
+    except KeyboardInterrupt:
+        report = scrubber.get_progress()
+    finally:
+        scrubber.close()
+        repo.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if not report.get('repairs') else 1
+
+
+def cmd_pack(args) -> int:
+    """将一组素材流式打包为ZIP/TAR(含清单)，中断后重新执行相同命令从断点续写"""
+    repo = MaterialRepository(args.base_dir, backend=args.backend)
+    search = {k: v for k, v in {'query': args.query, 'material_type': args.type, 'tags': args.tags}.items() if v}
+    try:
+        report = repo.export_archive(
+            args.output, fmt=args.format, material_ids=args.ids, category=args.category, search=search or None
+        )
+    finally:
+        repo.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def cmd_gc(args) -> int:
+    """回收恢复期已过的已删除素材文件，或恢复/列出已删除素材"""
+    repo = MaterialRepository(args.base_dir, backend=args.backend, gc={
+        'interval': None,
+        'max_files_per_second': args.max_files_per_second or None
+    })
+    try:
+        if args.undelete:
+            report = {mid: repo.undelete_material(mid) for mid in args.undelete}
+        elif args.list:
+            report = repo.get_deleted_materials(limit=args.limit)
+        else:
+            report = repo.gc.run_once(material_ids=args.ids)
+            report.update({k: v for k, v in repo.gc.get_metrics().items() if k in ('deleted', 'purging')})
+    finally:
+        repo.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if args.undelete and not all(report.values()) else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """构建命令行解析器"""
+    parser = argparse.ArgumentParser(description='素材库维护工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate = subparsers.add_parser('migrate', help='将JSON索引迁移到SQLite后端')
+    migrate.add_argument('base_dir', help='素材库目录')
+    migrate.add_argument('--force', action='store_true', help='覆盖已存在的索引数据库')
+    migrate.set_defaults(func=cmd_migrate)
+
+    repair = subparsers.add_parser('repair', help='检查并修复素材索引的一致性')
+    repair.add_argument('base_dir', help='素材库目录')
+    repair.add_argument('--backend', default='sqlite', choices=['sqlite', 'json'], help='存储后端')
+    repair.add_argument('--check-only', action='store_true', help='只检查不修复')
+    repair.set_defaults(func=cmd_repair)
+
+    dedup = subparsers.add_parser('dedup', help='按内容哈希合并重复的素材文件')
+    dedup.add_argument('base_dir', help='素材库目录')
+    dedup.add_argument('--backend', default='sqlite', choices=['sqlite', 'json'], help='存储后端')
+    dedup.add_argument('--report-only', action='store_true', help='只输出去重报告')
+    dedup.set_defaults(func=cmd_dedup)
+
+    reshard = subparsers.add_parser('reshard', help='将素材文件迁移到新的分层目录布局')
+    reshard.add_argument('base_dir', help='素材库目录')
+    reshard.add_argument('--backend', default='sqlite', choices=['sqlite', 'json'], help='存储后端')
+    reshard.add_argument('--levels', type=int, default=2, help='目录层数(0为平铺)')
+    reshard.add_argument('--width', type=int, default=2, help='每层使用的ID字符数')
+    reshard.add_argument('--batch-size', type=int, default=500, help='每批迁移的文件数')
+    reshard.set_defaults(func=cmd_reshard)
+
+    export = subparsers.add_parser('export', help='流式导出素材索引(NDJSON，.gz/.zst压缩)')
+    export.add_argument('base_dir', help='素材库目录')
+    export.add_argument('output', help='输出文件路径')
+    export.add_argument('--backend', default='sqlite', choices=['sqlite', 'json'], help='存储后端')
+    export.set_defaults(func=cmd_export)
+
+    import_ = subparsers.add_parser('import', help='流式导入素材索引(NDJSON，.gz/.zst压缩)')
+    import_.add_argument('base_dir', help='素材库目录')
+    import_.add_argument('input', help='输入文件路径')
+    import_.add_argument('--backend', default='sqlite', choices=['sqlite', 'json'], help='存储后端')
+    import_.add_argument('--merge-policy', default='skip', choices=list(MERGE_POLICIES),
+                         help='素材已存在时的处理方式')
+    import_.add_argument('--batch-size', type=int, default=1000, help='每批提交的记录数')
+    import_.add_argument('--restart', action='store_true', help='忽略上次中断的进度，从头导入')
+    import_.set_defaults(func=cmd_import)
+
+    watch = subparsers.add_parser('watch', help='监视投放目录并增量导入新文件')
+    watch.add_argument('base_dir', help='素材库目录')
+    watch.add_argument('drop_dirs', nargs='+', help='投放目录')
+    watch.add_argument('--backend', default='sqlite', choices=['sqlite', 'json'], help='存储后端')
+    watch.add_argument('--copy', action='store_true', help='复制文件而不是移动到素材库')
+    watch.add_argument('--settle', type=float, default=2.0, help='文件多久未变化后视为写完(秒)')
+    watch.add_argument('--batch-size', type=int, default=200, help='每批导入的文件数')
+    watch.add_argument('--workers', type=int, default=4, help='并行导入线程数')
+    watch.add_argument('--poll-interval', type=float, default=10.0, help='轮询或补扫间隔(秒)')
+    watch.add_argument('--poll', action='store_true', help='不使用inotify，只轮询')
+    watch.add_argument('--once', action='store_true', help='只扫描导入一轮后退出')
+    watch.set_defaults(func=cmd_watch)
+
+    scrub = subparsers.add_parser('scrub', help='巡检素材文件的完整性(可中断，重新执行从上次位置继续)')
+    scrub.add_argument('base_dir', help='素材库目录')
+    scrub.add_argument('--backend', default='sqlite', choices=['sqlite', 'json'], help='存储后端')
+    scrub.add_argument('--chunk-size', type=int, default=200, help='每块检查的素材数')
+    scrub.add_argument('--hash-sample-rate', type=float, default=1.0, help='校验内容哈希的素材比例(0-1)')
+    scrub.add_argument('--max-mb-per-second', type=float, default=32, help='读取速度上限(MB/s，0为不限)')
+    scrub.add_argument('--max-chunks', type=int, default=None, help='最多检查的块数，默认检查到本轮结束')
+    scrub.add_argument('--limit', type=int, default=100, help='输出的修复记录数')
+    scrub.set_defaults(func=cmd_scrub)
+
+    pack = subparsers.add_parser('pack', help='将搜索结果或分类打包为ZIP/TAR(含清单，可断点续写)')
+    pack.add_argument('base_dir', help='素材库目录')
+    pack.add_argument('output', help='输出文件路径(.zip或.tar)')
+    pack.add_argument('--backend', default='sqlite', choices=['sqlite', 'json'], help='存储后端')
+    pack.add_argument('--format', choices=['zip', 'tar'], default=None, help='归档格式，默认按扩展名')
+    pack.add_argument('--category', default=None, help='素材分类')
+    pack.add_argument('--query', default=None, help='搜索关键词')
+    pack.add_argument('--type', default=None, help='素材类型')
+    pack.add_argument('--tags', nargs='+', default=None, help='标签(与关系)')
+    pack.add_argument('--ids', nargs='+', default=None, help='素材ID，指定时忽略搜索条件')
+    pack.set_defaults(func=cmd_pack)
+
+    gc = subparsers.add_parser('gc', help='回收已删除素材的文件(只处理恢复期已过的墓碑)')
+    gc.add_argument('base_dir', help='素材库目录')
+    gc.add_argument('--backend', default='sqlite', choices=['sqlite', 'json'], help='存储后端')
+    gc.add_argument('--max-files-per-second', type=float, default=100, help='每秒删除的文件数上限(0为不限)')
+    gc.add_argument('--ids', nargs='+', default=None, help='立即回收这些已删除素材(不论是否到期)')
+    gc.add_argument('--list', action='store_true', help='列出已删除素材，不执行回收')
+    gc.add_argument('--limit', type=int, default=100, help='--list输出的条数')
+    gc.add_argument('--undelete', nargs='+', default=None, help='恢复这些已删除素材')
+    gc.set_defaults(func=cmd_gc)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO)
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+素材文件的内容哈希
+导入时边复制边计算哈希，不需要再单独读一遍文件
+"""
+import os
+import shutil
+import hashlib
+import logging
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+# 内容哈希算法
+HASH_ALGORITHM = 'sha256'
+
+# 读写缓冲区大小
+CHUNK_SIZE = 1024 * 1024
+
+
+def new_hasher():
+    """创建内容哈希对象"""
+    return hashlib.new(HASH_ALGORITHM)
+
+
+def hash_file(path: str) -> Tuple[str, int]:
+    """
+    计算文件的内容哈希
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        (十六进制哈希, 文件大小)
+    """
+    hasher = new_hasher()
+    size = 0
+    with open(path, 'rb') as f:
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hasher.update(view[:n])
+            size += n
+    return hasher.hexdigest(), size
+
+
+def copy_with_hash(src: str, dst: str) -> Tuple[str, int]:
+    """
+    复制文件并同时计算内容哈希(单次读取)，保留文件的访问和修改时间
+
+    Args:
+        src: 源文件路径
+        dst: 目标文件路径
+
+    Returns:
+        (十六进制哈希, 文件大小)
+    """
+    hasher = new_hasher()
+    size = 0
+    try:
+        with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            while True:
+                n = fin.readinto(buffer)
+                if not n:
+                    break
+                hasher.update(view[:n])
+                fout.write(view[:n])
+                size += n
+        shutil.copystat(src, dst)
+    except BaseException:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+    return hasher.hexdigest(), size
+
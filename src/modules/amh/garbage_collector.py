@@ -0,0 +1,226 @@
+"""
+墓碑垃圾回收
+删除素材时只留下墓碑，恢复期过后由本模块分批删除文件并清理墓碑；删除文件时限速。
+每批分三步提交：在写锁内把墓碑标记为回收中并确定是否删除文件 -> 锁外删除文件 -> 在写锁内删除墓碑，
+中途崩溃后下一轮从标记为回收中的墓碑继续(删除文件是幂等的)
+"""
+import os
+import logging
+import datetime
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .scrubber import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class GarbageCollector:
+    """墓碑垃圾回收器，由MaterialRepository按gc参数创建"""
+
+    def __init__(self,
+                 repository,
+                 interval: Optional[float] = 600.0,
+                 batch_size: int = 200,
+                 max_files_per_second: Optional[float] = 100,
+                 max_bytes_per_second: Optional[float] = None):
+        """
+        初始化垃圾回收器
+
+        Args:
+            repository: 素材仓库
+            interval: 后台回收间隔(秒)，为None或不大于0时不启动后台线程，由调用方执行run_once()
+            batch_size: 每批回收的墓碑数(每批两次写入索引)
+            max_files_per_second: 每秒删除的文件数上限，None表示不限
+            max_bytes_per_second: 每秒删除的文件总大小上限(部分文件系统删除大文件的开销与大小成正比)，
+                None表示不限
+        """
+        self.repository = repository
+        self.interval = interval
+        self.batch_size = batch_size
+        self._file_limiter = RateLimiter(max_files_per_second)
+        self._byte_limiter = RateLimiter(max_bytes_per_second)
+
+        # 同一进程内同时只执行一轮回收；跨进程由各批的写锁保证一致
+        self._run_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._counters = {
+            'passes': 0,
+            'purged': 0,
+            'unlinked': 0,
+            'kept_shared': 0,
+            'bytes_freed': 0,
+            'failed': 0
+        }
+        self._counters_lock = threading.Lock()
+
+        self._thread = None
+        if interval and interval > 0:
+            self._thread = threading.Thread(target=self._run, name='amh-gc', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """停止后台线程(正在回收的批次保持回收中状态，下一轮继续)"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _count(self, name: str, value: int = 1):
+        with self._counters_lock:
+            self._counters[name] += value
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"垃圾回收失败: {str(e)}")
+
+    def run_once(self, material_ids: Iterable[str] = None, now: datetime.datetime = None) -> Dict:
+        """
+        执行一轮回收，处理全部到期的墓碑
+
+        Args:
+            material_ids: 只回收这些墓碑(不论是否到期)，None表示全部到期的墓碑
+            now: 判断是否到期的时间，默认为当前时间
+
+        Returns:
+            {'purged': 清理的墓碑数, 'unlinked': 删除的文件数, 'bytes_freed': 释放的字节数,
+             'kept_shared': 因仍被引用而保留的文件数, 'failed': 删除失败(下一轮重试)的文件数}
+        """
+        now = (now or datetime.datetime.now()).isoformat()
+        only = set(material_ids) if material_ids is not None else None
+        report = {'purged': 0, 'unlinked': 0, 'bytes_freed': 0, 'kept_shared': 0, 'failed': 0}
+        with self._run_lock:
+            # 删除失败的墓碑本轮不再重试
+            tried = set()
+            while not self._stop_event.is_set():
+                claimed = self._claim(now, only, tried)
+                if not claimed:
+                    break
+                tried.update(material_id for material_id, _, _ in claimed)
+
+                done = []
+                for material_id, file_path, purge_file in claimed:
+                    if self._stop_event.is_set():
+                        break
+                    if not purge_file:
+                        report['kept_shared'] += 1
+                    else:
+                        try:
+                            freed = self._unlink(file_path)
+                        except OSError as e:
+                            logger.error(f"删除素材文件失败: {file_path}, {str(e)}")
+                            report['failed'] += 1
+                            continue
+                        if freed is not None:
+                            report['unlinked'] += 1
+                            report['bytes_freed'] += freed
+                    done.append(material_id)
+
+                if not self._finish(done):
+                    break
+                report['purged'] += len(done)
+
+        for name, value in report.items():
+            self._count(name, value)
+        self._count('passes')
+        if report['purged'] or report['failed']:
+            logger.info(f"垃圾回收完成: {report}")
+        return report
+
+    def _claim(self, now: str, only: Optional[set], tried: set) -> List[Tuple[str, str, bool]]:
+        """
+        在写锁内领取一批墓碑并标记为回收中，同时确定是否删除文件
+
+        仍被现有素材或未到期的墓碑引用的文件保留；上次中断的墓碑沿用当时的决定。
+
+        Returns:
+            [(素材ID, 文件路径, 是否删除文件)]
+        """
+        repo = self.repository
+        with repo._write_lock():
+            tombstones = repo.index['tombstones']
+            candidates = [
+                material_id for material_id, tombstone in tombstones.items()
+                if material_id not in tried
+                and (material_id in only if only is not None
+                     else tombstone['state'] == 'purging' or tombstone['purge_after'] <= now)
+            ]
+            if not candidates:
+                return []
+            # 先继续上次中断的回收
+            candidates.sort(key=lambda mid: (tombstones[mid]['state'] != 'purging', tombstones[mid]['purge_after']))
+            batch = candidates[:self.batch_size]
+
+            claimed = set(batch)
+            repo._journal(tombstones=batch)
+            for material_id in batch:
+                tombstone = tombstones[material_id]
+                if tombstone['state'] == 'purging':
+                    continue
+                material = tombstone['material']
+                shared = ((repo._file_references(material) - {material_id})
+                          | (repo._tombstone_references(material['file_path']) - claimed))
+                tombstone['state'] = 'purging'
+                tombstone['purge_file'] = tombstone.get('delete_file', True) and not shared
+            if not repo._persist(tombstones=batch):
+                raise IOError("保存墓碑状态失败")
+            return [
+                (material_id, tombstones[material_id]['material']['file_path'], tombstones[material_id]['purge_file'])
+                for material_id in batch
+            ]
+
+    def _unlink(self, file_path: str) -> Optional[int]:
+        """
+        限速删除文件
+
+        Returns:
+            释放的字节数(文件还有其他硬链接时只删除了这一个路径，为0)；文件已不存在时返回None
+        """
+        try:
+            stat = os.lstat(file_path)
+        except FileNotFoundError:
+            return None
+        self._file_limiter.consume(1, self._stop_event)
+        self._byte_limiter.consume(stat.st_size, self._stop_event)
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size if stat.st_nlink == 1 else 0
+
+    def _finish(self, material_ids: List[str]) -> bool:
+        """在写锁内删除已回收的墓碑"""
+        if not material_ids:
+            return True
+        repo = self.repository
+        with repo._write_lock():
+            material_ids = [mid for mid in material_ids if mid in repo.index['tombstones']]
+            repo._journal(tombstones=material_ids)
+            for material_id in material_ids:
+                del repo.index['tombstones'][material_id]
+            if not repo._persist(deleted_tombstones=material_ids):
+                logger.error("删除墓碑失败，下一轮重试")
+                return False
+        return True
+
+    def get_metrics(self) -> Dict:
+        """
+        垃圾回收指标
+
+        Returns:
+            累计的回收轮数、清理的墓碑数、删除/保留/失败的文件数和释放的字节数，
+            以及当前可恢复(deleted)、已到期(expired)和回收中(purging)的墓碑数
+        """
+        with self._counters_lock:
+            metrics = dict(self._counters)
+        now = datetime.datetime.now().isoformat()
+        repo = self.repository
+        with repo._lock:
+            tombstones = list(repo.index['tombstones'].values())
+        metrics['deleted'] = sum(1 for t in tombstones if t['state'] == 'deleted')
+        metrics['expired'] = sum(1 for t in tombstones if t['state'] == 'deleted' and t['purge_after'] <= now)
+        metrics['purging'] = sum(1 for t in tombstones if t['state'] == 'purging')
+        return metrics
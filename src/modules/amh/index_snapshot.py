@@ -0,0 +1,383 @@
+"""
+素材索引的二进制快照
+固定字段按列存储(类型/分类为字符串表编号，标签为编号数组，时间为float64)，
+完整记录以JSON块存放并按需解码；文件通过mmap映射，启动时无需解析全部素材
+"""
+import os
+import json
+import mmap
+import array
+import struct
+import logging
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .secondary_index import MISSING, coerce_value
+
+logger = logging.getLogger(__name__)
+
+# 文件头: 魔数 + header长度
+MAGIC = b'AMHSNAP1'
+_PREFIX = struct.Struct('<8sQ')
+
+# 列定义: 名称 -> array类型码
+_COLUMNS = {
+    'id_offsets': 'Q',
+    'id_order': 'I',
+    'type': 'I',
+    'category': 'i',
+    'tag_offsets': 'Q',
+    'tag_codes': 'I',
+    'added_at': 'd',
+    'last_accessed': 'd',
+    'record_offsets': 'Q',
+}
+
+# 内容哈希列的每项字节数(SHA-256)
+_HASH_SIZE = 32
+
+_ABSENT = object()
+
+
+class _Interner:
+    """字符串表，字符串 -> 编号"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _timestamp(value: Any) -> float:
+    """ISO时间转换为时间戳，无效时为NaN"""
+    value = coerce_value(value, 'datetime')
+    return float('nan') if value is MISSING else value
+
+
+def write_snapshot(path: str, index: Dict) -> int:
+    """
+    将素材索引写为二进制快照(先写临时文件再替换)
+
+    Args:
+        path: 快照文件路径
+        index: 素材索引(包含元信息、categories和materials；tombstones不写入快照)
+
+    Returns:
+        写入的素材数量
+    """
+    types, categories, tags = _Interner(), _Interner(), _Interner()
+    columns = {name: array.array(code) for name, code in _COLUMNS.items()}
+    ids = bytearray()
+    hashes = bytearray()
+    records = bytearray()
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    columns['id_offsets'].append(0)
+    columns['tag_offsets'].append(0)
+    columns['record_offsets'].append(0)
+    id_list = []
+    materials = index['materials']
+    # 以快照为底的素材映射只读遍历，避免把全部记录解码进内存
+    for material in (materials.scan() if hasattr(materials, 'scan') else materials.values()):
+        material_id = material['id']
+        id_list.append(material_id)
+        ids += material_id.encode('utf-8')
+        columns['id_offsets'].append(len(ids))
+        columns['type'].append(types.code(material.get('type') or ''))
+        category = material.get('category')
+        columns['category'].append(categories.code(category) if category else -1)
+        columns['tag_codes'].extend(tags.code(tag) for tag in material.get('tags') or ())
+        columns['tag_offsets'].append(len(columns['tag_codes']))
+        columns['added_at'].append(_timestamp(material.get('added_at')))
+        columns['last_accessed'].append(_timestamp(material.get('last_accessed')))
+        content_hash = bytes.fromhex(material['content_hash']) if material.get('content_hash') else bytes(_HASH_SIZE)
+        if len(content_hash) != _HASH_SIZE:
+            raise ValueError(f"内容哈希长度不是{_HASH_SIZE}字节: {material_id}")
+        hashes += content_hash
+        records += encode(material).encode('utf-8')
+        columns['record_offsets'].append(len(records))
+
+    # 按ID排序的行号，用于二分查找
+    columns['id_order'].extend(sorted(range(len(id_list)), key=id_list.__getitem__))
+
+    sections = [(name, columns[name].tobytes(), columns[name].typecode) for name in _COLUMNS]
+    sections += [('ids', bytes(ids), None), ('content_hash', bytes(hashes), None), ('records', bytes(records), None)]
+
+    # 墓碑各带一份完整的素材记录，数量不受限制，不放进启动时整体解析的header(由存储后端单独加载)
+    header = {
+        'meta': {k: v for k, v in index.items() if k not in ('materials', 'categories', 'tombstones')},
+        'categories': index['categories'],
+        'count': len(id_list),
+        'types': types.values,
+        'category_names': categories.values,
+        'tags': tags.values,
+        'sections': {}
+    }
+    # 先确定header长度再计算各段偏移(8字节对齐)
+    offset = 0
+    layout = []
+    for name, data, typecode in sections:
+        offset = (offset + 7) & ~7
+        layout.append((name, offset, data))
+        header['sections'][name] = [offset, len(data), typecode]
+        offset += len(data)
+    header_bytes = encode(header).encode('utf-8')
+    base = (_PREFIX.size + len(header_bytes) + 7) & ~7
+
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            for name, section_offset, data in layout:
+                f.seek(base + section_offset)
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(id_list)
+
+
+class IndexSnapshot:
+    """只读的内存映射快照"""
+
+    def __init__(self, path: str):
+        """
+        打开快照
+
+        Args:
+            path: 快照文件路径
+
+        Raises:
+            ValueError: 文件不是有效的快照
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"快照文件为空: {path}")
+
+        magic, header_len = _PREFIX.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"不是素材索引快照: {path}")
+        header = json.loads(self._mmap[_PREFIX.size:_PREFIX.size + header_len].decode('utf-8'))
+        base = (_PREFIX.size + header_len + 7) & ~7
+
+        self.meta = header['meta']
+        self.categories = header['categories']
+        self.count = header['count']
+        self._types = header['types']
+        self._category_names = header['category_names']
+        self._tags = header['tags']
+
+        view = memoryview(self._mmap)
+        self._views = {}
+        for name, (offset, length, typecode) in header['sections'].items():
+            section = view[base + offset:base + offset + length]
+            self._views[name] = section.cast(typecode) if typecode else section
+        self._view = view
+
+    def close(self):
+        """释放映射(之后不能再解码记录)"""
+        for section in getattr(self, '_views', {}).values():
+            section.release()
+        self._views = {}
+        if getattr(self, '_view', None) is not None:
+            self._view.release()
+            self._view = None
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def id_at(self, row: int) -> str:
+        """行号对应的素材ID"""
+        offsets = self._views['id_offsets']
+        return bytes(self._views['ids'][offsets[row]:offsets[row + 1]]).decode('utf-8')
+
+    def copy_ids(self) -> Callable[[], List[str]]:
+        """
+        复制ID数据段(只做内存拷贝，可在持有锁时调用)
+
+        Returns:
+            按ID排序解码全部素材ID的函数，不依赖映射，快照关闭后仍可调用
+        """
+        ids = self._views['ids'].tobytes()
+        offsets = array.array(_COLUMNS['id_offsets'], self._views['id_offsets'].tobytes())
+        order = array.array(_COLUMNS['id_order'], self._views['id_order'].tobytes())
+
+        def decode() -> List[str]:
+            return [ids[offsets[row]:offsets[row + 1]].decode('utf-8') for row in order]
+        return decode
+
+    def row_of(self, material_id: str) -> Optional[int]:
+        """二分查找素材ID所在的行号，不存在时返回None"""
+        order = self._views['id_order']
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.id_at(order[mid]) < material_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.id_at(order[lo]) == material_id:
+            return order[lo]
+        return None
+
+    def record(self, row: int) -> Dict:
+        """解码一行的完整素材记录"""
+        offsets = self._views['record_offsets']
+        return json.loads(bytes(self._views['records'][offsets[row]:offsets[row + 1]]).decode('utf-8'))
+
+    def index_fields(self, row: int, material_id: str = None) -> Dict:
+        """
+        只用列数据构造建立倒排/有序索引所需的字段，不解码完整记录
+
+        Returns:
+            包含id、type、category、tags、content_hash、added_at、last_accessed(时间戳)的字典
+        """
+        views = self._views
+        category = views['category'][row]
+        tag_offsets = views['tag_offsets']
+        content_hash = bytes(views['content_hash'][row * _HASH_SIZE:(row + 1) * _HASH_SIZE])
+        fields = {
+            'id': material_id or self.id_at(row),
+            'type': self._types[views['type'][row]],
+            'category': self._category_names[category] if category >= 0 else None,
+            'tags': [self._tags[code] for code in views['tag_codes'][tag_offsets[row]:tag_offsets[row + 1]]],
+            'content_hash': content_hash.hex() if any(content_hash) else None,
+        }
+        for name in ('added_at', 'last_accessed'):
+            value = views[name][row]
+            if value == value:
+                fields[name] = value
+        return fields
+
+
+class LazyMaterialMap(MutableMapping):
+    """
+    以快照为底的素材映射：读取时按需解码并缓存，修改记在内存中
+
+    迭代顺序为快照中的顺序，其后是快照之后新增的素材。
+    """
+
+    def __init__(self, snapshot: IndexSnapshot):
+        self.snapshot = snapshot
+        self._loaded = {}
+        self._removed = set()
+        # 快照之后新增的素材ID(保持插入顺序)
+        self._extra = {}
+        self._length = snapshot.count
+
+    def _in_base(self, material_id: str) -> bool:
+        return material_id not in self._removed and self.snapshot.row_of(material_id) is not None
+
+    def __getitem__(self, material_id: str) -> Dict:
+        material = self._loaded.get(material_id)
+        if material is not None:
+            return material
+        if material_id in self._removed:
+            raise KeyError(material_id)
+        row = self.snapshot.row_of(material_id)
+        if row is None:
+            raise KeyError(material_id)
+        material = self._loaded[material_id] = self.snapshot.record(row)
+        return material
+
+    def __contains__(self, material_id) -> bool:
+        return material_id in self._loaded or self._in_base(material_id)
+
+    def peek(self, material_id: str) -> Optional[Dict]:
+        """只读获取记录，未加载的记录解码后不缓存(用于全量遍历的分块读取)"""
+        material = self._loaded.get(material_id)
+        if material is not None or not self._in_base(material_id):
+            return material
+        return self.snapshot.record(self.snapshot.row_of(material_id))
+
+    def copy_ids(self) -> Callable[[], List[str]]:
+        """
+        复制当前的素材ID集合：锁内只做内存拷贝和增删集合的复制，逐个解码在锁外进行
+
+        Returns:
+            返回按ID排序的素材ID列表的函数
+        """
+        decode_base = self.snapshot.copy_ids()
+        removed = set(self._removed)
+        extra = list(self._extra)
+
+        def decode() -> List[str]:
+            material_ids = [material_id for material_id in decode_base() if material_id not in removed]
+            if extra:
+                material_ids.extend(extra)
+                material_ids.sort()
+            return material_ids
+        return decode
+
+    def __setitem__(self, material_id: str, material: Dict):
+        if material_id not in self:
+            self._length += 1
+            if self.snapshot.row_of(material_id) is None:
+                self._extra[material_id] = None
+        self._loaded[material_id] = material
+        self._removed.discard(material_id)
+
+    def __delitem__(self, material_id: str):
+        if material_id not in self:
+            raise KeyError(material_id)
+        self._loaded.pop(material_id, None)
+        if self._extra.pop(material_id, _ABSENT) is _ABSENT:
+            self._removed.add(material_id)
+        self._length -= 1
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[str]:
+        snapshot = self.snapshot
+        removed = self._removed
+        for row in range(snapshot.count):
+            material_id = snapshot.id_at(row)
+            if material_id not in removed:
+                yield material_id
+        yield from list(self._extra)
+
+    def scan(self) -> Iterator[Dict]:
+        """只读遍历全部记录，未加载的记录解码后不缓存"""
+        snapshot = self.snapshot
+        for row in range(snapshot.count):
+            material_id = snapshot.id_at(row)
+            if material_id in self._removed:
+                continue
+            material = self._loaded.get(material_id)
+            yield material if material is not None else snapshot.record(row)
+        for material_id in list(self._extra):
+            yield self._loaded[material_id]
+
+    def index_fields(self) -> Iterator[Dict]:
+        """遍历建立倒排/有序索引所需的字段，未修改的记录直接取自列数据"""
+        snapshot = self.snapshot
+        for row in range(snapshot.count):
+            material_id = snapshot.id_at(row)
+            if material_id in self._removed:
+                continue
+            material = self._loaded.get(material_id)
+            yield material if material is not None else snapshot.index_fields(row, material_id)
+        for material_id in list(self._extra):
+            yield self._loaded[material_id]
+
+    def loaded_count(self) -> int:
+        """已解码的记录数量"""
+        return len(self._loaded)
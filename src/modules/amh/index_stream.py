@@ -0,0 +1,146 @@
+"""
+素材索引的流式NDJSON格式
+每行一条记录：首行为header，其后是分类记录和素材记录，末行为end；
+支持gzip和zstd(需要安装zstandard)压缩
+"""
+import io
+import os
+import gzip
+import json
+import logging
+from typing import Dict, Iterable, Iterator, Optional, TextIO, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 格式名称和版本
+STREAM_FORMAT = 'amh-index-ndjson'
+STREAM_VERSION = 1
+
+# 素材合并策略
+MERGE_POLICIES = ('skip', 'overwrite', 'newer', 'replace')
+
+
+def detect_compression(path: str, compression: Optional[str] = 'auto') -> Optional[str]:
+    """
+    确定压缩格式
+
+    Args:
+        path: 文件路径
+        compression: 'auto'(按扩展名 .gz/.zst 判断)、'gzip'、'zstd' 或 None
+
+    Returns:
+        'gzip'、'zstd' 或 None
+    """
+    if compression == 'auto':
+        if path.endswith('.gz'):
+            return 'gzip'
+        if path.endswith('.zst'):
+            return 'zstd'
+        return None
+    if compression not in (None, 'gzip', 'zstd'):
+        raise ValueError(f"不支持的压缩格式: {compression}")
+    return compression
+
+
+def is_stream_path(path: str) -> bool:
+    """文件名是否为NDJSON索引流(.ndjson，可带压缩扩展名)"""
+    for ext in ('.gz', '.zst'):
+        if path.endswith(ext):
+            path = path[:-len(ext)]
+    return path.endswith('.ndjson')
+
+
+def open_stream(path: str, mode: str = 'r', compression: Optional[str] = 'auto') -> TextIO:
+    """
+    以文本方式打开(可能压缩的)索引流
+
+    Args:
+        path: 文件路径
+        mode: 'r' 或 'w'
+        compression: 见detect_compression
+
+    Returns:
+        UTF-8文本流
+    """
+    compression = detect_compression(path, compression)
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=6)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd压缩需要安装zstandard")
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            binary = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        else:
+            binary = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(binary, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def write_stream(f: TextIO,
+                 meta: Dict,
+                 categories: Iterable[Tuple[str, Dict]],
+                 materials: Iterable[Dict]) -> int:
+    """
+    写出索引流
+
+    Args:
+        f: 文本流
+        meta: 索引元信息(版本、创建时间等)
+        categories: (分类名称, 分类属性)
+        materials: 素材记录
+
+    Returns:
+        写出的素材数量
+    """
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    f.write(dumps({'record': 'header', 'format': STREAM_FORMAT, 'version': STREAM_VERSION, 'meta': meta}))
+    f.write('\n')
+    for name, info in categories:
+        f.write(dumps({'record': 'category', 'name': name, 'data': info}))
+        f.write('\n')
+    count = 0
+    for material in materials:
+        f.write(dumps({'record': 'material', 'data': material}))
+        f.write('\n')
+        count += 1
+    f.write(dumps({'record': 'end', 'materials': count}))
+    f.write('\n')
+    return count
+
+
+def read_stream(f: TextIO) -> Iterator[Tuple[int, Dict]]:
+    """
+    逐行读取索引流
+
+    Args:
+        f: 文本流
+
+    Returns:
+        (行号(从1开始), 记录)迭代器；首条记录必须是header
+
+    Raises:
+        ValueError: 格式不正确
+    """
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"索引流第{line_no}行不是有效的JSON: {str(e)}")
+        if line_no == 1 and (record.get('record') != 'header' or record.get('format') != STREAM_FORMAT):
+            raise ValueError("不是素材索引流(缺少header)")
+        yield line_no, record
+
+
+def stream_fingerprint(path: str) -> Dict:
+    """用于断点续传时确认输入文件未变化的指纹"""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
@@ -0,0 +1,171 @@
+"""
+素材文件导入策略
+按代价从低到高依次尝试：同文件系统重命名、reflink(写时复制克隆)、
+内核态复制(copy_file_range/sendfile)，最后才是用户态缓冲复制；
+硬链接与源文件共享inode，两边的原地修改会互相影响，只在显式指定时使用
+"""
+import os
+import errno
+import shutil
+import logging
+from typing import Dict, Iterable, Tuple
+
+from .content_hash import CHUNK_SIZE, copy_with_hash, hash_file
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Linux的FICLONE ioctl(btrfs、xfs等支持写时复制的文件系统)
+FICLONE = 0x40049409
+
+# 复制时默认依次尝试的策略(不含hardlink：源文件被原地修改会改变仓库内的文件及其内容哈希)
+DEFAULT_COPY_STRATEGIES = ('reflink', 'copy_file_range', 'sendfile', 'buffered')
+
+# 内核态复制单次调用的最大字节数
+_KERNEL_COPY_CHUNK = 64 * CHUNK_SIZE
+
+
+class StrategyUnavailable(Exception):
+    """导入策略在当前平台或文件系统上不可用"""
+    pass
+
+
+def _reflink(src: str, dst: str):
+    """写时复制克隆，数据块与源文件共享，修改任一方不影响另一方"""
+    if fcntl is None or not hasattr(fcntl, 'ioctl'):
+        raise StrategyUnavailable('reflink需要fcntl.ioctl')
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        try:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        except OSError as e:
+            raise StrategyUnavailable(f"文件系统不支持reflink: {e.strerror}")
+
+
+def _hardlink(src: str, dst: str):
+    """硬链接，与源文件共享同一个inode(源文件被原地修改时仓库内的文件也会变化)"""
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP):
+            raise StrategyUnavailable(f"无法创建硬链接: {e.strerror}")
+        raise
+
+
+def _kernel_copy(src: str, dst: str, copy_fn):
+    """用内核态复制函数(copy_file_range或sendfile)复制整个文件"""
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        remaining = os.fstat(fin.fileno()).st_size
+        offset = 0
+        while remaining > 0:
+            try:
+                sent = copy_fn(fin.fileno(), fout.fileno(), offset, min(remaining, _KERNEL_COPY_CHUNK))
+            except OSError as e:
+                if e.errno in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.EOPNOTSUPP):
+                    raise StrategyUnavailable(f"内核态复制不可用: {e.strerror}")
+                raise
+            if sent == 0:
+                break
+            offset += sent
+            remaining -= sent
+    shutil.copystat(src, dst)
+
+
+def _copy_file_range(src: str, dst: str):
+    if not hasattr(os, 'copy_file_range'):
+        raise StrategyUnavailable('当前平台没有os.copy_file_range')
+    _kernel_copy(src, dst, lambda fin, fout, offset, count: os.copy_file_range(fin, fout, count, offset))
+
+
+def _sendfile(src: str, dst: str):
+    if not hasattr(os, 'sendfile'):
+        raise StrategyUnavailable('当前平台没有os.sendfile')
+    _kernel_copy(src, dst, lambda fin, fout, offset, count: os.sendfile(fout, fin, offset, count))
+
+
+# 不计算哈希的复制策略；缓冲复制在复制过程中直接计算哈希
+_COPY_FUNCTIONS = {
+    'reflink': _reflink,
+    'hardlink': _hardlink,
+    'copy_file_range': _copy_file_range,
+    'sendfile': _sendfile,
+}
+
+STRATEGIES = ('rename',) + tuple(_COPY_FUNCTIONS) + ('buffered',)
+
+
+def copy_file(src: str, dst: str, strategies: Iterable[str] = DEFAULT_COPY_STRATEGIES) -> Tuple[str, str, int]:
+    """
+    按策略顺序复制文件，不可用的策略自动跳过
+
+    Args:
+        src: 源文件路径
+        dst: 目标文件路径(不能已存在)
+        strategies: 依次尝试的策略名称
+
+    Returns:
+        (实际使用的策略, 十六进制内容哈希, 文件大小)
+    """
+    for strategy in strategies:
+        if strategy == 'buffered':
+            content_hash, size = copy_with_hash(src, dst)
+            return strategy, content_hash, size
+
+        copy_fn = _COPY_FUNCTIONS.get(strategy)
+        if copy_fn is None:
+            raise ValueError(f"不支持的导入策略: {strategy}")
+        try:
+            copy_fn(src, dst)
+        except StrategyUnavailable as e:
+            logger.debug(f"导入策略{strategy}不可用: {str(e)}")
+            if os.path.exists(dst):
+                os.remove(dst)
+            continue
+        except BaseException:
+            if os.path.exists(dst):
+                os.remove(dst)
+            raise
+
+        # 未经用户态读写的策略单独读取一次计算哈希
+        content_hash, size = hash_file(dst)
+        return strategy, content_hash, size
+
+    raise StrategyUnavailable(f"没有可用的导入策略: {list(strategies)}")
+
+
+def ingest_file(src: str,
+                dst: str,
+                move: bool = False,
+                strategies: Iterable[str] = DEFAULT_COPY_STRATEGIES) -> Dict:
+    """
+    将文件导入仓库并计算内容哈希
+
+    Args:
+        src: 源文件路径
+        dst: 仓库内的目标路径
+        move: 是否移动(同文件系统内直接重命名，否则复制后删除源文件)
+        strategies: 复制时依次尝试的策略
+
+    Returns:
+        {'strategy': 实际使用的策略, 'content_hash': 十六进制哈希, 'file_size': 文件大小}
+    """
+    if move:
+        try:
+            os.rename(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        else:
+            content_hash, size = hash_file(dst)
+            return {'strategy': 'rename', 'content_hash': content_hash, 'file_size': size}
+
+        # 跨文件系统移动：硬链接不可用，复制后删除源文件
+        strategies = [s for s in strategies if s != 'hardlink']
+
+    strategy, content_hash, size = copy_file(src, dst, strategies)
+    if move:
+        os.remove(src)
+    return {'strategy': strategy, 'content_hash': content_hash, 'file_size': size}
@@ -0,0 +1,399 @@
+"""
+素材倒排索引
+维护 标签/分类/类型 -> 素材ID 的映射，过滤查询转换为集合求交
+"""
+import time
+import logging
+from typing import Collection, Dict, Iterable, List, Mapping, Optional, Set
+
+from .relation_graph import RelationGraph
+from .secondary_index import SortedIndex
+
+logger = logging.getLogger(__name__)
+
+
+class InvertedIndex:
+    """倒排索引，键 -> 素材ID集合
+
+    每个倒排表用dict保存(值为None)，既能O(1)增删，又保留插入顺序。
+    """
+
+    def __init__(self):
+        self._postings = {}
+
+    def add(self, key: str, material_id: str):
+        """将素材加入键的倒排表"""
+        postings = self._postings.get(key)
+        if postings is None:
+            postings = self._postings[key] = {}
+        postings[material_id] = None
+
+    def remove(self, key: str, material_id: str):
+        """从键的倒排表中移除素材，倒排表为空时删除该键"""
+        postings = self._postings.get(key)
+        if postings is not None:
+            postings.pop(material_id, None)
+            if not postings:
+                del self._postings[key]
+
+    def get(self, key: str) -> Dict[str, None]:
+        """获取键的倒排表(只读)，不存在时返回空字典"""
+        return self._postings.get(key, {})
+
+    def count(self, key: str) -> int:
+        """键对应的素材数量"""
+        return len(self._postings.get(key, ()))
+
+    def keys(self):
+        return self._postings.keys()
+
+    def items(self):
+        return self._postings.items()
+
+    def clear(self):
+        self._postings.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self._postings
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    def as_sets(self) -> Dict[str, Set[str]]:
+        """转换为 键 -> 集合，用于一致性比对"""
+        return {key: set(postings) for key, postings in self._postings.items()}
+
+
+class FileUsageIndex:
+    """文件路径 -> 引用该文件的素材，同时按文件汇总大小和最近访问时间
+
+    文件的最近访问时间取引用素材中的最新值(移除引用时不回退)；全部文件和各目录前缀下的
+    文件总大小随增删增量维护，前缀在首次查询时统计一次。
+    """
+
+    def __init__(self):
+        # 文件路径 -> {'size', 'last_accessed', 'materials': {素材ID: None}}
+        self._files = {}
+        self._prefix_bytes = {}
+        self.total_bytes = 0
+
+    def add(self, material: Dict):
+        """加入素材对文件的引用"""
+        path = material['file_path']
+        entry = self._files.get(path)
+        if entry is None:
+            entry = self._files[path] = {'size': material.get('file_size') or 0, 'last_accessed': '', 'materials': {}}
+            self._count_bytes(path, entry['size'])
+        entry['materials'][material['id']] = None
+        self.touch(material)
+
+    def remove(self, material: Dict):
+        """移除素材对文件的引用，文件不再被引用时删除该文件"""
+        path = material['file_path']
+        entry = self._files.get(path)
+        if entry is None:
+            return
+        entry['materials'].pop(material['id'], None)
+        if not entry['materials']:
+            del self._files[path]
+            self._count_bytes(path, -entry['size'])
+
+    def touch(self, material: Dict):
+        """素材的访问时间已修改，更新文件的最近访问时间"""
+        entry = self._files.get(material['file_path'])
+        last_accessed = material.get('last_accessed') or ''
+        if entry is not None and last_accessed > entry['last_accessed']:
+            entry['last_accessed'] = last_accessed
+
+    def _count_bytes(self, path: str, delta: int):
+        self.total_bytes += delta
+        for prefix in self._prefix_bytes:
+            if path.startswith(prefix):
+                self._prefix_bytes[prefix] += delta
+
+    def bytes_under(self, prefix: str) -> int:
+        """路径以prefix开头的文件总大小"""
+        total = self._prefix_bytes.get(prefix)
+        if total is None:
+            total = self._prefix_bytes[prefix] = sum(
+                entry['size'] for path, entry in self._files.items() if path.startswith(prefix)
+            )
+        return total
+
+    def get(self, path: str) -> Dict[str, None]:
+        """引用文件的素材(只读)，文件未被引用时返回空字典"""
+        entry = self._files.get(path)
+        return entry['materials'] if entry is not None else {}
+
+    def items(self):
+        """文件路径 -> {'size', 'last_accessed', 'materials'}(只读)"""
+        return self._files.items()
+
+    def __contains__(self, path) -> bool:
+        return path in self._files
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def as_sets(self) -> Dict[str, Set[str]]:
+        return {path: set(entry['materials']) for path, entry in self._files.items()}
+
+
+class MaterialIndexes:
+    """素材的标签、分类、类型和内容哈希倒排索引，关键词全文索引，有序二级索引，文件引用索引，以及关系图
+
+    各部分索引可以延迟构建：指定素材来源时，某部分索引在首次访问时才根据素材记录构建，
+    尚未构建的部分不需要随增删同步维护。
+    """
+
+    # 倒排索引: 名称 -> 素材记录中的字段
+    INVERTED_FIELDS = {
+        'tags': 'tags',
+        'categories': 'category',
+        'types': 'type',
+        # 内容哈希 -> 引用同一文件的素材，倒排表长度即文件的引用计数
+        'content': 'content_hash'
+    }
+
+    # 内置的有序索引(相对素材记录本身)
+    RECORD_SORTED_FIELDS = ('added_at', 'last_accessed')
+
+    # 只依赖固定字段、可由素材来源的index_fields()构建的部分
+    FIELD_PARTS = tuple(INVERTED_FIELDS) + RECORD_SORTED_FIELDS
+
+    PARTS = FIELD_PARTS + ('text', 'metadata', 'relations', 'files')
+
+    def __init__(self, metadata_indexes: Optional[Dict[str, str]] = None, source: Mapping = None):
+        """
+        初始化索引集合
+
+        Args:
+            metadata_indexes: 声明的元数据二级索引 {点分路径: 值类型}
+            source: 素材ID -> 素材记录；指定时各部分索引在首次访问时构建，否则立即创建空索引
+        """
+        self._metadata_types = dict(metadata_indexes or {})
+        self._source = source
+        self._parts = {}
+        # 访问时间已修改、尚未重新排序进访问时间索引的素材: 素材ID -> 记录
+        self._touched = {}
+        if source is None:
+            for name in self.PARTS:
+                self._parts[name] = self._new_part(name)
+
+    def _new_part(self, name: str):
+        """创建一个空的部分索引"""
+        if name in self.INVERTED_FIELDS:
+            return InvertedIndex()
+        if name in self.RECORD_SORTED_FIELDS:
+            return SortedIndex(name, 'datetime', source='record')
+        if name == 'text':
+            # 全文索引依赖本模块的intersect_postings，在此处导入以避免循环引用
+            from .text_index import NGramIndex
+            return NGramIndex()
+        if name == 'metadata':
+            return {path: SortedIndex(path, value_type) for path, value_type in self._metadata_types.items()}
+        if name == 'relations':
+            return RelationGraph()
+        if name == 'files':
+            return FileUsageIndex()
+        raise KeyError(name)
+
+    def _part(self, name: str):
+        part = self._parts.get(name)
+        if part is None:
+            part = self._parts[name] = self._build_part(name)
+        return part
+
+    def _build_part(self, name: str):
+        """根据素材来源构建一个部分索引"""
+        start = time.perf_counter()
+        part = self._new_part(name)
+        source = self._source
+        if name in self.FIELD_PARTS and hasattr(source, 'index_fields'):
+            # 只需要固定字段时不解码完整记录
+            records = source.index_fields()
+        elif hasattr(source, 'scan'):
+            records = source.scan()
+        else:
+            records = source.values()
+
+        if name == 'metadata':
+            records = list(records)
+            for index in part.values():
+                index.rebuild(records)
+        elif name in self.RECORD_SORTED_FIELDS:
+            part.rebuild(records)
+        else:
+            for material in records:
+                self._add_to_part(name, part, material)
+
+        logger.info(f"构建{name}索引完成，耗时{time.perf_counter() - start:.3f}秒")
+        return part
+
+    def is_built(self, name: str) -> bool:
+        """部分索引是否已构建"""
+        return name in self._parts
+
+    tags = property(lambda self: self._part('tags'))
+    categories = property(lambda self: self._part('categories'))
+    types = property(lambda self: self._part('types'))
+    content = property(lambda self: self._part('content'))
+    text = property(lambda self: self._part('text'))
+    added_at = property(lambda self: self._part('added_at'))
+    metadata = property(lambda self: self._part('metadata'))
+    relations = property(lambda self: self._part('relations'))
+    files = property(lambda self: self._part('files'))
+
+    @property
+    def last_accessed(self) -> SortedIndex:
+        """访问时间索引，读取前批量重新排序被访问过的素材"""
+        part = self._part('last_accessed')
+        if self._touched:
+            touched, self._touched = self._touched, {}
+            part.update_many(touched.values())
+        return part
+
+    def touch(self, material: Dict):
+        """
+        素材的访问时间已修改：只记录待更新，下次读取访问时间索引时批量重新排序，
+        读取素材保持O(1)(索引尚未构建时无需记录，构建时读取最新值)；文件引用索引直接更新
+        """
+        if self.is_built('last_accessed'):
+            self._touched[material['id']] = material
+        if self.is_built('files'):
+            self._parts['files'].touch(material)
+
+    def sorted_indexes(self) -> List[SortedIndex]:
+        """全部有序索引"""
+        return [self.added_at, self.last_accessed] + list(self.metadata.values())
+
+    def define_metadata_index(self, path: str, value_type: str, materials: Iterable[Dict]) -> Optional[SortedIndex]:
+        """声明元数据二级索引；元数据索引已构建时立即根据现有素材构建"""
+        self._metadata_types[path] = value_type
+        if not self.is_built('metadata'):
+            return None
+        index = SortedIndex(path, value_type)
+        index.rebuild(materials)
+        self._parts['metadata'][path] = index
+        return index
+
+    def drop_metadata_index(self, path: str):
+        """删除元数据二级索引"""
+        self._metadata_types.pop(path, None)
+        if self.is_built('metadata'):
+            self._parts['metadata'].pop(path, None)
+
+    def add(self, material: Dict):
+        """将素材加入全部已构建的索引"""
+        self._touched.pop(material['id'], None)
+        for name, part in self._parts.items():
+            self._add_to_part(name, part, material)
+
+    def remove(self, material: Dict):
+        """从全部已构建的索引中移除素材(按素材当前的字段值)"""
+        self._touched.pop(material['id'], None)
+        for name, part in self._parts.items():
+            self._remove_from_part(name, part, material)
+
+    def rebuild(self, materials: Iterable[Dict]):
+        """根据素材记录重建全部索引"""
+        materials = list(materials)
+        self._source = None
+        self._parts = {}
+        self._touched = {}
+        for name in self.PARTS:
+            part = self._parts[name] = self._new_part(name)
+            if name == 'metadata':
+                for index in part.values():
+                    index.rebuild(materials)
+            elif name in self.RECORD_SORTED_FIELDS:
+                # 有序索引一次排序构建
+                part.rebuild(materials)
+            else:
+                for material in materials:
+                    self._add_to_part(name, part, material)
+
+    def _add_to_part(self, name: str, part, material: Dict):
+        """将素材加入一个部分索引"""
+        field = self.INVERTED_FIELDS.get(name)
+        if field == 'tags':
+            for tag in set(material.get('tags') or ()):
+                part.add(tag, material['id'])
+        elif field is not None:
+            if material.get(field):
+                part.add(material[field], material['id'])
+        elif name == 'metadata':
+            for index in part.values():
+                index.add(material)
+        else:
+            part.add(material)
+
+    def _remove_from_part(self, name: str, part, material: Dict):
+        """从一个部分索引中移除素材"""
+        field = self.INVERTED_FIELDS.get(name)
+        if field == 'tags':
+            for tag in set(material.get('tags') or ()):
+                part.remove(tag, material['id'])
+        elif field is not None:
+            if material.get(field):
+                part.remove(material[field], material['id'])
+        elif name == 'metadata':
+            for index in part.values():
+                index.remove(material)
+        else:
+            part.remove(material)
+
+    def check(self, materials: Iterable[Dict]) -> Dict[str, Dict[str, List[str]]]:
+        """
+        比对当前索引与根据素材记录重建的索引
+
+        Args:
+            materials: 全部素材记录
+
+        Returns:
+            {索引名: {'missing': [...], 'extra': [...]}}，条目格式为"键:素材ID"；一致时为空字典
+        """
+        expected = MaterialIndexes(self._metadata_types)
+        expected.rebuild(materials)
+
+        pairs = [(name, getattr(self, name), getattr(expected, name))
+                 for name in ('tags', 'categories', 'types', 'content', 'text', 'added_at', 'last_accessed',
+                              'relations', 'files')]
+        pairs.extend((f"metadata:{path}", index, expected.metadata[path])
+                     for path, index in self.metadata.items())
+
+        issues = {}
+        for name, actual, wanted in pairs:
+            actual_sets = actual.as_sets()
+            expected_sets = wanted.as_sets()
+            missing, extra = [], []
+            for key in set(actual_sets) | set(expected_sets):
+                have = actual_sets.get(key, set())
+                want = expected_sets.get(key, set())
+                missing.extend(f"{key}:{mid}" for mid in want - have)
+                extra.extend(f"{key}:{mid}" for mid in have - want)
+            if missing or extra:
+                issues[name] = {'missing': sorted(missing), 'extra': sorted(extra)}
+        return issues
+
+
+def intersect_postings(postings_list: List[Collection[str]]) -> Optional[Set[str]]:
+    """
+    按选择度(倒排表长度)从小到大求交集
+
+    Args:
+        postings_list: 倒排表列表
+
+    Returns:
+        素材ID集合；列表为空(没有可用的索引条件)时返回None
+    """
+    if not postings_list:
+        return None
+
+    ordered = sorted(postings_list, key=len)
+    result = set(ordered[0])
+    for postings in ordered[1:]:
+        if not result:
+            break
+        result = {material_id for material_id in result if material_id in postings}
+    return result
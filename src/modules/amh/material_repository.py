@@ -3,32 +3,249 @@
 负责结构化存储和管理广告素材
 """
 import os
+import copy
 import json
 import shutil
+import time
 import logging
 import datetime
 import uuid
-from typing import List, Dict, Any, Optional, Union, Tuple
+import heapq
+import functools
+import threading
+import contextlib
+import concurrent.futures
+from typing import List, Dict, Any, Callable, Collection, Iterable, Optional, Union, Tuple
+
+from .access_tracker import AccessTracker
+from .content_hash import hash_file
+from .ingest_strategy import DEFAULT_COPY_STRATEGIES, STRATEGIES, ingest_file
+from .inverted_index import MaterialIndexes
+from .query_planner import plan_candidates, postings_predicate
+from .pagination import decode_cursor, encode_cursor, select_page
+from .secondary_index import MISSING, VALUE_TYPES, coerce_value, get_path, match_condition
+from .index_snapshot import IndexSnapshot, LazyMaterialMap, write_snapshot
+from .process_lock import ProcessLock
+from .index_stream import (
+    MERGE_POLICIES,
+    detect_compression,
+    is_stream_path,
+    open_stream,
+    read_stream,
+    stream_fingerprint,
+    write_stream
+)
+from .tier_manager import TierManager
+from .garbage_collector import GarbageCollector
+from .media_probe import PROBE_FIELDS, MediaProber
+from .archive_export import MANIFEST_NAME, CrcCache, MaterialArchive, data_entry, file_entry
+from .storage_layout import DEFAULT_LAYOUT, material_file_path, normalize_layout, relocated_path
+from .storage_backend import (
+    META_FIELDS,
+    StorageBackend,
+    SQLiteStorageBackend,
+    create_backend,
+    migrate_json_index
+)
 
 logger = logging.getLogger(__name__)
 
+# 回滚日志中表示“批量开始前不存在”的占位值
+_MISSING = object()
+
+# 删除后默认可以恢复的时间(秒)
+DEFAULT_UNDELETE_WINDOW = 7 * 24 * 3600
+
+# facet_counts支持的过滤条件(与search_materials的参数相同)
+FACET_FILTERS = (
+    'query', 'material_type', 'tags', 'category', 'metadata_filters', 'added_after', 'added_before'
+)
+
+# 排序字段别名 -> 元数据路径
+SORT_FIELDS = {
+    'duration': 'duration'
+}
+
+
+def _synchronized(method):
+    """在素材仓库的锁内执行方法，执行前同步其他进程的修改(按refresh_interval节流)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            self._refresh_if_stale()
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _exclusive(method):
+    """在素材仓库的锁和跨进程文件锁内执行修改操作，执行前同步其他进程的修改"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._write_lock():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class RevisionConflict(Exception):
+    """素材记录已被修改(乐观并发检查失败)"""
+    
+    def __init__(self, material_id: str, expected: int, actual: int):
+        super().__init__(f"素材已被修改: {material_id}, 期望版本{expected}, 当前版本{actual}")
+        self.material_id = material_id
+        self.expected = expected
+        self.actual = actual
+
+
+class _BatchState:
+    """批量模式的状态：累积的待写入变更、回滚日志和延迟执行的文件操作"""
+    
+    def __init__(self, index: Dict):
+        self.total_materials = index['total_materials']
+        self.material_backup = {}
+        self.category_backup = {}
+        self.tombstone_backup = {}
+        self.materials = set()
+        self.deleted_materials = set()
+        self.categories = set()
+        self.deleted_categories = set()
+        self.tombstones = set()
+        self.deleted_tombstones = set()
+        # (仓库内路径, 原始路径, 是否为移动)
+        self.ingested_files = []
+        self.files_to_delete = []
+        
+    def record(self, materials, deleted_materials, categories, deleted_categories,
+               tombstones=(), deleted_tombstones=()):
+        """合并一次变更，后发生的写入/删除覆盖先前的操作"""
+        for material_id in materials:
+            self.materials.add(material_id)
+            self.deleted_materials.discard(material_id)
+        for material_id in deleted_materials:
+            self.deleted_materials.add(material_id)
+            self.materials.discard(material_id)
+        for name in categories:
+            self.categories.add(name)
+            self.deleted_categories.discard(name)
+        for name in deleted_categories:
+            self.deleted_categories.add(name)
+            self.categories.discard(name)
+        for material_id in tombstones:
+            self.tombstones.add(material_id)
+            self.deleted_tombstones.discard(material_id)
+        for material_id in deleted_tombstones:
+            self.deleted_tombstones.add(material_id)
+            self.tombstones.discard(material_id)
+
+
 class MaterialRepository:
     """素材仓库，负责管理广告素材的存储和检索"""
     
-    def __init__(self, base_dir: str):
+    def __init__(self,
+                 base_dir: str,
+                 backend: Union[str, StorageBackend] = 'sqlite',
+                 access_flush_interval: Optional[float] = 5.0,
+                 ingest_strategies: Tuple[str, ...] = DEFAULT_COPY_STRATEGIES,
+                 layout: Dict = None,
+                 tiers: Dict = None,
+                 media_probe: Union[bool, Dict] = True,
+                 undelete_window: float = DEFAULT_UNDELETE_WINDOW,
+                 gc: Union[bool, Dict] = True,
+                 refresh_interval: float = 0.5):
         """
         初始化素材仓库
         
         Args:
             base_dir: 素材存储的基础目录
+            backend: 索引存储后端，'sqlite'(默认，WAL模式)、'json'(旧的单文件格式)或StorageBackend实例
+            access_flush_interval: 访问时间的后台写入间隔(秒)，为None时只在close()时写入
+            ingest_strategies: 复制导入文件时依次尝试的策略，见ingest_strategy模块；
+                默认不含'hardlink'(与源文件共享inode)，确定源文件之后不会被修改时可以显式加入
+            layout: 新建素材库时的文件目录布局(默认两级分层，见storage_layout模块)；
+                已有素材库沿用记录的布局，修改布局使用reshard()
+            tiers: 冷热分层存储配置，例如 {'cold_dir': ..., 'hot_bytes': ...}，参数见TierManager；
+                None表示不分层
+            media_probe: 导入时探测媒体信息(时长、分辨率、编码、码率、帧率，见media_probe模块)，
+                可以是MediaProber的参数字典；没有ffprobe和PyAV时不探测，False表示关闭
+            undelete_window: 删除后可以恢复的时间(秒)，超过后由垃圾回收删除文件
+            gc: 后台垃圾回收配置，可以是GarbageCollector的参数字典；
+                False表示不启动后台线程，由调用方执行gc.run_once()
+            refresh_interval: 读操作检查其他进程修改的最短间隔(秒)，读取最多滞后这么久；
+                0表示每次读取都检查。写操作和refresh()总是先同步
         """
+        unknown = [s for s in ingest_strategies if s not in STRATEGIES or s == 'rename']
+        if unknown:
+            raise ValueError(f"不支持的导入策略: {unknown}")
+            
         self.base_dir = base_dir
+        self.ingest_strategies = tuple(ingest_strategies)
+        self.undelete_window = undelete_window
+        self._new_layout = normalize_layout(layout or DEFAULT_LAYOUT)
+        self._lock = threading.RLock()
+        self._batch = None
+        
+        # 内存中素材和分类的修改版本，每次修改递增；统计快照按版本缓存
+        self.content_version = 0
+        self._statistics_snapshot = None
+        # 内存与存储的变更序号_seen_seq一致时的修改版本(未确认时为None)
+        self._synced_version = None
         
         # 创建必要的目录结构
         self._create_directory_structure()
         
-        # 加载素材索引
-        self.index = self._load_index()
+        # 初始化存储后端
+        if isinstance(backend, StorageBackend):
+            self.backend = backend
+        else:
+            self.backend = create_backend(backend, os.path.join(self.base_dir, 'metadata'))
+        
+        # 同一素材库可能被多个进程同时打开：写操作持有跨进程文件锁，
+        # 并在执行前按存储的变更日志同步其他进程修改过的记录
+        self._process_lock = ProcessLock(os.path.join(self.base_dir, 'metadata', 'repository.lock'))
+        self._seen_seq = None
+        self.refresh_interval = refresh_interval
+        # 加载期间其他进程的写入在首次读取时同步
+        self._refreshed_at = float('-inf')
+        self._closed = False
+        
+        # 加载素材索引，并重建分类成员关系和倒排索引；没有记录布局的旧素材库为平铺布局
+        self._snapshot = None
+        self._snapshot_updated = None
+        with self._process_lock:
+            # 先取变更序号再加载，加载期间的写入会在下次同步时重放
+            self._seen_seq = self.backend.change_seq()
+            self.index = self._load_snapshot() or self._load_index()
+            self.index['layout'] = normalize_layout(self.index.get('layout'))
+            self.index.setdefault('tombstones', {})
+            if self._snapshot is not None:
+                # 快照与数据库一致时素材记录按需解码，各部分索引在首次使用时构建
+                self.indexes = MaterialIndexes(self.index['secondary_indexes'], source=self.index['materials'])
+            else:
+                registered = self._rebuild_indexes()
+                if registered:
+                    self._persist(categories=registered)
+        
+        # 访问时间在内存中缓冲，由后台线程合并写入
+        self.access_tracker = AccessTracker(self._flush_access_times, access_flush_interval)
+        
+        # 冷热分层：热层超出容量时降级最久未访问的文件，访问冷层文件时移回热层
+        self.tiers = TierManager(self, **tiers) if tiers else None
+        
+        # 打包导出时ZIP条目的CRC32缓存，首次导出时创建
+        self._crc_cache = None
+        
+        # 媒体信息探测，结果按文件缓存在metadata/probe_cache.db
+        self.prober = None
+        if media_probe:
+            options = media_probe if isinstance(media_probe, dict) else {}
+            prober = MediaProber(os.path.join(self.base_dir, 'metadata', 'probe_cache.db'), **options)
+            if prober.available:
+                self.prober = prober
+            else:
+                prober.close()
+                
+        # 删除的素材先留下墓碑，恢复期过后由垃圾回收分批删除文件
+        options = gc if isinstance(gc, dict) else ({} if gc else {'interval': None})
+        self.gc = GarbageCollector(self, **options)
         
     def _create_directory_structure(self):
         """创建素材库的目录结构"""
@@ -65,17 +282,93 @@ class MaterialRepository:
         """加载素材索引"""
         index_path = self._get_index_path()
         
-        if os.path.exists(index_path):
+        # 首次使用SQLite后端时，从旧的JSON索引一次性迁移
+        if (isinstance(self.backend, SQLiteStorageBackend)
+                and not self.backend.exists()
+                and os.path.exists(index_path)):
             try:
-                with open(index_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                migrate_json_index(index_path, self.backend.db_path)
             except Exception as e:
-                logger.error(f"加载素材索引失败: {str(e)}")
-                # 返回新索引
-                return self._create_new_index()
-        else:
+                logger.error(f"迁移旧素材索引失败: {str(e)}")
+        
+        try:
+            index = self.backend.load()
+        except Exception as e:
+            logger.error(f"加载素材索引失败: {str(e)}")
+            index = None
+            
+        if index is None:
+            # 返回新索引
             return self._create_new_index()
+        return index
+            
+    def _snapshot_path(self) -> str:
+        """二进制索引快照路径"""
+        return os.path.join(self.base_dir, 'metadata', 'material_index.snapshot')
+        
+    def _load_snapshot(self) -> Optional[Dict]:
+        """
+        从二进制快照加载索引
+        
+        只有快照记录的last_updated与存储后端一致时才使用快照，否则返回None走完整加载。
+        """
+        snapshot_path = self._snapshot_path()
+        if self.backend.needs_full_index or not os.path.exists(snapshot_path):
+            return None
+            
+        try:
+            meta = self.backend.load_meta()
+            if meta is None:
+                return None
+            snapshot = IndexSnapshot(snapshot_path)
+        except Exception as e:
+            logger.warning(f"加载索引快照失败: {str(e)}")
+            return None
+            
+        if snapshot.meta.get('last_updated') != meta.get('last_updated'):
+            logger.info("索引快照已过期，完整加载素材索引")
+            snapshot.close()
+            return None
+            
+        self._snapshot = snapshot
+        index = dict(meta)
+        index['secondary_indexes'] = index.get('secondary_indexes') or {}
+        index['categories'] = {
+            name: {k: v for k, v in info.items() if k not in ('count', 'materials')}
+            for name, info in snapshot.categories.items()
+        }
+        index['materials'] = LazyMaterialMap(snapshot)
+        index['tombstones'] = self.backend.load_tombstones() or {}
+        self._snapshot_updated = meta.get('last_updated')
+        logger.info(f"从索引快照加载素材库: {snapshot.count}个素材")
+        return index
+        
+    @_exclusive
+    def save_snapshot(self, force: bool = False) -> bool:
+        """
+        写出二进制索引快照，下次启动时按需解码素材记录
+        
+        Args:
+            force: 快照已是最新时是否仍然重写
+            
+        Returns:
+            是否写出了快照
+        """
+        if self.backend.needs_full_index:
+            return False
+        if not force and self._snapshot_updated == self.index['last_updated']:
+            return False
+            
+        try:
+            count = write_snapshot(self._snapshot_path(), self.index)
+        except Exception as e:
+            logger.error(f"写入索引快照失败: {str(e)}")
+            return False
             
+        self._snapshot_updated = self.index['last_updated']
+        logger.info(f"写入索引快照成功: {count}个素材")
+        return True
+        
     def _create_new_index(self) -> Dict:
         """创建新的素材索引"""
         index = {
@@ -83,8 +376,11 @@ class MaterialRepository:
             'created_at': datetime.datetime.now().isoformat(),
             'last_updated': datetime.datetime.now().isoformat(),
             'total_materials': 0,
+            'secondary_indexes': {},
+            'layout': self._new_layout,
             'categories': {},
-            'materials': {}
+            'materials': {},
+            'tombstones': {}
         }
         
         # 保存新索引
@@ -93,21 +389,403 @@ class MaterialRepository:
         return index
         
     def _save_index(self, index: Dict = None) -> bool:
-        """保存素材索引"""
+        """整体保存素材索引(用于导入等需要替换全部内容的场景)"""
         if index is None:
-            index = self.index
+            # 更新时间戳
+            self.index['last_updated'] = datetime.datetime.now().isoformat()
+            index = self._backend_index()
+        else:
+            index['last_updated'] = datetime.datetime.now().isoformat()
             
-        # 更新时间戳
-        index['last_updated'] = datetime.datetime.now().isoformat()
+        return self._synced(self.backend.replace_all(index))
         
-        try:
-            index_path = self._get_index_path()
-            with open(index_path, 'w', encoding='utf-8') as f:
-                json.dump(index, f, ensure_ascii=False, indent=2)
+    def _rebuild_indexes(self) -> List[str]:
+        """
+        根据素材记录重建分类成员关系和倒排索引
+        
+        分类成员关系以素材记录的category字段为准，内存中的分类信息只保留分类自身的属性。
+        
+        Returns:
+            素材引用但尚未登记、因此被补登记的分类
+        """
+        for info in self.index['categories'].values():
+            info.pop('count', None)
+            info.pop('materials', None)
+            
+        self.index.setdefault('secondary_indexes', {})
+        if self.index['secondary_indexes'] is None:
+            self.index['secondary_indexes'] = {}
+        self.indexes = MaterialIndexes(self.index['secondary_indexes'])
+        self.indexes.rebuild(self.index['materials'].values())
+        self.index['total_materials'] = len(self.index['materials'])
+        self.content_version += 1
+        
+        registered = []
+        for name in self.indexes.categories.keys():
+            if name not in self.index['categories']:
+                self.index['categories'][name] = {}
+                registered.append(name)
+        if registered:
+            logger.warning(f"补登记缺失的分类: {registered}")
+        return registered
+        
+    def _category_view(self, name: str) -> Dict:
+        """分类信息的对外表示，包含计数和成员列表"""
+        members = self.indexes.categories.get(name)
+        info = dict(self.index['categories'][name])
+        info['count'] = len(members)
+        info['materials'] = list(members)
+        return info
+        
+    def _serializable_index(self) -> Dict:
+        """完整的索引文档(与material_index.json格式一致)"""
+        index = {k: v for k, v in self.index.items() if k not in ('categories', 'materials')}
+        index['materials'] = dict(self.index['materials'])
+        index['categories'] = {name: self._category_view(name) for name in self.index['categories']}
+        return index
+        
+    def _backend_index(self) -> Dict:
+        """传给存储后端的索引，单文件后端需要完整文档"""
+        if self.backend.needs_full_index:
+            return self._serializable_index()
+        return self.index
+        
+    def _persist(self,
+                 materials: List[str] = (),
+                 deleted_materials: List[str] = (),
+                 categories: List[str] = (),
+                 deleted_categories: List[str] = (),
+                 tombstones: List[str] = (),
+                 deleted_tombstones: List[str] = (),
+                 bump_revision: bool = True) -> bool:
+        """
+        持久化发生变更的素材和分类
+        
+        Args:
+            materials: 新增或修改的素材ID
+            deleted_materials: 已删除的素材ID
+            categories: 新增或修改的分类名称
+            deleted_categories: 已删除的分类名称
+            tombstones: 新增或修改的墓碑(素材ID)
+            deleted_tombstones: 已回收或恢复的墓碑(素材ID)
+            bump_revision: 是否递增素材的版本号(只写入访问时间时不递增)
+            
+        Returns:
+            保存是否成功
+        """
+        # 批量模式下只记录变更，退出时统一提交
+        if self._batch is not None:
+            self._batch.record(materials, deleted_materials, categories, deleted_categories,
+                               tombstones, deleted_tombstones)
             return True
-        except Exception as e:
-            logger.error(f"保存素材索引失败: {str(e)}")
-            return False
+            
+        # 更新时间戳和素材记录的版本号
+        self.index['last_updated'] = datetime.datetime.now().isoformat()
+        if bump_revision:
+            self._bump_revisions(materials)
+        
+        return self._synced(self.backend.apply(
+            self._backend_index(),
+            materials=materials,
+            deleted_materials=deleted_materials,
+            categories=categories,
+            deleted_categories=deleted_categories,
+            tombstones=tombstones,
+            deleted_tombstones=deleted_tombstones
+        ))
+        
+    def _bump_revisions(self, material_ids):
+        """递增写入的素材记录的版本号(用于乐观并发检查)"""
+        for material_id in material_ids:
+            material = self.index['materials'].get(material_id)
+            if material is not None:
+                material['revision'] = material.get('revision', 0) + 1
+                
+    def _synced(self, success: bool) -> bool:
+        """
+        自身写入成功后更新已同步的变更序号
+        
+        写入时持有跨进程文件锁且已先行同步，因此新的变更都来自本进程。
+        """
+        if success:
+            self._seen_seq = self.backend.change_seq()
+            self._synced_version = self.content_version
+        return success
+        
+    def _check_revision(self, material_id: str, expected_revision: Optional[int]):
+        """检查素材记录的版本号，不一致时抛出RevisionConflict"""
+        if expected_revision is None:
+            return
+        actual = self.index['materials'][material_id].get('revision', 0)
+        if actual != expected_revision:
+            raise RevisionConflict(material_id, expected_revision, actual)
+        
+    def _journal(self, materials: List[str] = (), categories: List[str] = (), tombstones: List[str] = ()):
+        """在修改素材、分类或墓碑前调用：递增修改版本；批量模式下首次修改前备份以便回滚"""
+        self.content_version += 1
+        batch = self._batch
+        if batch is None:
+            return
+            
+        for material_id in materials:
+            if material_id not in batch.material_backup:
+                material = self.index['materials'].get(material_id, _MISSING)
+                batch.material_backup[material_id] = (
+                    material if material is _MISSING else copy.deepcopy(material)
+                )
+                
+        for name in categories:
+            if name and name not in batch.category_backup:
+                info = self.index['categories'].get(name, _MISSING)
+                batch.category_backup[name] = (
+                    info if info is _MISSING else copy.deepcopy(info)
+                )
+                
+        for material_id in tombstones:
+            if material_id not in batch.tombstone_backup:
+                tombstone = self.index['tombstones'].get(material_id, _MISSING)
+                batch.tombstone_backup[material_id] = (
+                    tombstone if tombstone is _MISSING else copy.deepcopy(tombstone)
+                )
+                
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        批量模式：块内的所有修改在退出时作为一次原子提交写入，
+        块内抛出异常时在内存中回滚全部修改
+        
+        批量期间持有仓库锁和跨进程文件锁；嵌套调用并入最外层批量。
+        
+        用法:
+            with repo.batch():
+                material_id = repo.add_material(...)
+                repo.update_material_tags(material_id, [...])
+        """
+        with self._write_lock():
+            if self._batch is not None:
+                yield self
+                return
+                
+            self._batch = _BatchState(self.index)
+            try:
+                yield self
+            except BaseException:
+                self._rollback_batch()
+                raise
+            else:
+                self._commit_batch()
+            finally:
+                self._batch = None
+                
+    # 事务是批量模式的别名
+    transaction = batch
+    
+    def _commit_batch(self):
+        """提交批量模式中累积的变更"""
+        batch = self._batch
+        
+        self.index['last_updated'] = datetime.datetime.now().isoformat()
+        self._bump_revisions(batch.materials)
+        if not self._synced(self.backend.apply(
+            self._backend_index(),
+            materials=batch.materials,
+            deleted_materials=batch.deleted_materials,
+            categories=batch.categories,
+            deleted_categories=batch.deleted_categories,
+            tombstones=batch.tombstones,
+            deleted_tombstones=batch.deleted_tombstones
+        )):
+            self._rollback_batch()
+            raise IOError("批量提交素材索引失败，已回滚")
+            
+        # 索引提交成功后再删除文件
+        for path in batch.files_to_delete:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                logger.error(f"删除素材文件失败: {path}, {str(e)}")
+                
+        logger.info(
+            f"批量提交成功: 写入{len(batch.materials)}个素材, "
+            f"删除{len(batch.deleted_materials)}个素材"
+        )
+        
+    def _rollback_batch(self):
+        """在内存中撤销批量模式中的修改，并撤回已导入的文件"""
+        batch = self._batch
+        
+        for material_id, material in batch.material_backup.items():
+            current = self.index['materials'].get(material_id)
+            if current is not None:
+                self.indexes.remove(current)
+            if material is _MISSING:
+                self.index['materials'].pop(material_id, None)
+            else:
+                self.index['materials'][material_id] = material
+                self.indexes.add(material)
+                
+        for name, info in batch.category_backup.items():
+            if info is _MISSING:
+                self.index['categories'].pop(name, None)
+            else:
+                self.index['categories'][name] = info
+                
+        for material_id, tombstone in batch.tombstone_backup.items():
+            if tombstone is _MISSING:
+                self.index['tombstones'].pop(material_id, None)
+            else:
+                self.index['tombstones'][material_id] = tombstone
+                
+        self.index['total_materials'] = batch.total_materials
+        self.content_version += 1
+        
+        for target_path, source_path, moved in reversed(batch.ingested_files):
+            try:
+                if moved:
+                    shutil.move(target_path, source_path)
+                elif os.path.exists(target_path):
+                    os.remove(target_path)
+            except Exception as e:
+                logger.error(f"撤回导入文件失败: {target_path}, {str(e)}")
+                
+        logger.warning(f"批量操作已回滚: {len(batch.material_backup)}个素材")
+        
+    @_exclusive
+    def _flush_access_times(self, updates: Dict[str, str]):
+        """写入缓冲的访问时间(记录可能刚被其他进程的版本替换，取较新的访问时间)"""
+        material_ids = []
+        for material_id, accessed_at in updates.items():
+            material = self.index['materials'].get(material_id)
+            if material is None:
+                continue
+            if (material.get('last_accessed') or '') < accessed_at:
+                self._touch(material, accessed_at)
+            material_ids.append(material_id)
+        if material_ids and not self._persist(materials=material_ids, bump_revision=False):
+            raise IOError("保存素材访问时间失败")
+            
+    @contextlib.contextmanager
+    def _write_lock(self):
+        """持有仓库锁和跨进程文件锁；最外层获取文件锁时先同步其他进程的修改"""
+        with self._lock:
+            self._process_lock.acquire()
+            try:
+                self._refresh()
+                yield
+            finally:
+                self._process_lock.release()
+                
+    def refresh(self) -> int:
+        """
+        同步其他进程对素材库的修改(只重新读取变更过的记录)
+        
+        读写方法在执行前会自动同步，长时间只持有素材记录引用的调用方可以手动调用。
+        
+        Returns:
+            同步的素材和分类记录数；完整重新加载时为-1
+        """
+        with self._lock:
+            return self._refresh()
+            
+    def _refresh(self) -> int:
+        """按存储的变更日志同步其他进程的修改(需持有仓库锁)"""
+        # 批量模式持有文件锁，期间没有其他进程写入；嵌套获取文件锁时外层已同步
+        if self._batch is not None or self._process_lock.depth > 1:
+            return 0
+            
+        seq = self.backend.change_seq()
+        self._refreshed_at = time.monotonic()
+        if seq is None or seq == self._seen_seq:
+            if seq is not None:
+                self._synced_version = self.content_version
+            return 0
+            
+        changes = self.backend.changes_since(self._seen_seq)
+        if changes is None:
+            self._reload()
+            self._seen_seq = seq
+            self._synced_version = self.content_version
+            return -1
+            
+        materials = self.index['materials']
+        for material_id, material in changes['materials'].items():
+            current = materials.get(material_id)
+            if current is not None:
+                self.indexes.remove(current)
+                del materials[material_id]
+            if material is not None:
+                materials[material_id] = material
+                self.indexes.add(material)
+            else:
+                self.access_tracker.discard(material_id)
+                
+        for name, info in changes['categories'].items():
+            if info is None:
+                self.index['categories'].pop(name, None)
+            else:
+                self.index['categories'][name] = info
+                
+        for material_id, tombstone in changes.get('tombstones', {}).items():
+            if tombstone is None:
+                self.index['tombstones'].pop(material_id, None)
+            else:
+                self.index['tombstones'][material_id] = tombstone
+                
+        meta = changes['meta']
+        if meta is not None:
+            secondary_indexes = meta.get('secondary_indexes') or {}
+            self.index['last_updated'] = meta.get('last_updated')
+            self.index['layout'] = normalize_layout(meta.get('layout'))
+            if secondary_indexes != self.index['secondary_indexes']:
+                self.index['secondary_indexes'] = secondary_indexes
+                self.indexes = MaterialIndexes(secondary_indexes)
+                self.indexes.rebuild(materials.values())
+        self.index['total_materials'] = len(materials)
+        self.content_version += 1
+        self._seen_seq = changes['seq']
+        self._synced_version = self.content_version
+        
+        count = len(changes['materials']) + len(changes['categories']) + len(changes.get('tombstones', {}))
+        logger.debug(f"同步其他进程的修改: {count}条记录")
+        return count
+        
+    def _refresh_if_stale(self) -> int:
+        """读操作前同步其他进程的修改(需持有仓库锁)；距上次检查不足refresh_interval秒时不查询存储"""
+        if time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return 0
+        return self._refresh()
+        
+    def _reload(self):
+        """完整重新加载素材索引(无法增量同步时)"""
+        logger.info("素材索引已被其他进程整体修改，重新加载")
+        index = self._load_index()
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+        self.index = index
+        self.index['layout'] = normalize_layout(self.index.get('layout'))
+        self.index.setdefault('tombstones', {})
+        self._rebuild_indexes()
+        
+    def close(self):
+        """关闭素材仓库，写入缓冲的访问时间和索引快照，并释放存储后端资源(重复调用无效果)"""
+        if self._closed:
+            return
+        self._closed = True
+        self.gc.close()
+        if self.tiers is not None:
+            self.tiers.close()
+        if self.prober is not None:
+            self.prober.close()
+        if self._crc_cache is not None:
+            self._crc_cache.close()
+        self.access_tracker.close()
+        self.save_snapshot()
+        self.backend.close()
+        self._process_lock.close()
+        if self._snapshot is not None:
+            self._snapshot.close()
             
     def add_material(self, 
                     file_path: str, 
@@ -115,7 +793,8 @@ class MaterialRepository:
                     metadata: Dict,
                     tags: List[str] = None,
                     category: str = None,
-                    move_file: bool = True) -> str:
+                    move_file: bool = True,
+                    deduplicate: bool = True) -> str:
         """
         添加素材到仓库
         
@@ -126,10 +805,33 @@ class MaterialRepository:
             tags: 素材标签
             category: 素材分类
             move_file: 是否移动文件(True为移动，False为复制)
+            deduplicate: 内容与已有素材相同时是否只保留一份文件(新素材引用已有文件)
             
         Returns:
             素材ID
         """
+        # 文件导入和媒体探测不持有仓库锁，只有登记索引时加锁
+        ingested = self._ingest_file(file_path, material_type, move_file)
+        probed = self._probe(ingested['target_path'], self.prober)
+        return self._register_material(ingested, {**probed, **(metadata or {})}, tags, category, deduplicate)
+        
+    def _probe(self, path: str, probe_fn: Optional[Callable[[str], Dict]]) -> Dict:
+        """探测媒体信息，失败时返回空字典"""
+        if probe_fn is None:
+            return {}
+        try:
+            return probe_fn(path) or {}
+        except Exception as e:
+            logger.warning(f"探测素材元数据失败: {path}, {str(e)}")
+            return {}
+        
+    def _ingest_file(self, file_path: str, material_type: str, move_file: bool) -> Dict:
+        """
+        将文件复制或移动到仓库目录并计算内容哈希(不修改索引，可在锁外并行执行)
+        
+        Returns:
+            导入结果，包含material_id、target_path、source_path、moved、content_hash和file_size
+        """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"素材文件不存在: {file_path}")
             
@@ -151,26 +853,74 @@ class MaterialRepository:
         else:
             raise ValueError(f"不支持的素材类型: {material_type}")
             
-        # 生成目标文件路径
-        target_path = os.path.join(target_dir, f"{material_id}{ext}")
+        # 生成目标文件路径(按目录布局分层)
+        target_path = material_file_path(target_dir, material_id, ext, self.index['layout'])
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
         
-        # 复制或移动文件
+        # 复制或移动文件(优先使用重命名、reflink、硬链接等零复制策略)，同时计算内容哈希
         try:
-            if move_file:
-                shutil.move(file_path, target_path)
-            else:
-                shutil.copy2(file_path, target_path)
+            result = ingest_file(file_path, target_path, move=move_file, strategies=self.ingest_strategies)
         except Exception as e:
             logger.error(f"复制/移动文件失败: {str(e)}")
             raise
             
+        return {
+            'material_id': material_id,
+            'material_type': material_type,
+            'target_path': target_path,
+            'source_path': file_path,
+            'moved': move_file,
+            'strategy': result['strategy'],
+            'content_hash': result['content_hash'],
+            'file_size': result['file_size']
+        }
+        
+    def _discard_ingested(self, ingested: Dict):
+        """撤回一次未登记到索引的文件导入"""
+        try:
+            if ingested['moved']:
+                shutil.move(ingested['target_path'], ingested['source_path'])
+            elif os.path.exists(ingested['target_path']):
+                os.remove(ingested['target_path'])
+        except Exception as e:
+            logger.error(f"撤回导入文件失败: {ingested['target_path']}, {str(e)}")
+            
+    @_exclusive
+    def _register_material(self,
+                           ingested: Dict,
+                           metadata: Dict,
+                           tags: List[str] = None,
+                           category: str = None,
+                           deduplicate: bool = True) -> str:
+        """将已导入的文件登记为素材并写入索引"""
+        material_id = ingested['material_id']
+        file_path = ingested['source_path']
+        target_path = ingested['target_path']
+        content_hash = ingested['content_hash']
+        
+        if self._batch is not None:
+            self._batch.ingested_files.append((target_path, file_path, ingested['moved']))
+            
+        # 相同内容的文件只保存一份，新导入的副本在批量提交后(或立即)删除
+        existing = self._find_by_content(content_hash) if deduplicate else None
+        if existing is not None:
+            if self._batch is not None:
+                self._batch.files_to_delete.append(target_path)
+            else:
+                os.remove(target_path)
+            logger.info(f"素材内容重复，引用已有文件: {existing['file_path']}")
+            target_path = existing['file_path']
+            
         # 准备素材信息
         now = datetime.datetime.now().isoformat()
         material_info = {
             'id': material_id,
-            'type': material_type,
+            'type': ingested['material_type'],
             'file_path': target_path,
             'original_filename': os.path.basename(file_path),
+            'content_hash': content_hash,
+            'file_size': ingested['file_size'],
+            'ingest_strategy': ingested['strategy'],
             'added_at': now,
             'last_accessed': now,
             'metadata': metadata,
@@ -180,26 +930,152 @@ class MaterialRepository:
         }
         
         # 更新索引
+        self._journal(materials=[material_id], categories=[category])
         self.index['materials'][material_id] = material_info
         self.index['total_materials'] += 1
+        self.indexes.add(material_info)
         
         # 更新分类
-        if category:
-            if category not in self.index['categories']:
-                self.index['categories'][category] = {
-                    'count': 0,
-                    'materials': []
-                }
-            self.index['categories'][category]['count'] += 1
-            self.index['categories'][category]['materials'].append(material_id)
+        new_categories = []
+        if category and category not in self.index['categories']:
+            self.index['categories'][category] = {}
+            new_categories.append(category)
             
         # 保存索引
-        self._save_index()
+        self._persist(materials=[material_id], categories=new_categories)
         
-        logger.info(f"添加素材成功: {material_id}, 类型: {material_type}")
+        logger.info(f"添加素材成功: {material_id}, 类型: {ingested['material_type']}")
         
         return material_id
         
+    def add_materials_bulk(self,
+                           items: List[Dict],
+                           workers: int = 4,
+                           progress_callback: Callable[[int, int], None] = None,
+                           probe_fn: Callable[[str], Dict] = None,
+                           deduplicate: bool = True) -> List[Dict]:
+        """
+        批量并行添加素材
+        
+        文件的复制/移动、内容哈希和元数据探测在线程池中并行执行，
+        全部完成后在一次batch()中登记索引并提交。单个素材失败不影响其他素材。
+        
+        Args:
+            items: 素材列表，每项包含file_path、material_type，以及可选的metadata、tags、category、move_file(默认True)
+            workers: 并行线程数
+            progress_callback: 进度回调，参数为(已完成数量, 总数量)，在每个文件处理完成后调用
+            probe_fn: 媒体元数据探测函数，参数为仓库内的文件路径，返回的字典并入元数据(显式传入的元数据优先)；
+                默认使用仓库的媒体探测器(见media_probe参数)
+            deduplicate: 是否按内容去重，同add_material
+            
+        Returns:
+            与items一一对应的结果列表，每项为{'file_path', 'material_id', 'error'}，失败时material_id为None
+        """
+        results = [
+            {'file_path': item.get('file_path'), 'material_id': None, 'error': None}
+            for item in items
+        ]
+        total = len(items)
+        if probe_fn is None:
+            probe_fn = self.prober
+        
+        def ingest(item):
+            ingested = self._ingest_file(item['file_path'], item['material_type'], item.get('move_file', True))
+            return ingested, self._probe(ingested['target_path'], probe_fn)
+            
+        staged = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(ingest, item): i for i, item in enumerate(items)}
+            for completed, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                i = futures[future]
+                try:
+                    staged[i] = future.result()
+                except Exception as e:
+                    results[i]['error'] = str(e)
+                    logger.error(f"导入素材文件失败: {results[i]['file_path']}, {str(e)}")
+                if progress_callback is not None:
+                    progress_callback(completed, total)
+                    
+        # 按输入顺序登记，整批一次提交
+        with self.batch():
+            for i in sorted(staged):
+                ingested, probed = staged[i]
+                item = items[i]
+                metadata = dict(probed)
+                metadata.update(item.get('metadata') or {})
+                try:
+                    results[i]['material_id'] = self._register_material(
+                        ingested, metadata, item.get('tags'), item.get('category'), deduplicate
+                    )
+                except Exception as e:
+                    results[i]['error'] = str(e)
+                    logger.error(f"登记素材失败: {results[i]['file_path']}, {str(e)}")
+                    entry = (ingested['target_path'], ingested['source_path'], ingested['moved'])
+                    if entry in self._batch.ingested_files:
+                        self._batch.ingested_files.remove(entry)
+                    self._discard_ingested(ingested)
+                    
+        failed = sum(1 for result in results if result['error'])
+        logger.info(f"批量添加素材完成: 成功{total - failed}个, 失败{failed}个")
+        return results
+        
+    def probe_materials(self,
+                        material_ids: Iterable[str] = None,
+                        workers: int = 4,
+                        overwrite: bool = False,
+                        batch_size: int = 500) -> Dict:
+        """
+        为已有素材补充媒体信息(时长、分辨率、编码、码率、帧率)
+        
+        探测在线程池中并行执行且不持有仓库锁，结果按批写入；已有的元数据字段默认保留。
+        
+        Args:
+            material_ids: 要探测的素材ID，None表示所有还没有媒体信息的素材
+            workers: 并行线程数
+            overwrite: 是否覆盖已有的同名元数据字段
+            batch_size: 每批提交的素材数
+            
+        Returns:
+            {'probed': 写入了媒体信息的素材数, 'skipped': 未探测到信息的素材数}
+        """
+        if self.prober is None:
+            raise RuntimeError("没有可用的媒体探测方式(需要ffprobe或PyAV)")
+        with self._lock:
+            self._refresh_if_stale()
+            materials = self.index['materials']
+            if material_ids is None:
+                records = materials.scan() if hasattr(materials, 'scan') else materials.values()
+                material_ids = [
+                    m['id'] for m in records
+                    if not any(field in (m.get('metadata') or {}) for field in PROBE_FIELDS)
+                ]
+            paths = {mid: materials[mid]['file_path'] for mid in material_ids if mid in materials}
+            
+        report = {'probed': 0, 'skipped': 0}
+        ordered = sorted(paths)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for start in range(0, len(ordered), batch_size):
+                chunk = ordered[start:start + batch_size]
+                probed = dict(zip(chunk, pool.map(lambda mid: self._probe(paths[mid], self.prober), chunk)))
+                with self.batch():
+                    for material_id, info in probed.items():
+                        material = self.index['materials'].get(material_id)
+                        if not info or material is None or material['file_path'] != paths[material_id]:
+                            report['skipped'] += 1
+                            continue
+                        self._journal(materials=[material_id])
+                        self.indexes.remove(material)
+                        if overwrite:
+                            material['metadata'].update(info)
+                        else:
+                            material['metadata'] = {**info, **material['metadata']}
+                        self.indexes.add(material)
+                        self._persist(materials=[material_id])
+                        report['probed'] += 1
+                        
+        logger.info(f"补充素材媒体信息完成: {report}")
+        return report
+        
     def get_material(self, material_id: str) -> Optional[Dict]:
         """
         获取素材信息
@@ -208,22 +1084,37 @@ class MaterialRepository:
             material_id: 素材ID
             
         Returns:
-            素材信息字典，如果不存在则返回None
+            素材信息字典(revision为记录的版本号，可用于修改时的乐观并发检查)，如果不存在则返回None
         """
-        if material_id in self.index['materials']:
-            # 更新访问时间
-            self.index['materials'][material_id]['last_accessed'] = datetime.datetime.now().isoformat()
-            self._save_index()
+        with self._lock:
+            self._refresh_if_stale()
+        material = self.index['materials'].get(material_id)
+        if material is not None:
+            # 更新访问时间(只修改内存，由访问跟踪器在后台写入)
+            now = self._touch(material)
+            self.access_tracker.record(material_id, now)
             
-            return self.index['materials'][material_id]
+            return material
         else:
             logger.warning(f"素材不存在: {material_id}")
             return None
             
+    def _touch(self, material: Dict, now: str = None) -> str:
+        """更新素材的访问时间并同步访问时间索引，返回新的时间"""
+        now = now or datetime.datetime.now().isoformat()
+        with self._lock:
+            # 访问时间索引延迟到下次按访问时间排序时批量更新
+            material['last_accessed'] = now
+            self.indexes.touch(material)
+        return now
+        
     def get_material_path(self, material_id: str) -> Optional[str]:
         """
         获取素材文件路径
         
+        启用分层存储时，冷层文件的路径同样可以直接读取，同时加入提升队列由后台移回热层；
+        文件移到另一层后原路径保留unlink_grace秒，返回的路径在此期间仍然可以打开。
+        
         Args:
             material_id: 素材ID
             
@@ -232,13 +1123,17 @@ class MaterialRepository:
         """
         material = self.get_material(material_id)
         if material:
+            if self.tiers is not None:
+                self.tiers.record_access(material)
             return material['file_path']
         return None
         
+    @_exclusive
     def update_material_metadata(self, 
                                material_id: str, 
                                metadata: Dict,
-                               merge: bool = True) -> bool:
+                               merge: bool = True,
+                               expected_revision: int = None) -> bool:
         """
         更新素材元数据
         
@@ -246,6 +1141,7 @@ class MaterialRepository:
             material_id: 素材ID
             metadata: 新的元数据
             merge: 是否合并现有元数据
+            expected_revision: 读取时的记录版本号，与当前版本不一致时抛出RevisionConflict
             
         Returns:
             更新是否成功
@@ -253,21 +1149,25 @@ class MaterialRepository:
         if material_id not in self.index['materials']:
             logger.warning(f"素材不存在: {material_id}")
             return False
+        self._check_revision(material_id, expected_revision)
             
         try:
+            self._journal(materials=[material_id])
+            material = self.index['materials'][material_id]
+            self.indexes.remove(material)
             if merge:
                 # 合并元数据
-                current_metadata = self.index['materials'][material_id]['metadata']
-                current_metadata.update(metadata)
+                material['metadata'].update(metadata)
             else:
                 # 替换元数据
-                self.index['materials'][material_id]['metadata'] = metadata
+                material['metadata'] = metadata
+            self.indexes.add(material)
                 
             # 更新修改时间
-            self.index['materials'][material_id]['last_accessed'] = datetime.datetime.now().isoformat()
+            self._touch(material)
             
             # 保存索引
-            self._save_index()
+            self._persist(materials=[material_id])
             
             logger.info(f"更新素材元数据成功: {material_id}")
             return True
@@ -276,10 +1176,12 @@ class MaterialRepository:
             logger.error(f"更新素材元数据失败: {str(e)}")
             return False
             
+    @_exclusive
     def update_material_tags(self, 
                            material_id: str, 
                            tags: List[str],
-                           replace: bool = False) -> bool:
+                           replace: bool = False,
+                           expected_revision: int = None) -> bool:
         """
         更新素材标签
         
@@ -287,6 +1189,7 @@ class MaterialRepository:
             material_id: 素材ID
             tags: 标签列表
             replace: 是否替换现有标签
+            expected_revision: 读取时的记录版本号，与当前版本不一致时抛出RevisionConflict
             
         Returns:
             更新是否成功
@@ -294,21 +1197,26 @@ class MaterialRepository:
         if material_id not in self.index['materials']:
             logger.warning(f"素材不存在: {material_id}")
             return False
+        self._check_revision(material_id, expected_revision)
             
         try:
+            self._journal(materials=[material_id])
+            material = self.index['materials'][material_id]
+            self.indexes.remove(material)
             if replace:
-                self.index['materials'][material_id]['tags'] = tags
+                material['tags'] = tags
             else:
                 # 合并标签并去重
-                current_tags = set(self.index['materials'][material_id]['tags'])
+                current_tags = set(material['tags'])
                 current_tags.update(tags)
-                self.index['materials'][material_id]['tags'] = list(current_tags)
+                material['tags'] = list(current_tags)
+            self.indexes.add(material)
                 
             # 更新修改时间
-            self.index['materials'][material_id]['last_accessed'] = datetime.datetime.now().isoformat()
+            self._touch(material)
             
             # 保存索引
-            self._save_index()
+            self._persist(materials=[material_id])
             
             logger.info(f"更新素材标签成功: {material_id}")
             return True
@@ -317,13 +1225,23 @@ class MaterialRepository:
             logger.error(f"更新素材标签失败: {str(e)}")
             return False
             
-    def delete_material(self, material_id: str, delete_file: bool = True) -> bool:
+    @_exclusive
+    def delete_material(self,
+                        material_id: str,
+                        delete_file: bool = True,
+                        expected_revision: int = None,
+                        permanent: bool = False) -> bool:
         """
         删除素材
         
+        默认只留下墓碑：素材立即从索引和检索结果中消失，undelete_window内可以用undelete_material()恢复，
+        之后由垃圾回收(见garbage_collector模块)分批删除文件。
+        
         Args:
             material_id: 素材ID
             delete_file: 是否删除文件
+            expected_revision: 读取时的记录版本号，与当前版本不一致时抛出RevisionConflict
+            permanent: 是否立即彻底删除(不留墓碑，同步删除文件)
             
         Returns:
             删除是否成功
@@ -331,31 +1249,62 @@ class MaterialRepository:
         if material_id not in self.index['materials']:
             logger.warning(f"素材不存在: {material_id}")
             return False
+        self._check_revision(material_id, expected_revision)
             
         try:
             material = self.index['materials'][material_id]
+            # 其他素材指向该素材的关联由反向邻接表查出，只需修改这些引用方
+            referrers = [sid for sid in self.indexes.relations.incoming(material_id) if sid != material_id]
+            self._journal(materials=[material_id, *referrers], categories=[material.get('category')],
+                          tombstones=[material_id])
             
-            # 删除文件
-            if delete_file and os.path.exists(material['file_path']):
-                os.remove(material['file_path'])
+            if permanent:
+                # 删除文件(批量模式下在提交成功后删除)，仍被其他素材或墓碑引用的文件保留
+                shared = (self._file_references(material)
+                          | self._tombstone_references(material['file_path'])) - {material_id}
+                if shared:
+                    logger.info(f"素材文件仍被{len(shared)}个素材引用，保留文件: {material['file_path']}")
+                elif delete_file and os.path.exists(material['file_path']):
+                    if self._batch is not None:
+                        self._batch.files_to_delete.append(material['file_path'])
+                    else:
+                        os.remove(material['file_path'])
+            else:
+                # 墓碑保存素材记录和引用方的关联，用于恢复
+                now = datetime.datetime.now()
+                self.index['tombstones'][material_id] = {
+                    'material': material,
+                    'referrers': {
+                        sid: [dict(relation) for relation in self.index['materials'][sid]['related_materials']
+                              if relation.get('id') == material_id]
+                        for sid in referrers
+                    },
+                    'deleted_at': now.isoformat(),
+                    'purge_after': (now + datetime.timedelta(seconds=self.undelete_window)).isoformat(),
+                    'state': 'deleted',
+                    'delete_file': delete_file
+                }
                 
-            # 更新分类
+            # 从索引中删除(先于分类计数，按需构建的索引部分以当前素材为准)
+            self.indexes.remove(material)
+            del self.index['materials'][material_id]
+            self.access_tracker.discard(material_id)
+            for source_id in referrers:
+                self._drop_relations(source_id, material_id)
+
+            # 如果分类为空，考虑删除它
+            deleted_categories = []
             category = material.get('category')
             if category and category in self.index['categories']:
-                if material_id in self.index['categories'][category]['materials']:
-                    self.index['categories'][category]['materials'].remove(material_id)
-                self.index['categories'][category]['count'] -= 1
-                
-                # 如果分类为空，考虑删除它
-                if self.index['categories'][category]['count'] <= 0:
+                if self.indexes.categories.count(category) == 0:
                     del self.index['categories'][category]
+                    deleted_categories.append(category)
             
-            # 从索引中删除
-            del self.index['materials'][material_id]
             self.index['total_materials'] -= 1
             
             # 保存索引
-            self._save_index()
+            self._persist(materials=referrers, deleted_materials=[material_id], deleted_categories=deleted_categories,
+                          tombstones=() if permanent else [material_id])
             
             logger.info(f"删除素材成功: {material_id}")
             return True
@@ -364,120 +1313,533 @@ class MaterialRepository:
             logger.error(f"删除素材失败: {str(e)}")
             return False
             
-    def search_materials(self, 
-                        query: str = None, 
-                        material_type: str = None,
-                        tags: List[str] = None,
-                        category: str = None,
-                        metadata_filters: Dict = None,
-                        limit: int = 100,
-                        offset: int = 0) -> Tuple[List[Dict], int]:
+    @_exclusive
+    def undelete_material(self, material_id: str) -> bool:
         """
-        搜索素材
+        恢复已删除但文件尚未回收的素材，包括其他素材指向它的关联
+        
+        删除后文件被移走时(例如共享的文件被分层存储降级)，改用内容哈希相同的现有文件。
         
         Args:
-            query: 搜索关键词
-            material_type: 素材类型
-            tags: 标签列表(与关系)
-            category: 分类
-            metadata_filters: 元数据过滤条件
-            limit: 返回结果数量限制
-            offset: 结果偏移量
+            material_id: 素材ID
             
         Returns:
-            匹配的素材列表和总数量
+            恢复是否成功
         """
-        results = []
-        
-        # 首先按分类过滤
-        if category and category in self.index['categories']:
-            # 获取分类中的所有素材ID
-            material_ids = self.index['categories'][category]['materials']
-            candidates = {mid: self.index['materials'][mid] for mid in material_ids if mid in self.index['materials']}
-        else:
-            # 使用所有素材
-            candidates = self.index['materials']
+        tombstone = self.index['tombstones'].get(material_id)
+        if tombstone is None:
+            logger.warning(f"没有可恢复的已删除素材: {material_id}")
+            return False
+        if tombstone['state'] != 'deleted':
+            logger.warning(f"素材文件正在回收，无法恢复: {material_id}")
+            return False
             
-        # 按照条件过滤
-        for material_id, material in candidates.items():
-            # 按类型过滤
-            if material_type and material['type'] != material_type:
-                continue
-                
-            # 按标签过滤(必须包含所有指定标签)
-            if tags:
-                material_tags = set(material['tags'])
-                if not all(tag in material_tags for tag in tags):
-                    continue
-                    
-            # 按元数据过滤
-            if metadata_filters:
-                material_metadata = material['metadata']
-                match = True
-                
-                for key, value in metadata_filters.items():
-                    # 嵌套键名处理 (例如 "video.duration")
-                    if '.' in key:
-                        parts = key.split('.')
-                        curr = material_metadata
-                        for part in parts[:-1]:
-                            if part not in curr:
-                                match = False
-                                break
-                            curr = curr[part]
-                        
-                        if not match or parts[-1] not in curr or curr[parts[-1]] != value:
-                            match = False
-                    else:
-                        if key not in material_metadata or material_metadata[key] != value:
-                            match = False
-                            
-                if not match:
-                    continue
-                    
-            # 关键词搜索
-            if query:
-                query_lower = query.lower()
-                
-                # 搜索原始文件名
-                if query_lower in material['original_filename'].lower():
-                    results.append(material)
-                    continue
-                    
-                # 搜索标签
-                found_in_tags = False
-                for tag in material['tags']:
-                    if query_lower in tag.lower():
-                        found_in_tags = True
-                        break
-                        
-                if found_in_tags:
-                    results.append(material)
-                    continue
-                    
-                # 搜索元数据的值
-                found_in_metadata = False
-                for k, v in material['metadata'].items():
-                    if isinstance(v, str) and query_lower in v.lower():
-                        found_in_metadata = True
-                        break
-                        
-                if found_in_metadata:
-                    results.append(material)
-                    continue
-            else:
-                # 没有查询关键词，添加到结果
-                results.append(material)
-                
-        # 按最后访问时间排序(最近访问的排在前面)
-        results.sort(key=lambda x: x['last_accessed'], reverse=True)
+        material = copy.deepcopy(tombstone['material'])
+        if not os.path.exists(material['file_path']):
+            existing = self._find_by_content(material['content_hash']) if material.get('content_hash') else None
+            if existing is None:
+                logger.warning(f"素材文件已不存在，无法恢复: {material['file_path']}")
+                return False
+            material['file_path'] = existing['file_path']
+            
+        materials = self.index['materials']
+        # 删除期间被删除的素材不再恢复关联
+        material['related_materials'] = [
+            relation for relation in material.get('related_materials') or [] if relation.get('id') in materials
+        ]
+        referrers = [sid for sid in tombstone.get('referrers', {}) if sid in materials]
+        category = material.get('category')
+        self._journal(materials=[material_id, *referrers], categories=[category], tombstones=[material_id])
         
-        # 应用分页
-        total_count = len(results)
-        results = results[offset:offset+limit]
+        del self.index['tombstones'][material_id]
+        materials[material_id] = material
+        self.index['total_materials'] += 1
+        self.indexes.add(material)
+        for source_id in referrers:
+            source = materials[source_id]
+            if not source.get('related_materials'):
+                source['related_materials'] = []
+            for relation in tombstone['referrers'][source_id]:
+                source['related_materials'].append(dict(relation))
+                self.indexes.relations.add_edge(source_id, material_id, relation.get('type', 'related'))
+                
+        new_categories = []
+        if category and category not in self.index['categories']:
+            self.index['categories'][category] = {}
+            new_categories.append(category)
+            
+        self._persist(materials=[material_id, *referrers], categories=new_categories,
+                      deleted_tombstones=[material_id])
+        
+        logger.info(f"恢复素材成功: {material_id}")
+        return True
+        
+    @_synchronized
+    def get_deleted_materials(self, limit: int = None, offset: int = 0) -> List[Dict]:
+        """
+        列出等待回收的已删除素材(按删除时间从新到旧)
+        
+        Args:
+            limit: 返回的最大条数，None表示全部
+            offset: 跳过的条数
+            
+        Returns:
+            [{'id', 'deleted_at', 'purge_after', 'state', 'material'}]，state为'deleted'(可恢复)或'purging'(正在回收)
+        """
+        tombstones = sorted(self.index['tombstones'].items(), key=lambda item: item[1]['deleted_at'], reverse=True)
+        end = None if limit is None else offset + limit
+        return [
+            {
+                'id': material_id,
+                'deleted_at': tombstone['deleted_at'],
+                'purge_after': tombstone['purge_after'],
+                'state': tombstone['state'],
+                'material': copy.deepcopy(tombstone['material'])
+            }
+            for material_id, tombstone in tombstones[offset:end]
+        ]
+        
+    def _tombstone_references(self, file_path: str) -> set:
+        """引用同一文件的墓碑(素材ID)"""
+        return {
+            material_id for material_id, tombstone in self.index['tombstones'].items()
+            if tombstone['material']['file_path'] == file_path
+        }
         
-        return results, total_count
+    def _find_by_content(self, content_hash: str) -> Optional[Dict]:
+        """查找内容哈希相同且文件仍然存在的素材"""
+        for material_id in self.indexes.content.get(content_hash):
+            material = self.index['materials'][material_id]
+            if os.path.exists(material['file_path']):
+                return material
+        return None
+        
+    def _file_references(self, material: Dict) -> set:
+        """引用同一文件的素材ID(包括素材自身)"""
+        content_hash = material.get('content_hash')
+        if not content_hash:
+            return {material['id']}
+        return {
+            material_id for material_id in self.indexes.content.get(content_hash)
+            if self.index['materials'][material_id]['file_path'] == material['file_path']
+        } | {material['id']}
+        
+    def find_materials_by_content(self, content_hash: str) -> List[Dict]:
+        """
+        查找内容哈希相同的素材
+        
+        Args:
+            content_hash: 文件内容的十六进制哈希
+            
+        Returns:
+            素材列表
+        """
+        return [self.index['materials'][mid] for mid in self.indexes.content.get(content_hash)]
+        
+    @_synchronized
+    def get_dedup_report(self) -> Dict:
+        """
+        获取内容去重报告
+        
+        Returns:
+            {'hashed_materials': 有内容哈希的素材数, 'unique_files': 实际保存的文件数,
+             'duplicate_references': 引用已有文件的素材数, 'bytes_stored': 实际占用字节数,
+             'bytes_saved': 去重节省的字节数, 'unhashed_materials': 尚未计算哈希的旧素材数}
+        """
+        report = {
+            'hashed_materials': 0,
+            'unique_files': 0,
+            'duplicate_references': 0,
+            'bytes_stored': 0,
+            'bytes_saved': 0,
+            'unhashed_materials': 0
+        }
+        materials = self.index['materials']
+        for _, material_ids in self.indexes.content.items():
+            paths = {}
+            for material_id in material_ids:
+                material = materials[material_id]
+                paths.setdefault(material['file_path'], material.get('file_size') or 0)
+            size = next(iter(paths.values()))
+            report['hashed_materials'] += len(material_ids)
+            report['unique_files'] += len(paths)
+            report['duplicate_references'] += len(material_ids) - len(paths)
+            report['bytes_stored'] += size * len(paths)
+            report['bytes_saved'] += size * (len(material_ids) - len(paths))
+        report['unhashed_materials'] = len(materials) - report['hashed_materials']
+        return report
+        
+    @_exclusive
+    def deduplicate_existing(self) -> Dict:
+        """
+        为没有内容哈希的旧素材计算哈希，并将内容重复的素材合并为引用同一文件
+        
+        Returns:
+            去重报告(同get_dedup_report)，另含本次处理的hashed和merged数量
+        """
+        hashed, merged = 0, 0
+        with self.batch():
+            for material_id, material in list(self.index['materials'].items()):
+                if material.get('content_hash') or not os.path.exists(material['file_path']):
+                    continue
+                    
+                try:
+                    content_hash, file_size = hash_file(material['file_path'])
+                except OSError as e:
+                    logger.error(f"计算素材内容哈希失败: {material_id}, {str(e)}")
+                    continue
+                    
+                existing = self._find_by_content(content_hash)
+                self._journal(materials=[material_id])
+                self.indexes.remove(material)
+                material['content_hash'] = content_hash
+                material['file_size'] = file_size
+                if existing is not None and existing['file_path'] != material['file_path']:
+                    self._batch.files_to_delete.append(material['file_path'])
+                    material['file_path'] = existing['file_path']
+                    merged += 1
+                self.indexes.add(material)
+                self._persist(materials=[material_id])
+                hashed += 1
+                
+        logger.info(f"素材去重完成: 计算哈希{hashed}个, 合并{merged}个")
+        report = self.get_dedup_report()
+        report.update({'hashed': hashed, 'merged': merged})
+        return report
         
+    def reshard(self,
+                layout: Dict,
+                batch_size: int = 500,
+                progress_callback: Callable[[int, int], None] = None) -> Dict:
+        """
+        将素材文件迁移到新的目录布局(在线、可中断后重新执行以继续)
+        
+        新导入的素材立即使用新布局。已有文件按批迁移，每批持有仓库锁并作为一次批量提交：
+        先在新路径创建硬链接，提交索引后再删除旧路径，批次之间其他线程可以正常读写。
+        中断后重新执行会跳过已迁移的文件，并复用上次已创建的新路径。
+        
+        Args:
+            layout: 新布局，例如 {'levels': 2, 'width': 2}
+            batch_size: 每批迁移的文件数
+            progress_callback: 进度回调，参数为(已处理文件数, 总文件数)
+            
+        Returns:
+            {'moved': 迁移的文件数, 'skipped': 已在新布局中的文件数, 'failed': 失败的文件数, 'layout': 新布局}
+        """
+        layout = normalize_layout(layout)
+        with self._write_lock():
+            if self.index['layout'] != layout:
+                self.index['layout'] = layout
+                self._persist()
+            # 同一文件可能被多个去重素材引用，按文件分组迁移
+            files = {}
+            for material_id, material in self.index['materials'].items():
+                files.setdefault(material['file_path'], []).append(material_id)
+                
+        report = {'moved': 0, 'skipped': 0, 'failed': 0, 'layout': layout}
+        pending = list(files.items())
+        total = len(pending)
+        
+        for start in range(0, total, batch_size):
+            with self.batch():
+                for old_path, material_ids in pending[start:start + batch_size]:
+                    new_path = relocated_path(self.base_dir, old_path, layout)
+                    if new_path is None or new_path == old_path:
+                        report['skipped'] += 1
+                        continue
+                        
+                    # 批次之间素材可能已被删除或修改
+                    material_ids = [
+                        mid for mid in material_ids
+                        if self.index['materials'].get(mid, {}).get('file_path') == old_path
+                    ]
+                    if not material_ids:
+                        report['skipped'] += 1
+                        continue
+                        
+                    try:
+                        self._relocate_file(old_path, new_path)
+                    except OSError as e:
+                        report['failed'] += 1
+                        logger.error(f"迁移素材文件失败: {old_path}, {str(e)}")
+                        continue
+                        
+                    self._journal(materials=material_ids)
+                    for material_id in material_ids:
+                        material = self.index['materials'][material_id]
+                        self.indexes.remove(material)
+                        material['file_path'] = new_path
+                        self.indexes.add(material)
+                    self._persist(materials=material_ids)
+                    self._batch.files_to_delete.append(old_path)
+                    report['moved'] += 1
+                    
+            if progress_callback is not None:
+                progress_callback(min(start + batch_size, total), total)
+                
+        logger.info(f"素材目录布局迁移完成: {report}")
+        return report
+        
+    @staticmethod
+    def _relocate_file(old_path: str, new_path: str):
+        """在新路径创建旧文件的硬链接(不支持时复制)，旧路径由调用方在提交后删除"""
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        if os.path.exists(new_path):
+            # 上次中断时已创建的链接
+            if os.path.exists(old_path) and os.path.samefile(old_path, new_path):
+                return
+            if not os.path.exists(old_path):
+                return
+            raise FileExistsError(f"新路径已存在其他文件: {new_path}")
+        try:
+            os.link(old_path, new_path)
+        except OSError:
+            shutil.copy2(old_path, new_path)
+            
+    def search_materials(self, 
+                        query: str = None, 
+                        material_type: str = None,
+                        tags: List[str] = None,
+                        category: str = None,
+                        metadata_filters: Dict = None,
+                        limit: int = 100,
+                        offset: int = 0,
+                        added_after: Union[str, datetime.datetime] = None,
+                        added_before: Union[str, datetime.datetime] = None,
+                        sort_by: str = 'last_accessed',
+                        descending: bool = True,
+                        cursor: str = None) -> Tuple[List[Dict], int]:
+        """
+        搜索素材
+        
+        Args:
+            query: 搜索关键词
+            material_type: 素材类型
+            tags: 标签列表(与关系)
+            category: 分类
+            metadata_filters: 元数据过滤条件，键为点分路径；值为普通值时表示相等，
+                也可以是操作符字典，例如 {'video.duration': {'$gte': 10, '$lte': 30},
+                'height': {'$gte': 1080}, 'platform': {'$in': ['douyin', 'tiktok']},
+                'title': {'$prefix': '春节'}}
+            limit: 返回结果数量限制
+            offset: 结果偏移量
+            added_after: 只返回此时间(含)之后添加的素材
+            added_before: 只返回此时间(含)之前添加的素材
+            sort_by: 排序字段，见search_page
+            descending: 是否降序
+            cursor: 上一页返回的游标，见search_page
+            
+        Returns:
+            匹配的素材列表和总数量
+        """
+        page = self.search_page(
+            query=query, material_type=material_type, tags=tags, category=category,
+            metadata_filters=metadata_filters, limit=limit, offset=offset,
+            added_after=added_after, added_before=added_before,
+            sort_by=sort_by, descending=descending, cursor=cursor
+        )
+        return page['items'], page['total']
+        
+    @_synchronized
+    def search_page(self,
+                    query: str = None,
+                    material_type: str = None,
+                    tags: List[str] = None,
+                    category: str = None,
+                    metadata_filters: Dict = None,
+                    limit: int = 100,
+                    offset: int = 0,
+                    added_after: Union[str, datetime.datetime] = None,
+                    added_before: Union[str, datetime.datetime] = None,
+                    sort_by: str = 'last_accessed',
+                    descending: bool = True,
+                    cursor: str = None) -> Dict[str, Any]:
+        """
+        分页搜索素材
+        
+        过滤条件与search_materials相同。结果按(排序值, 素材ID)排序，没有排序值的素材排在最后；
+        翻页时传入上一页的next_cursor，从上一页最后一条之后继续(keyset分页)，
+        深分页不必重新排序全部结果。
+        
+        Args:
+            sort_by: 排序字段：'last_accessed'(默认)、'added_at'、'duration'(元数据duration)、
+                'relevance'(关键词相关度，没有关键词时按last_accessed)，或已声明二级索引的元数据路径
+            descending: 是否降序
+            cursor: 上一页返回的next_cursor，排序方式必须与上一页相同
+            
+        Returns:
+            {'items': 素材列表, 'total': 匹配总数, 'next_cursor': 下一页游标(没有下一页时为None)}
+        """
+        if sort_by == 'relevance' and not query:
+            sort_by = 'last_accessed'
+            
+        candidate_ids, text_scores = self._filter_ids(
+            query=query, material_type=material_type, tags=tags, category=category,
+            metadata_filters=metadata_filters, added_after=added_after, added_before=added_before,
+            score=(sort_by == 'relevance')
+        )
+        materials = self.index['materials']
+            
+        # 选取排序值来源：有序索引优先，相关度取自全文检索分数
+        sorted_index = None
+        if sort_by == 'relevance':
+            value_of = lambda material_id: text_scores.get(material_id, MISSING)
+        elif sort_by in ('added_at', 'last_accessed'):
+            sorted_index = getattr(self.indexes, sort_by)
+            value_of = sorted_index.value_of
+        else:
+            path = SORT_FIELDS.get(sort_by, sort_by)
+            sorted_index = self.indexes.metadata.get(path)
+            if sorted_index is not None:
+                value_of = sorted_index.value_of
+            elif sort_by in SORT_FIELDS:
+                value_of = lambda material_id: coerce_value(
+                    get_path(materials[material_id]['metadata'], path), 'number'
+                )
+            else:
+                raise ValueError(f"不支持的排序字段: {sort_by}")
+                
+        after = decode_cursor(cursor, sort_by, descending) if cursor else None
+        page_ids, next_key = select_page(
+            candidate_ids, materials.keys(), value_of, limit,
+            offset=offset, descending=descending, after=after, sorted_index=sorted_index
+        )
+        
+        return {
+            'items': [materials[material_id] for material_id in page_ids],
+            'total': len(materials) if candidate_ids is None else len(candidate_ids),
+            'next_cursor': encode_cursor(sort_by, descending, next_key) if next_key else None
+        }
+        
+    @_synchronized
+    def facet_counts(self,
+                     filters: Dict = None,
+                     facets: Iterable[str] = ('type', 'category', 'tags'),
+                     limit: Optional[int] = 10) -> Dict[str, Any]:
+        """
+        统计满足过滤条件的素材在各分面上的取值分布，不读取素材记录也不排序结果
+        
+        类型、分类和标签分面用每个取值的倒排表与命中集合求交计数(没有过滤条件时直接取倒排表长度)；
+        元数据分面使用已声明的二级索引，未声明索引的路径逐条读取命中素材的元数据。
+        
+        Args:
+            filters: 过滤条件，键与search_materials的参数相同(query、material_type、tags、category、
+                metadata_filters、added_after、added_before)
+            facets: 分面：'type'、'category'、'tags'或'metadata.<点分路径>'
+            limit: 每个分面返回数量最多的前limit个取值，None表示全部
+            
+        Returns:
+            {'total': 命中总数, 'facets': {分面: [{'value': 取值, 'count': 数量}, ...]}}，
+            按数量降序、数量相同时按取值排序，数量为0的取值不返回
+        """
+        filters = dict(filters or {})
+        unknown = set(filters) - set(FACET_FILTERS)
+        if unknown:
+            raise ValueError(f"不支持的过滤条件: {sorted(unknown)}")
+        inverted = {'type': self.indexes.types, 'category': self.indexes.categories, 'tags': self.indexes.tags}
+        for facet in facets:
+            if facet not in inverted and not facet.startswith('metadata.'):
+                raise ValueError(f"不支持的分面: {facet}")
+                
+        candidate_ids, _ = self._filter_ids(**filters)
+        materials = self.index['materials']
+        
+        result = {}
+        for facet in facets:
+            if facet in inverted:
+                counts = {
+                    value: len(postings) if candidate_ids is None else len(postings.keys() & candidate_ids)
+                    for value, postings in inverted[facet].items()
+                }
+            else:
+                path = facet[len('metadata.'):]
+                index = self.indexes.metadata.get(path)
+                if index is not None:
+                    counts = index.value_counts(candidate_ids)
+                else:
+                    counts = {}
+                    for material_id in (materials.keys() if candidate_ids is None else candidate_ids):
+                        value = get_path(materials[material_id]['metadata'], path)
+                        for item in (value if isinstance(value, list) else [value]):
+                            if item is not MISSING and item is not None and not isinstance(item, (dict, list)):
+                                counts[item] = counts.get(item, 0) + 1
+                                
+            items = [(value, count) for value, count in counts.items() if count]
+            key = lambda item: (-item[1], str(item[0]))
+            top = sorted(items, key=key) if limit is None else heapq.nsmallest(limit, items, key=key)
+            result[facet] = [{'value': value, 'count': count} for value, count in top]
+            
+        return {
+            'total': len(materials) if candidate_ids is None else len(candidate_ids),
+            'facets': result
+        }
+        
+    def _filter_ids(self,
+                    query: str = None,
+                    material_type: str = None,
+                    tags: List[str] = None,
+                    category: str = None,
+                    metadata_filters: Dict = None,
+                    added_after: Union[str, datetime.datetime] = None,
+                    added_before: Union[str, datetime.datetime] = None,
+                    score: bool = False) -> Tuple[Optional[Collection[str]], Optional[Dict[str, float]]]:
+        """
+        求出满足过滤条件的素材ID(search_page和facet_counts共用，条件含义见search_materials)
+        
+        Args:
+            score: 是否计算关键词相关度
+            
+        Returns:
+            (素材ID集合，没有任何条件时为None表示全部素材; 关键词检索结果 {素材ID: 相关度}，没有关键词时为None)
+        """
+        # 能用索引求值的条件转换为谓词，由查询计划从选择度最高的谓词开始求交
+        predicates = []
+        if category:
+            predicates.append(postings_predicate(f"category:{category}", self.indexes.categories.get(category)))
+        if material_type:
+            predicates.append(postings_predicate(f"type:{material_type}", self.indexes.types.get(material_type)))
+        for tag in tags or ():
+            predicates.append(postings_predicate(f"tag:{tag}", self.indexes.tags.get(tag)))
+            
+        residual_filters = {}
+        for key, condition in (metadata_filters or {}).items():
+            index = self.indexes.metadata.get(key)
+            if index is not None:
+                predicates.append(index.predicate(condition))
+            else:
+                residual_filters[key] = condition
+                
+        if added_after or added_before:
+            condition = {}
+            if added_after:
+                condition['$gte'] = added_after
+            if added_before:
+                condition['$lte'] = added_before
+            predicates.append(self.indexes.added_at.predicate(condition))
+            
+        candidate_ids = plan_candidates(predicates)
+        materials = self.index['materials']
+        
+        # 关键词通过n-gram全文索引检索候选，再按子串语义校验
+        text_scores = None
+        if query:
+            text_scores = self.indexes.text.search(
+                query, materials, restrict=candidate_ids, score=score
+            )
+            candidate_ids = text_scores.keys()
+            
+        # 没有二级索引的元数据条件逐条过滤(嵌套键名例如 "video.duration")
+        if residual_filters:
+            candidate_ids = {
+                material_id
+                for material_id in (materials.keys() if candidate_ids is None else candidate_ids)
+                if all(match_condition(get_path(materials[material_id]['metadata'], key), condition)
+                       for key, condition in residual_filters.items())
+            }
+            
+        return candidate_ids, text_scores
+        
+    @_exclusive
     def create_category(self, category_name: str, description: str = None) -> bool:
         """
         创建素材分类
@@ -493,19 +1855,75 @@ class MaterialRepository:
             logger.warning(f"分类已存在: {category_name}")
             return False
             
+        self._journal(categories=[category_name])
         self.index['categories'][category_name] = {
-            'count': 0,
-            'materials': [],
             'description': description,
             'created_at': datetime.datetime.now().isoformat()
         }
         
         # 保存索引
-        self._save_index()
+        self._persist(categories=[category_name])
         
         logger.info(f"创建分类成功: {category_name}")
         return True
         
+    @_exclusive
+    def create_metadata_index(self, path: str, value_type: str = 'number') -> bool:
+        """
+        声明元数据二级索引，之后该路径上的过滤条件(含范围、前缀和IN)走索引
+        
+        Args:
+            path: 元数据点分路径，例如 'video.duration'
+            value_type: 值类型('number'、'string'、'datetime')
+            
+        Returns:
+            创建是否成功
+        """
+        if value_type not in VALUE_TYPES:
+            raise ValueError(f"不支持的索引值类型: {value_type}")
+            
+        if self.index['secondary_indexes'].get(path) == value_type:
+            logger.warning(f"元数据索引已存在: {path}")
+            return False
+            
+        self.indexes.define_metadata_index(path, value_type, self.index['materials'].values())
+        self.index['secondary_indexes'][path] = value_type
+        self._persist()
+        
+        logger.info(f"创建元数据索引成功: {path} ({value_type})")
+        return True
+        
+    @_exclusive
+    def drop_metadata_index(self, path: str) -> bool:
+        """
+        删除元数据二级索引
+        
+        Args:
+            path: 元数据点分路径
+            
+        Returns:
+            删除是否成功
+        """
+        if path not in self.index['secondary_indexes']:
+            logger.warning(f"元数据索引不存在: {path}")
+            return False
+            
+        del self.index['secondary_indexes'][path]
+        self.indexes.drop_metadata_index(path)
+        self._persist()
+        
+        logger.info(f"删除元数据索引成功: {path}")
+        return True
+        
+    def get_metadata_indexes(self) -> Dict[str, str]:
+        """
+        获取已声明的元数据二级索引
+        
+        Returns:
+            {点分路径: 值类型}
+        """
+        return dict(self.index['secondary_indexes'])
+        
     def get_all_categories(self) -> Dict:
         """
         获取所有分类
@@ -513,15 +1931,19 @@ class MaterialRepository:
         Returns:
             分类字典
         """
-        return self.index['categories']
+        with self._lock:
+            self._refresh_if_stale()
+            return {name: self._category_view(name) for name in self.index['categories']}
         
-    def set_material_category(self, material_id: str, category: str) -> bool:
+    @_exclusive
+    def set_material_category(self, material_id: str, category: str, expected_revision: int = None) -> bool:
         """
         设置素材分类
         
         Args:
             material_id: 素材ID
             category: 分类名称
+            expected_revision: 读取时的记录版本号，与当前版本不一致时抛出RevisionConflict
             
         Returns:
             设置是否成功
@@ -529,6 +1951,7 @@ class MaterialRepository:
         if material_id not in self.index['materials']:
             logger.warning(f"素材不存在: {material_id}")
             return False
+        self._check_revision(material_id, expected_revision)
             
         # 获取当前分类
         current_category = self.index['materials'][material_id].get('category')
@@ -537,30 +1960,25 @@ class MaterialRepository:
         if current_category == category:
             return True
             
-        # 从当前分类移除
-        if current_category and current_category in self.index['categories']:
-            if material_id in self.index['categories'][current_category]['materials']:
-                self.index['categories'][current_category]['materials'].remove(material_id)
-            self.index['categories'][current_category]['count'] -= 1
-            
-        # 添加到新分类
-        if category:
-            # 如果分类不存在，创建它
-            if category not in self.index['categories']:
-                self.create_category(category)
-                
-            self.index['categories'][category]['materials'].append(material_id)
-            self.index['categories'][category]['count'] += 1
+        self._journal(materials=[material_id], categories=[current_category, category])
+        
+        # 如果新分类不存在，创建它
+        if category and category not in self.index['categories']:
+            self.create_category(category)
             
-        # 更新素材信息
-        self.index['materials'][material_id]['category'] = category
+        # 更新素材信息和分类倒排索引
+        material = self.index['materials'][material_id]
+        self.indexes.remove(material)
+        material['category'] = category
+        self.indexes.add(material)
         
         # 保存索引
-        self._save_index()
+        self._persist(materials=[material_id])
         
         logger.info(f"设置素材分类成功: {material_id} -> {category}")
         return True
         
+    @_exclusive
     def link_materials(self, source_id: str, target_id: str, relation_type: str = 'related') -> bool:
         """
         关联两个素材
@@ -573,38 +1991,172 @@ class MaterialRepository:
         Returns:
             关联是否成功
         """
+        return self._link(source_id, target_id, relation_type) is not None
+        
+    @_exclusive
+    def link_materials_bulk(self, links: Iterable[Tuple[str, str, str]]) -> Dict:
+        """
+        批量关联素材，全部关联作为一次批量提交写入
+        
+        Args:
+            links: (源素材ID, 目标素材ID, 关系类型)，关系类型可省略
+            
+        Returns:
+            {'linked': 新建的关联数, 'updated': 更新类型的关联数, 'failed': 素材不存在的关联数}
+        """
+        report = {'linked': 0, 'updated': 0, 'failed': 0}
+        with self.batch():
+            for link in links:
+                result = self._link(*link)
+                report[result or 'failed'] += 1
+        logger.info(f"批量关联素材完成: {report}")
+        return report
+        
+    def _link(self, source_id: str, target_id: str, relation_type: str = 'related') -> Optional[str]:
+        """添加或更新一条关联，返回'linked'、'updated'，素材不存在时返回None"""
         if source_id not in self.index['materials']:
             logger.warning(f"源素材不存在: {source_id}")
-            return False
+            return None
             
         if target_id not in self.index['materials']:
             logger.warning(f"目标素材不存在: {target_id}")
-            return False
+            return None
+            
+        self._journal(materials=[source_id])
+        material = self.index['materials'][source_id]
+        relations = self.indexes.relations
+        
+        # 通过关系图判断是否已关联，只在已存在时查找记录中的条目
+        if target_id in relations.outgoing(source_id):
+            for relation in material['related_materials']:
+                if relation.get('id') == target_id:
+                    # 更新关系类型
+                    relation['type'] = relation_type
+            relations.add_edge(source_id, target_id, relation_type)
+            self._persist(materials=[source_id])
+            return 'updated'
             
-        # 检查是否已关联
-        for relation in self.index['materials'][source_id].get('related_materials', []):
-            if relation.get('id') == target_id:
-                # 更新关系类型
-                relation['type'] = relation_type
-                self._save_index()
-                return True
-                
         # 添加关联
-        if 'related_materials' not in self.index['materials'][source_id]:
-            self.index['materials'][source_id]['related_materials'] = []
+        if not material.get('related_materials'):
+            material['related_materials'] = []
             
-        self.index['materials'][source_id]['related_materials'].append({
+        material['related_materials'].append({
             'id': target_id,
             'type': relation_type,
             'linked_at': datetime.datetime.now().isoformat()
         })
+        relations.add_edge(source_id, target_id, relation_type)
         
         # 保存索引
-        self._save_index()
+        self._persist(materials=[source_id])
         
         logger.info(f"关联素材成功: {source_id} -> {target_id} ({relation_type})")
+        return 'linked'
+        
+    @_exclusive
+    def unlink_materials(self, source_id: str, target_id: str) -> bool:
+        """
+        取消两个素材之间的关联
+        
+        Args:
+            source_id: 源素材ID
+            target_id: 目标素材ID
+            
+        Returns:
+            是否删除了关联
+        """
+        if target_id not in self.indexes.relations.outgoing(source_id):
+            logger.warning(f"素材关联不存在: {source_id} -> {target_id}")
+            return False
+            
+        self._journal(materials=[source_id])
+        self._drop_relations(source_id, target_id)
+        self._persist(materials=[source_id])
+        
+        logger.info(f"取消素材关联成功: {source_id} -> {target_id}")
         return True
         
+    def _drop_relations(self, source_id: str, target_id: str):
+        """从源素材记录和关系图中删除指向目标素材的关联"""
+        material = self.index['materials'][source_id]
+        material['related_materials'] = [
+            relation for relation in material['related_materials'] if relation.get('id') != target_id
+        ]
+        self.indexes.relations.remove_edge(source_id, target_id)
+        
+    @_synchronized
+    def get_related(self,
+                    material_id: str,
+                    depth: int = 1,
+                    types: Iterable[str] = None,
+                    direction: str = 'out',
+                    limit: int = None) -> List[Dict]:
+        """
+        查询k跳以内的关联素材(广度优先，环路中的素材只返回一次)
+        
+        Args:
+            material_id: 起点素材ID
+            depth: 最大跳数
+            types: 只沿这些关系类型查询，None表示全部
+            direction: 'out'(该素材关联到的)、'in'(关联到该素材的)或'both'
+            limit: 最多返回的素材数量
+            
+        Returns:
+            按距离排列的 {'id', 'depth', 'relation_type', 'direction', 'via', 'material'}；
+            via为到达该素材的上一跳素材ID
+        """
+        if material_id not in self.index['materials']:
+            logger.warning(f"素材不存在: {material_id}")
+            return []
+            
+        results = []
+        for entry in self.indexes.relations.traverse(material_id, depth, types, direction, limit):
+            material = self.index['materials'].get(entry['id'])
+            if material is not None:
+                entry['material'] = material
+                results.append(entry)
+        return results
+        
+    @_exclusive
+    def check_indexes(self, repair: bool = False) -> Dict:
+        """
+        检查倒排索引、分类和素材总数与素材记录是否一致
+        
+        Args:
+            repair: 发现不一致时是否根据素材记录重建
+            
+        Returns:
+            检查报告，包含consistent、issues和repaired字段
+        """
+        issues = self.indexes.check(self.index['materials'].values())
+        
+        unregistered = [
+            name for name in self.indexes.categories.keys()
+            if name not in self.index['categories']
+        ]
+        if unregistered:
+            issues['unregistered_categories'] = unregistered
+            
+        if self.index['total_materials'] != len(self.index['materials']):
+            issues['total_materials'] = {
+                'recorded': self.index['total_materials'],
+                'actual': len(self.index['materials'])
+            }
+            
+        repaired = False
+        if issues and repair:
+            registered = self._rebuild_indexes()
+            repaired = self._persist(categories=registered)
+            logger.info(f"修复素材索引完成: {list(issues)}")
+        elif issues:
+            logger.warning(f"素材索引不一致: {list(issues)}")
+            
+        return {
+            'consistent': not issues,
+            'issues': issues,
+            'repaired': repaired
+        }
+        
     def get_statistics(self) -> Dict:
         """
         获取素材库统计信息
@@ -612,63 +2164,94 @@ class MaterialRepository:
         Returns:
             统计信息字典
         """
-        stats = {
-            'total_materials': self.index['total_materials'],
-            'total_categories': len(self.index['categories']),
-            'type_counts': {},
-            'top_tags': {},
-            'recent_materials': []
-        }
+        return copy.deepcopy(self.get_statistics_snapshot()['statistics'])
         
-        # 统计各类型素材数量
-        for material in self.index['materials'].values():
-            material_type = material['type']
-            if material_type not in stats['type_counts']:
-                stats['type_counts'][material_type] = 0
-            stats['type_counts'][material_type] += 1
-            
-            # 统计标签
-            for tag in material['tags']:
-                if tag not in stats['top_tags']:
-                    stats['top_tags'][tag] = 0
-                stats['top_tags'][tag] += 1
-                
-        # 获取最近添加的素材
-        recent_materials = sorted(
-            self.index['materials'].values(),
-            key=lambda x: x['added_at'],
-            reverse=True
-        )[:10]
-        
-        stats['recent_materials'] = [
-            {
+    @_synchronized
+    def get_statistics_snapshot(self, known_version: str = None) -> Optional[Dict]:
+        """
+        获取带版本号的统计快照，素材库未修改时直接返回缓存
+        
+        版本号取自存储的变更序号，同一素材库的各个进程对相同的数据给出相同的版本号。
+        
+        Args:
+            known_version: 调用方已有快照的版本号，与当前版本相同时返回None(可用于条件GET)
+            
+        Returns:
+            {'version': 版本号, 'generated_at': 生成时间, 'statistics': 统计信息}，
+            快照未变化时返回None；返回的快照应视为只读
+        """
+        version = self._statistics_version()
+        if known_version is not None and known_version == version:
+            return None
+            
+        snapshot = self._statistics_snapshot
+        if snapshot is None or snapshot['version'] != version:
+            snapshot = self._statistics_snapshot = {
+                'version': version,
+                'generated_at': datetime.datetime.now().isoformat(),
+                'statistics': self._compute_statistics()
+            }
+        return snapshot
+        
+    def _statistics_version(self) -> str:
+        """
+        统计快照的版本号：内存与存储一致时为存储的变更序号；
+        有尚未写入或尚未确认的修改(例如批量模式中)时附加本进程的修改版本，不与其他进程的版本号相同
+        """
+        seq = self._seen_seq
+        version = '-'.join(map(str, seq)) if isinstance(seq, tuple) else str(seq)
+        if self._synced_version != self.content_version:
+            version = f"{version}+{self.content_version}"
+        return version
+        
+    def _compute_statistics(self, top_tags: int = 20, recent: int = 10) -> Dict:
+        """根据倒排索引中维护的计数和添加时间索引生成统计信息，不遍历素材记录"""
+        materials = self.index['materials']
+        
+        # 标签计数即倒排表长度，只在标签种类上取前N个
+        tag_counts = heapq.nlargest(
+            top_tags, self.indexes.tags.items(), key=lambda item: len(item[1])
+        )
+        
+        recent_materials = []
+        for _, material_id in self.indexes.added_at.iter_entries(reverse=True):
+            if len(recent_materials) == recent:
+                break
+            material = materials[material_id]
+            recent_materials.append({
                 'id': material['id'],
                 'type': material['type'],
                 'original_filename': material['original_filename'],
                 'added_at': material['added_at']
-            }
-            for material in recent_materials
-        ]
-        
-        # 限制标签数量
-        stats['top_tags'] = dict(sorted(
-            stats['top_tags'].items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:20])
-        
-        return stats
+            })
+            
+        return {
+            'total_materials': self.index['total_materials'],
+            'total_categories': len(self.index['categories']),
+            'type_counts': {
+                material_type: len(postings) for material_type, postings in self.indexes.types.items()
+            },
+            'category_counts': {
+                name: self.indexes.categories.count(name) for name in self.index['categories']
+            },
+            'top_tags': {tag: len(postings) for tag, postings in tag_counts},
+            'recent_materials': recent_materials
+        }
         
     def export_index(self, output_path: str = None) -> str:
         """
         导出素材索引
         
         Args:
-            output_path: 输出文件路径，默认为metadata目录下的时间戳文件
+            output_path: 输出文件路径，默认为metadata目录下的时间戳文件；
+                扩展名为.ndjson(.gz/.zst)时使用流式格式，见export_ndjson
             
         Returns:
             导出文件路径
         """
+        if output_path and is_stream_path(output_path):
+            return self.export_ndjson(output_path)
+            
         if not output_path:
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
             output_path = os.path.join(
@@ -679,7 +2262,10 @@ class MaterialRepository:
             
         try:
             with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(self.index, f, ensure_ascii=False, indent=2)
+                # 墓碑只对本素材库的文件有意义，不导出
+                index = self._serializable_index()
+                index.pop('tombstones', None)
+                json.dump(index, f, ensure_ascii=False, indent=2)
                 
             logger.info(f"导出素材索引成功: {output_path}")
             return output_path
@@ -688,21 +2274,33 @@ class MaterialRepository:
             logger.error(f"导出素材索引失败: {str(e)}")
             raise
             
+    @_exclusive
     def import_index(self, input_path: str, merge: bool = False) -> bool:
         """
         导入素材索引
         
         Args:
-            input_path: 输入文件路径
+            input_path: 输入文件路径，扩展名为.ndjson(.gz/.zst)时流式导入，见import_ndjson
             merge: 是否合并到现有索引
             
         Returns:
             导入是否成功
         """
+        if self._batch is not None:
+            raise RuntimeError("批量模式中不能导入索引")
+            
         if not os.path.exists(input_path):
             logger.error(f"索引文件不存在: {input_path}")
             return False
             
+        if is_stream_path(input_path):
+            try:
+                self.import_ndjson(input_path, merge_policy='skip' if merge else 'replace')
+                return True
+            except Exception as e:
+                logger.error(f"导入素材索引失败: {str(e)}")
+                return False
+                
         try:
             with open(input_path, 'r', encoding='utf-8') as f:
                 new_index = json.load(f)
@@ -713,24 +2311,23 @@ class MaterialRepository:
                     if material_id not in self.index['materials']:
                         self.index['materials'][material_id] = material
                         
-                # 合并分类
+                # 合并分类(成员关系由素材记录的category字段决定)
                 for category, info in new_index['categories'].items():
                     if category not in self.index['categories']:
                         self.index['categories'][category] = info
-                    else:
-                        # 合并素材列表
-                        materials_set = set(self.index['categories'][category]['materials'])
-                        materials_set.update(info['materials'])
-                        self.index['categories'][category]['materials'] = list(materials_set)
-                        self.index['categories'][category]['count'] = len(materials_set)
                         
-                # 更新总数量
-                self.index['total_materials'] = len(self.index['materials'])
-                
             else:
-                # 替换整个索引
+                # 替换整个索引(保留本素材库的墓碑，等待回收的文件仍由垃圾回收删除)；
+                # 没有记录布局的旧格式导出沿用当前布局
+                new_index.setdefault('categories', {})
+                new_index.setdefault('materials', {})
+                new_index['layout'] = normalize_layout(new_index.get('layout') or self.index['layout'])
+                new_index['tombstones'] = self.index['tombstones']
                 self.index = new_index
                 
+            # 重建分类成员关系、倒排索引和总数量
+            self._rebuild_indexes()
+            
             # 保存索引
             self._save_index()
             
@@ -740,6 +2337,321 @@ class MaterialRepository:
         except Exception as e:
             logger.error(f"导入素材索引失败: {str(e)}")
             return False
+            
+    def export_ndjson(self, output_path: str, compression: Optional[str] = 'auto') -> str:
+        """
+        流式导出素材索引(NDJSON，每行一条记录)
+        
+        首行为header(索引元信息)，其后每个分类、每个素材各一行，末行为end。
+        逐条编码写出，不需要在内存中生成整个JSON文档。
+        
+        Args:
+            output_path: 输出文件路径，扩展名为.gz/.zst时压缩
+            compression: 'auto'(按扩展名)、'gzip'、'zstd'(需要zstandard)或None
+            
+        Returns:
+            导出文件路径
+        """
+        tmp_path = f"{output_path}.tmp"
+        try:
+            with self._lock, open_stream(tmp_path, 'w', detect_compression(output_path, compression)) as f:
+                self._refresh_if_stale()
+                meta = {key: self.index.get(key) for key in META_FIELDS}
+                count = write_stream(
+                    f, meta, self.index['categories'].items(), self.index['materials'].values()
+                )
+            os.replace(tmp_path, output_path)
+            
+            logger.info(f"导出素材索引成功: {output_path}, {count}个素材")
+            return output_path
+            
+        except Exception as e:
+            logger.error(f"导出素材索引失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+            
+    def build_archive(self,
+                      fmt: str = 'zip',
+                      material_ids: Iterable[str] = None,
+                      category: str = None,
+                      search: Dict = None,
+                      include_manifest: bool = True) -> MaterialArchive:
+        """
+        生成一组素材的归档描述(不读取素材文件)，用于流式写入文件或HTTP响应
+        
+        素材按material_ids、category或search(search_page的过滤和排序参数)选择，三者都为None时为全部素材。
+        归档内的文件名为 "类型/原文件名_ID前8位.扩展名"，清单manifest.json放在最前面，
+        包含每个素材在归档中的路径和索引中的记录；文件不存在的素材列在清单的missing中。
+        选择结果和文件都不变时，多次生成的归档字节完全相同(etag相同)，可以按Range续传。
+        
+        Args:
+            fmt: 'zip'(存储方式，不压缩)或'tar'
+            material_ids: 素材ID列表
+            category: 分类
+            search: 搜索条件，例如 {'query': '春节', 'material_type': 'video', 'sort_by': 'added_at'}
+            include_manifest: 是否包含清单
+            
+        Returns:
+            MaterialArchive，size为归档总大小，iter_bytes(start, end)生成任意字节范围
+        """
+        with self._lock:
+            self._refresh_if_stale()
+            if material_ids is not None:
+                materials = [self.index['materials'][mid] for mid in material_ids if mid in self.index['materials']]
+            elif category is not None or search is not None:
+                conditions = dict(search or {})
+                if category is not None:
+                    conditions['category'] = category
+                conditions.setdefault('sort_by', 'added_at')
+                conditions.setdefault('descending', False)
+                materials, cursor = [], None
+                while True:
+                    page = self.search_page(limit=1000, cursor=cursor, **conditions)
+                    materials.extend(page['items'])
+                    cursor = page['next_cursor']
+                    if cursor is None:
+                        break
+            else:
+                materials = sorted(self.index['materials'].values(), key=lambda m: (m['added_at'], m['id']))
+            materials = [copy.deepcopy(material) for material in materials]
+            
+        entries, records, missing, used = [], [], [], set()
+        for material in materials:
+            original = material.get('original_filename') or os.path.basename(material['file_path'])
+            stem, ext = os.path.splitext(original.replace('/', '_').replace('\\', '_'))
+            name = f"{material['type']}/{stem}_{material['id'][:8]}{ext}"
+            if name in used:
+                name = f"{material['type']}/{stem}_{material['id']}{ext}"
+            try:
+                entry = file_entry(name, material['file_path'])
+            except OSError:
+                missing.append(material['id'])
+                continue
+            used.add(name)
+            entries.append(entry)
+            records.append({'path': name, **{k: v for k, v in material.items() if k != 'file_path'}})
+            
+        if include_manifest:
+            manifest = {
+                'format': fmt,
+                'selection': {'material_ids': list(material_ids) if material_ids is not None else None,
+                              'category': category, 'search': search},
+                'count': len(records),
+                'total_bytes': sum(entry['size'] for entry in entries),
+                'materials': records,
+                'missing': missing
+            }
+            data = json.dumps(manifest, ensure_ascii=False, indent=2, default=str).encode('utf-8')
+            mtime = max((entry['mtime'] for entry in entries), default=0)
+            entries.insert(0, data_entry(MANIFEST_NAME, data, mtime))
+            
+        if fmt == 'zip' and self._crc_cache is None:
+            self._crc_cache = CrcCache(os.path.join(self.base_dir, 'metadata', 'export_crc.db'))
+        return MaterialArchive(entries, fmt, crc_cache=self._crc_cache)
+        
+    def export_archive(self, output_path: str, fmt: str = None, resume: bool = True, **selection) -> Dict:
+        """
+        将一组素材打包写入文件(流式，不生成临时副本)
+        
+        Args:
+            output_path: 输出文件路径
+            fmt: 'zip'或'tar'，None时按扩展名判断
+            resume: 输出文件是同一归档中断后的部分内容时从末尾续写
+            **selection: material_ids、category、search、include_manifest，见build_archive
+            
+        Returns:
+            {'path', 'size', 'etag', 'count', 'resumed_from'}
+        """
+        if fmt is None:
+            fmt = 'tar' if output_path.lower().endswith('.tar') else 'zip'
+        archive = self.build_archive(fmt, **selection)
+        # 中断的输出文件旁边记录etag，归档内容不变时才续写
+        etag_path = f"{output_path}.etag"
+        start = 0
+        if resume and os.path.exists(output_path) and os.path.exists(etag_path):
+            with open(etag_path, 'r', encoding='utf-8') as f:
+                if f.read().strip() == archive.etag:
+                    start = min(os.path.getsize(output_path), archive.size)
+        with open(etag_path, 'w', encoding='utf-8') as f:
+            f.write(archive.etag)
+        with open(output_path, 'r+b' if start else 'wb') as f:
+            f.seek(start)
+            f.truncate()
+            archive.write_to(f, start)
+        os.remove(etag_path)
+        
+        count = len(archive.entries) - (1 if selection.get('include_manifest', True) else 0)
+        logger.info(f"打包导出素材成功: {output_path}, {count}个素材, {archive.size}字节")
+        return {'path': output_path, 'size': archive.size, 'etag': archive.etag, 'count': count, 'resumed_from': start}
+        
+    def import_ndjson(self,
+                      input_path: str,
+                      merge_policy: str = 'skip',
+                      resume: bool = True,
+                      batch_size: int = 1000,
+                      compression: Optional[str] = 'auto') -> Dict:
+        """
+        流式导入素材索引(NDJSON)
+        
+        逐行解析，每batch_size条记录作为一次批量提交，内存占用与文件大小无关；
+        每批提交后记录进度，中断后以相同参数重新调用会从上次提交的位置继续。
+        
+        Args:
+            input_path: 输入文件路径，扩展名为.gz/.zst时解压
+            merge_policy: 素材ID已存在时的处理方式：
+                'skip'保留现有记录；'overwrite'使用导入的记录；
+                'newer'保留last_accessed较新的记录；'replace'先清空现有索引(不删除文件)再导入
+            resume: 是否从上次中断的位置继续
+            batch_size: 每批提交的记录数
+            compression: 见export_ndjson
+            
+        Returns:
+            导入报告 {'imported', 'updated', 'skipped', 'categories', 'resumed_from_line', 'complete'}
+        """
+        if merge_policy not in MERGE_POLICIES:
+            raise ValueError(f"不支持的合并策略: {merge_policy}")
+        if self._batch is not None:
+            raise RuntimeError("批量模式中不能导入索引")
+            
+        state_path = os.path.join(self.base_dir, 'metadata', 'import_state.json')
+        fingerprint = stream_fingerprint(input_path)
+        state = self._load_import_state(state_path) if resume else None
+        if not state or state.get('input') != fingerprint or state.get('merge_policy') != merge_policy:
+            state = {'input': fingerprint, 'merge_policy': merge_policy, 'line': 0, 'cleared': False}
+            
+        report = {
+            'imported': 0,
+            'updated': 0,
+            'skipped': 0,
+            'categories': 0,
+            'resumed_from_line': state['line'],
+            'complete': False
+        }
+        
+        if merge_policy == 'replace' and not state['cleared']:
+            self._clear_index_records()
+            state['cleared'] = True
+            self._save_import_state(state_path, state)
+            
+        chunk = []
+        with open_stream(input_path, 'r', compression) as f:
+            for line_no, record in read_stream(f):
+                kind = record.get('record')
+                if kind == 'header':
+                    self._import_stream_header(record.get('meta') or {})
+                    continue
+                if kind == 'end':
+                    report['complete'] = True
+                    break
+                if line_no <= state['line']:
+                    continue
+                    
+                chunk.append(record)
+                if len(chunk) >= batch_size:
+                    self._import_stream_chunk(chunk, merge_policy, report)
+                    chunk = []
+                    state['line'] = line_no
+                    self._save_import_state(state_path, state)
+                    
+        if chunk:
+            self._import_stream_chunk(chunk, merge_policy, report)
+            
+        if report['complete']:
+            if os.path.exists(state_path):
+                os.remove(state_path)
+        else:
+            logger.warning(f"索引流缺少结束记录，文件可能不完整: {input_path}")
+            
+        logger.info(f"导入素材索引成功: {input_path}, {report}")
+        return report
+        
+    @staticmethod
+    def _load_import_state(state_path: str) -> Optional[Dict]:
+        """读取流式导入的断点"""
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+            
+    @staticmethod
+    def _save_import_state(state_path: str, state: Dict):
+        """原子写入流式导入的断点"""
+        tmp_path = f"{state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, state_path)
+        
+    def _clear_index_records(self):
+        """清空全部素材和分类记录(不删除文件)"""
+        with self.batch():
+            materials = list(self.index['materials'])
+            categories = list(self.index['categories'])
+            self._journal(materials=materials, categories=categories)
+            for material_id in materials:
+                self.indexes.remove(self.index['materials'].pop(material_id))
+                self.access_tracker.discard(material_id)
+            self.index['categories'].clear()
+            self.index['total_materials'] = 0
+            self._persist(deleted_materials=materials, deleted_categories=categories)
+            
+    def _import_stream_header(self, meta: Dict):
+        """导入索引流声明的元数据二级索引"""
+        for path, value_type in (meta.get('secondary_indexes') or {}).items():
+            if path not in self.index['secondary_indexes']:
+                self.create_metadata_index(path, value_type)
+                
+    def _import_stream_chunk(self, records: List[Dict], merge_policy: str, report: Dict):
+        """将一批索引流记录作为一次批量提交写入"""
+        with self.batch():
+            for record in records:
+                kind = record.get('record')
+                if kind == 'category':
+                    self._import_category(record['name'], record.get('data') or {}, merge_policy, report)
+                elif kind == 'material':
+                    self._import_material(record['data'], merge_policy, report)
+                else:
+                    logger.warning(f"忽略未知的索引流记录: {kind}")
+                    
+    def _import_category(self, name: str, info: Dict, merge_policy: str, report: Dict):
+        """按合并策略导入一个分类的属性"""
+        if name in self.index['categories'] and merge_policy in ('skip', 'newer'):
+            return
+        info = {k: v for k, v in info.items() if k not in ('count', 'materials')}
+        self._journal(categories=[name])
+        self.index['categories'][name] = info
+        self._persist(categories=[name])
+        report['categories'] += 1
+        
+    def _import_material(self, material: Dict, merge_policy: str, report: Dict):
+        """按合并策略导入一条素材记录"""
+        material_id = material['id']
+        current = self.index['materials'].get(material_id)
+        if current is not None:
+            if merge_policy == 'skip' or (
+                merge_policy == 'newer'
+                and (material.get('last_accessed') or '') <= (current.get('last_accessed') or '')
+            ):
+                report['skipped'] += 1
+                return
+                
+        category = material.get('category')
+        self._journal(materials=[material_id], categories=[category])
+        if current is not None:
+            self.indexes.remove(current)
+            report['updated'] += 1
+        else:
+            self.index['total_materials'] += 1
+            report['imported'] += 1
+        self.index['materials'][material_id] = material
+        self.indexes.add(material)
+        
+        new_categories = []
+        if category and category not in self.index['categories']:
+            self.index['categories'][category] = {}
+            new_categories.append(category)
+        self._persist(materials=[material_id], categories=new_categories)
 
 
 # 示例用法
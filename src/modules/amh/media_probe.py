@@ -0,0 +1,249 @@
+"""
+媒体元数据探测
+导入时用ffprobe(JSON输出)或PyAV读取时长、分辨率、编码、码率和帧率，写入素材元数据的类型化字段；
+结果按(设备, inode, 大小, 修改时间)缓存在metadata/probe_cache.db，同一文件(包括硬链接和重命名后的文件)只探测一次
+"""
+import os
+import json
+import shutil
+import sqlite3
+import logging
+import datetime
+import threading
+import subprocess
+from typing import Dict, Optional
+
+try:
+    import av
+except ImportError:
+    av = None
+
+logger = logging.getLogger(__name__)
+
+# 探测写入的元数据字段及其二级索引类型
+PROBE_FIELDS = {
+    'duration': 'number',
+    'width': 'number',
+    'height': 'number',
+    'fps': 'number',
+    'bitrate': 'number',
+    'video_codec': 'string',
+    'audio_codec': 'string',
+    'container': 'string',
+    'sample_rate': 'number',
+    'channels': 'number',
+}
+
+
+def _number(value, cast=float) -> Optional[float]:
+    try:
+        result = cast(float(value))
+    except (TypeError, ValueError):
+        return None
+    return result if result > 0 else None
+
+
+def _rate(value) -> Optional[float]:
+    """解析帧率，例如 "30000/1001" """
+    if not value or value in ('0/0', 'N/A'):
+        return None
+    if isinstance(value, str) and '/' in value:
+        numerator, _, denominator = value.partition('/')
+        numerator, denominator = _number(numerator), _number(denominator)
+        return round(numerator / denominator, 3) if numerator and denominator else None
+    result = _number(value)
+    return round(result, 3) if result else None
+
+
+def _finish(info: Dict) -> Dict:
+    """去掉未探测到的字段，并补充resolution字符串"""
+    info = {key: value for key, value in info.items() if value is not None}
+    if 'width' in info and 'height' in info:
+        info['resolution'] = f"{info['width']}x{info['height']}"
+    return info
+
+
+def parse_ffprobe(data: Dict) -> Dict:
+    """
+    将ffprobe的JSON输出转换为元数据字段
+
+    Args:
+        data: ffprobe -show_format -show_streams -of json 的输出
+
+    Returns:
+        PROBE_FIELDS中探测到的字段，以及 "宽x高" 形式的resolution
+    """
+    streams = data.get('streams') or []
+    fmt = data.get('format') or {}
+    # 封面图等附加图片不算视频流
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not (s.get('disposition') or {}).get('attached_pic')), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    info = {
+        'duration': _number(fmt.get('duration')) or _number((video or audio or {}).get('duration')),
+        'bitrate': _number(fmt.get('bit_rate'), int),
+        'container': (fmt.get('format_name') or '').split(',')[0] or None,
+    }
+    if video is not None:
+        info.update({
+            'width': _number(video.get('width'), int),
+            'height': _number(video.get('height'), int),
+            'fps': _rate(video.get('avg_frame_rate')) or _rate(video.get('r_frame_rate')),
+            'video_codec': video.get('codec_name'),
+        })
+    if audio is not None:
+        info.update({
+            'audio_codec': audio.get('codec_name'),
+            'sample_rate': _number(audio.get('sample_rate'), int),
+            'channels': _number(audio.get('channels'), int),
+        })
+    return _finish(info)
+
+
+def probe_ffprobe(path: str, ffprobe: str = 'ffprobe', timeout: float = 30) -> Dict:
+    """
+    用ffprobe探测媒体文件(只读取文件头，不解码)
+
+    Args:
+        path: 媒体文件路径
+        ffprobe: ffprobe可执行文件
+        timeout: 超时时间(秒)
+
+    Returns:
+        元数据字段，见parse_ffprobe
+    """
+    cmd = [ffprobe, '-v', 'error', '-show_format', '-show_streams', '-of', 'json', path]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe探测失败: {result.stderr.strip()}")
+    return parse_ffprobe(json.loads(result.stdout or '{}'))
+
+
+def probe_pyav(path: str) -> Dict:
+    """
+    用PyAV探测媒体文件
+
+    Args:
+        path: 媒体文件路径
+
+    Returns:
+        元数据字段，见parse_ffprobe
+    """
+    if av is None:
+        raise RuntimeError("未安装PyAV")
+    with av.open(path) as container:
+        info = {
+            'duration': container.duration / av.time_base if container.duration else None,
+            'bitrate': _number(container.bit_rate, int),
+            'container': (container.format.name or '').split(',')[0] or None,
+        }
+        if container.streams.video:
+            stream = container.streams.video[0]
+            info.update({
+                'width': _number(stream.codec_context.width, int),
+                'height': _number(stream.codec_context.height, int),
+                'fps': round(float(stream.average_rate), 3) if stream.average_rate else None,
+                'video_codec': stream.codec_context.name,
+            })
+        if container.streams.audio:
+            stream = container.streams.audio[0]
+            info.update({
+                'audio_codec': stream.codec_context.name,
+                'sample_rate': _number(stream.codec_context.sample_rate, int),
+                'channels': _number(stream.codec_context.channels, int),
+            })
+    return _finish(info)
+
+
+class MediaProber:
+    """带持久缓存的媒体探测器，可直接作为add_materials_bulk的probe_fn，线程安全"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS probes (
+            device INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            result TEXT NOT NULL,
+            error TEXT,
+            probed_at TEXT NOT NULL,
+            PRIMARY KEY (device, inode, size, mtime_ns)
+        );
+    """
+
+    def __init__(self, cache_path: str, backend: str = 'auto', ffprobe: str = 'ffprobe'):
+        """
+        初始化探测器
+
+        Args:
+            cache_path: 缓存数据库路径
+            backend: 'ffprobe'、'pyav'或'auto'(优先ffprobe，不可用时使用PyAV)
+            ffprobe: ffprobe可执行文件
+        """
+        if backend == 'auto':
+            backend = 'ffprobe' if shutil.which(ffprobe) else ('pyav' if av is not None else None)
+        elif backend not in ('ffprobe', 'pyav'):
+            raise ValueError(f"不支持的探测方式: {backend}")
+        self.backend = backend
+        self.ffprobe = ffprobe
+        self.stats = {'hits': 0, 'probed': 0, 'failed': 0}
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+
+    @property
+    def available(self) -> bool:
+        """是否有可用的探测方式"""
+        return self.backend is not None
+
+    def __call__(self, path: str) -> Dict:
+        return self.probe(path)
+
+    def probe(self, path: str) -> Dict:
+        """
+        探测媒体文件，命中缓存时不读取文件
+
+        探测失败的结果同样缓存(返回空字典)，文件被修改后重新探测
+
+        Args:
+            path: 媒体文件路径
+
+        Returns:
+            元数据字段，见parse_ffprobe
+        """
+        stat = os.stat(path)
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT result FROM probes WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?', key
+            ).fetchone()
+            if row is not None:
+                self.stats['hits'] += 1
+                return json.loads(row[0])
+        if not self.available:
+            return {}
+
+        error = None
+        try:
+            if self.backend == 'ffprobe':
+                info = probe_ffprobe(path, self.ffprobe)
+            else:
+                info = probe_pyav(path)
+        except Exception as e:
+            logger.warning(f"探测媒体信息失败: {path}, {str(e)}")
+            info, error = {}, str(e)
+
+        with self._lock:
+            self.stats['failed' if error else 'probed'] += 1
+            self.conn.execute(
+                'INSERT OR REPLACE INTO probes(device, inode, size, mtime_ns, result, error, probed_at) '
+                'VALUES(?, ?, ?, ?, ?, ?, ?)',
+                key + (json.dumps(info), error, datetime.datetime.now().isoformat())
+            )
+        return info
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,153 @@
+"""
+素材检索结果的排序与分页
+小页面用堆选取前k个，深分页使用基于(排序值, 素材ID)的游标(keyset分页)
+"""
+import json
+import heapq
+import base64
+import logging
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
+
+from .secondary_index import MISSING, SortedIndex
+
+logger = logging.getLogger(__name__)
+
+# 排序键: (是否有值的序号, 排序值, 素材ID)
+SortKey = Tuple[int, Any, str]
+
+
+def sort_key(value: Any, material_id: str, descending: bool) -> SortKey:
+    """
+    生成排序键，没有排序值的素材无论升序降序都排在最后
+
+    Args:
+        value: 排序值(MISSING表示没有)
+        material_id: 素材ID，排序值相同时用于确定顺序
+        descending: 是否降序
+
+    Returns:
+        排序键
+    """
+    if value is MISSING:
+        return (0 if descending else 1, 0, material_id)
+    return (1 if descending else 0, value, material_id)
+
+
+def encode_cursor(sort_by: str, descending: bool, key: SortKey) -> str:
+    """将最后一条结果的排序键编码为不透明的游标字符串"""
+    payload = json.dumps({'s': sort_by, 'd': descending, 'k': list(key)}, ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_by: str, descending: bool) -> SortKey:
+    """
+    解码游标
+
+    Args:
+        cursor: encode_cursor生成的游标
+        sort_by: 本次检索的排序字段
+        descending: 本次检索是否降序
+
+    Returns:
+        排序键
+
+    Raises:
+        ValueError: 游标无效或与本次的排序方式不一致
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        rank, value, material_id = payload['k']
+    except (TypeError, ValueError, KeyError) as e:
+        raise ValueError(f"无效的分页游标: {str(e)}")
+
+    if payload.get('s') != sort_by or payload.get('d') != descending:
+        raise ValueError("分页游标与本次检索的排序方式不一致")
+    return (rank, value, material_id)
+
+
+def select_page(matches: Optional[Collection[str]],
+                all_ids: Collection[str],
+                value_of: Callable[[str], Any],
+                limit: int,
+                offset: int = 0,
+                descending: bool = True,
+                after: Optional[SortKey] = None,
+                sorted_index: Optional[SortedIndex] = None) -> Tuple[List[str], Optional[SortKey]]:
+    """
+    选取一页结果
+
+    Args:
+        matches: 满足条件的素材ID，None表示全部素材
+        all_ids: 全部素材ID
+        value_of: 素材ID -> 排序值(MISSING表示没有)
+        limit: 每页数量
+        offset: 在游标之后再跳过的数量
+        descending: 是否降序
+        after: 上一页最后一条的排序键，只返回排在它之后的结果
+        sorted_index: 排序字段的有序索引，提供时可按索引顺序遍历而不必读取全部匹配项
+
+    Returns:
+        (本页素材ID列表, 还有下一页时为本页最后一条的排序键，否则为None)
+    """
+    wanted = offset + limit + 1
+    if limit <= 0:
+        return [], None
+
+    if sorted_index is not None and _prefer_index_walk(matches, all_ids, sorted_index, wanted):
+        keys = _walk_index(matches, all_ids, sorted_index, wanted, descending, after)
+    else:
+        candidates = all_ids if matches is None else matches
+        keys = (sort_key(value_of(mid), mid, descending) for mid in candidates)
+        if after is not None:
+            keys = (key for key in keys if (key < after if descending else key > after))
+        select = heapq.nlargest if descending else heapq.nsmallest
+        keys = select(wanted, keys)
+
+    page = keys[offset:offset + limit]
+    next_key = page[-1] if page and len(keys) == wanted else None
+    return [key[2] for key in page], next_key
+
+
+def _prefer_index_walk(matches: Optional[Collection[str]],
+                       all_ids: Collection[str],
+                       sorted_index: SortedIndex,
+                       wanted: int) -> bool:
+    """
+    估算按索引顺序遍历是否比堆选取更省
+
+    按索引遍历平均需要读取 wanted / 选择度 个条目，堆选取需要读取全部匹配项
+    """
+    if matches is None:
+        return True
+    total = max(len(all_ids), 1)
+    return wanted * total < len(matches) * len(matches)
+
+
+def _walk_index(matches: Optional[Collection[str]],
+                all_ids: Collection[str],
+                sorted_index: SortedIndex,
+                wanted: int,
+                descending: bool,
+                after: Optional[SortKey]) -> List[SortKey]:
+    """按有序索引的顺序收集排序键，索引中没有值的素材排在最后"""
+    keys = []
+    present_rank = sort_key(None, '', descending)[0]
+
+    if after is None or after[0] == present_rank:
+        start = None if after is None else (after[1], after[2])
+        for value, material_id in sorted_index.iter_entries(reverse=descending, after=start):
+            if matches is None or material_id in matches:
+                keys.append((present_rank, value, material_id))
+                if len(keys) == wanted:
+                    return keys
+
+    # 没有排序值的素材按素材ID排序
+    candidates = all_ids if matches is None else matches
+    missing = (sort_key(MISSING, mid, descending) for mid in candidates
+               if sorted_index.value_of(mid) is MISSING)
+    if after is not None and after[0] != present_rank:
+        missing = (key for key in missing if (key < after if descending else key > after))
+    select = heapq.nlargest if descending else heapq.nsmallest
+    keys.extend(select(wanted - len(keys), missing))
+    return keys
@@ -0,0 +1,92 @@
+"""
+跨进程文件锁
+同一素材库被多个进程(API worker、后台任务)同时打开时，用于串行化写操作
+"""
+import os
+import time
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessLock:
+    """
+    基于锁文件的排他锁(POSIX为fcntl.flock，Windows为msvcrt.locking)
+
+    同一实例可重入，调用方负责线程间互斥(素材仓库在自身的线程锁内使用)。
+    平台不支持文件锁时退化为进程内的计数，不提供跨进程保护。
+    """
+
+    def __init__(self, path: str):
+        """
+        初始化文件锁
+
+        Args:
+            path: 锁文件路径(不存在时创建)
+        """
+        self.path = path
+        self._fd = None
+        self._depth = 0
+        if fcntl is None and msvcrt is None:
+            logger.warning("当前平台不支持文件锁，多进程同时写入素材库可能丢失修改")
+
+    @property
+    def depth(self) -> int:
+        """当前的重入层数，0表示未持有"""
+        return self._depth
+
+    def acquire(self):
+        """获取锁(阻塞直到其他进程释放)"""
+        if self._depth == 0:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                while True:
+                    try:
+                        # LK_LOCK重试10次(约10秒)后抛出OSError，继续等待
+                        msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+        self._depth += 1
+
+    def release(self):
+        """释放一层锁，最外层释放时解除文件锁"""
+        if self._depth == 0:
+            raise RuntimeError("释放未持有的文件锁")
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def close(self):
+        """关闭锁文件(持有时先释放)"""
+        while self._depth:
+            self.release()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
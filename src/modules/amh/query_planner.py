@@ -0,0 +1,63 @@
+"""
+素材检索的简单查询计划
+按估计的选择度排序谓词：最有选择性的谓词枚举候选集，其余谓词逐条过滤
+"""
+import logging
+from typing import Callable, Collection, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class Predicate:
+    """可用索引求值的查询条件"""
+
+    def __init__(self,
+                 name: str,
+                 estimate: int,
+                 ids: Callable[[], Iterable[str]],
+                 contains: Callable[[str], bool]):
+        """
+        初始化谓词
+
+        Args:
+            name: 谓词名称(用于日志)
+            estimate: 估计命中的素材数量
+            ids: 枚举命中素材ID的函数
+            contains: 判断单个素材是否命中的函数
+        """
+        self.name = name
+        self.estimate = estimate
+        self.ids = ids
+        self.contains = contains
+
+    def __repr__(self) -> str:
+        return f"Predicate({self.name}, estimate={self.estimate})"
+
+
+def postings_predicate(name: str, postings: Collection[str]) -> Predicate:
+    """由倒排表构造谓词"""
+    return Predicate(name, len(postings), lambda: postings, postings.__contains__)
+
+
+def plan_candidates(predicates: List[Predicate]) -> Optional[Set[str]]:
+    """
+    执行查询计划，返回同时满足所有谓词的素材ID
+
+    Args:
+        predicates: 谓词列表
+
+    Returns:
+        素材ID集合；没有谓词时返回None(表示不限制)
+    """
+    if not predicates:
+        return None
+
+    ordered = sorted(predicates, key=lambda p: p.estimate)
+    logger.debug(f"素材检索计划: {ordered}")
+
+    result = set(ordered[0].ids())
+    for predicate in ordered[1:]:
+        if not result:
+            break
+        result = {material_id for material_id in result if predicate.contains(material_id)}
+    return result
@@ -0,0 +1,144 @@
+"""
+素材关系图索引
+由素材记录的related_materials推导出正向和反向邻接表，支持反查引用方和多跳查询
+"""
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 查询方向
+DIRECTIONS = ('out', 'in', 'both')
+
+# 未指定类型的关联
+DEFAULT_RELATION_TYPE = 'related'
+
+
+class RelationGraph:
+    """素材关系图，源素材 -> {目标素材: 关系类型} 以及反向的 目标素材 -> {源素材: 关系类型}
+
+    关系保存在源素材的记录中，这里的两个邻接表只是索引；同一对素材之间每个方向最多一条边。
+    """
+
+    def __init__(self):
+        self._out = {}
+        self._in = {}
+
+    def add_edge(self, source_id: str, target_id: str, relation_type: str = DEFAULT_RELATION_TYPE):
+        """添加或更新一条边"""
+        self._out.setdefault(source_id, {})[target_id] = relation_type
+        self._in.setdefault(target_id, {})[source_id] = relation_type
+
+    def remove_edge(self, source_id: str, target_id: str):
+        """删除一条边(不存在时忽略)"""
+        for adjacency, key, other in ((self._out, source_id, target_id), (self._in, target_id, source_id)):
+            edges = adjacency.get(key)
+            if edges is not None:
+                edges.pop(other, None)
+                if not edges:
+                    del adjacency[key]
+
+    def add(self, material: Dict):
+        """加入素材记录中的全部关联"""
+        for relation in material.get('related_materials') or ():
+            self.add_edge(material['id'], relation['id'], relation.get('type') or DEFAULT_RELATION_TYPE)
+
+    def remove(self, material: Dict):
+        """移除素材记录中的全部关联"""
+        for relation in material.get('related_materials') or ():
+            self.remove_edge(material['id'], relation['id'])
+
+    def outgoing(self, material_id: str) -> Dict[str, str]:
+        """素材关联到的素材 {目标素材ID: 关系类型}(只读)"""
+        return self._out.get(material_id, {})
+
+    def incoming(self, material_id: str) -> Dict[str, str]:
+        """关联到该素材的素材 {源素材ID: 关系类型}(只读)"""
+        return self._in.get(material_id, {})
+
+    def degree(self, material_id: str) -> int:
+        """素材的出边和入边总数"""
+        return len(self.outgoing(material_id)) + len(self.incoming(material_id))
+
+    def neighbors(self, material_id: str, direction: str = 'out', types: Optional[Set[str]] = None):
+        """
+        遍历相邻素材
+
+        Returns:
+            (相邻素材ID, 关系类型, 方向'out'或'in')迭代器
+        """
+        if direction in ('out', 'both'):
+            for other, relation_type in self.outgoing(material_id).items():
+                if types is None or relation_type in types:
+                    yield other, relation_type, 'out'
+        if direction in ('in', 'both'):
+            for other, relation_type in self.incoming(material_id).items():
+                if types is None or relation_type in types:
+                    yield other, relation_type, 'in'
+
+    def traverse(self,
+                 material_id: str,
+                 depth: int = 1,
+                 types: Optional[Iterable[str]] = None,
+                 direction: str = 'out',
+                 limit: Optional[int] = None) -> List[Dict]:
+        """
+        广度优先遍历k跳以内的素材，已访问的素材不再展开(环路只访问一次)
+
+        Args:
+            material_id: 起点素材ID
+            depth: 最大跳数
+            types: 只沿这些关系类型遍历，None表示全部
+            direction: 'out'(沿关联方向)、'in'(反向)或'both'
+            limit: 最多返回的素材数量
+
+        Returns:
+            按距离排列的 {'id', 'depth', 'relation_type', 'direction', 'via'}，不包含起点；
+            via为首次到达该素材时的上一跳素材
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError(f"不支持的遍历方向: {direction}")
+        types = set(types) if types is not None else None
+
+        visited = {material_id}
+        results = []
+        frontier = deque([(material_id, 0)])
+        while frontier:
+            current, distance = frontier.popleft()
+            if distance >= depth:
+                continue
+            for other, relation_type, edge_direction in self.neighbors(current, direction, types):
+                if other in visited:
+                    continue
+                visited.add(other)
+                results.append({
+                    'id': other,
+                    'depth': distance + 1,
+                    'relation_type': relation_type,
+                    'direction': edge_direction,
+                    'via': current
+                })
+                if limit is not None and len(results) >= limit:
+                    return results
+                frontier.append((other, distance + 1))
+        return results
+
+    def clear(self):
+        self._out.clear()
+        self._in.clear()
+
+    def __len__(self) -> int:
+        """边的数量"""
+        return sum(len(edges) for edges in self._out.values())
+
+    def as_sets(self) -> Dict[str, Set[str]]:
+        """转换为 "关系类型>源素材" -> 目标素材集合，并包含反向邻接表的条目，用于一致性比对"""
+        sets = {}
+        for source_id, edges in self._out.items():
+            for target_id, relation_type in edges.items():
+                sets.setdefault(f"{relation_type}>{source_id}", set()).add(target_id)
+        for target_id, edges in self._in.items():
+            for source_id, relation_type in edges.items():
+                sets.setdefault(f"{relation_type}<{target_id}", set()).add(source_id)
+        return sets
@@ -0,0 +1,390 @@
+"""
+素材文件完整性巡检
+后台按素材ID顺序分块遍历索引，检查文件是否存在、大小和内容哈希是否与记录一致，
+发现的问题写入修复队列；读取文件时限速，进度保存在metadata/scrubber.db，中断后从上次位置继续
+"""
+import os
+import time
+import zlib
+import bisect
+import sqlite3
+import logging
+import datetime
+import threading
+from typing import Dict, List, Optional
+
+from .content_hash import CHUNK_SIZE, new_hasher
+
+logger = logging.getLogger(__name__)
+
+# 问题类型
+PROBLEMS = ('missing', 'size_mismatch', 'hash_mismatch', 'unreadable')
+
+
+class RateLimiter:
+    """令牌桶限速，rate为每秒允许的数量，None表示不限"""
+
+    def __init__(self, rate: Optional[float], burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else (rate or 0)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+
+    def consume(self, amount: float, stop_event: Optional[threading.Event] = None):
+        """消耗令牌，不足时等待(stop_event被设置时立即返回)"""
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        self._tokens -= amount
+        if self._tokens < 0:
+            wait = -self._tokens / self.rate
+            if stop_event is not None:
+                stop_event.wait(wait)
+            else:
+                time.sleep(wait)
+
+
+class IntegrityScrubber:
+    """素材文件巡检器"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS repairs (
+            material_id TEXT PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            problem TEXT NOT NULL,
+            expected TEXT,
+            actual TEXT,
+            detected_at TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open'
+        );
+        CREATE INDEX IF NOT EXISTS idx_repairs_status ON repairs(status);
+    """
+
+    def __init__(self,
+                 repository,
+                 chunk_size: int = 200,
+                 hash_sample_rate: float = 0.05,
+                 max_bytes_per_second: Optional[float] = 32 * 1024 * 1024,
+                 max_files_per_second: Optional[float] = 200,
+                 pass_interval: float = 24 * 3600):
+        """
+        初始化巡检器
+
+        Args:
+            repository: 素材仓库
+            chunk_size: 每块检查的素材数
+            hash_sample_rate: 每轮校验内容哈希的素材比例，1为全部校验，0为只检查存在和大小；
+                按素材ID和轮次轮换抽样，约1/hash_sample_rate轮覆盖全部素材
+            max_bytes_per_second: 计算哈希时的读取速度上限，None表示不限
+            max_files_per_second: 每秒检查的文件数上限，None表示不限
+            pass_interval: 后台运行时，完成一轮后等待多久开始下一轮(秒)
+        """
+        self.repository = repository
+        self.chunk_size = chunk_size
+        self.hash_sample_rate = hash_sample_rate
+        self.pass_interval = pass_interval
+        self._byte_limiter = RateLimiter(max_bytes_per_second, burst=max(CHUNK_SIZE, max_bytes_per_second or 0))
+        self._file_limiter = RateLimiter(max_files_per_second)
+
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(
+            os.path.join(repository.base_dir, 'metadata', 'scrubber.db'),
+            timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+
+        # 本轮的素材ID快照(按ID排序)，本轮开始之后新增的素材在下一轮检查
+        self._pass_ids = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _get_state(self, key: str, default=None):
+        with self._lock:
+            row = self.conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def _set_state(self, **values):
+        with self._lock:
+            self.conn.executemany(
+                'INSERT INTO state(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                [(key, None if value is None else str(value)) for key, value in values.items()]
+            )
+
+    def start(self):
+        """启动后台巡检线程"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='amh-scrubber', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程(当前块检查完毕后退出，进度已保存)"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self.conn.close()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                report = self.run_once()
+            except Exception as e:
+                logger.error(f"素材巡检失败: {str(e)}")
+                self._stop_event.wait(60)
+                continue
+            if report['pass_complete']:
+                self._stop_event.wait(self.pass_interval)
+
+    def run_once(self, max_chunks: Optional[int] = None) -> Dict:
+        """
+        从上次停止的位置继续巡检，直到本轮结束、检查了max_chunks块或巡检被停止
+
+        Args:
+            max_chunks: 最多检查的块数，None表示检查到本轮结束
+
+        Returns:
+            {'checked', 'hashed', 'problems', 'pass', 'pass_complete'}
+        """
+        report = {'checked': 0, 'hashed': 0, 'problems': 0, 'pass': 0, 'pass_complete': False}
+        chunks = 0
+        while not self._stop_event.is_set() and (max_chunks is None or chunks < max_chunks):
+            chunk_report = self._scrub_chunk()
+            chunks += 1
+            for key in ('checked', 'hashed', 'problems'):
+                report[key] += chunk_report[key]
+            report['pass'] = chunk_report['pass']
+            if chunk_report['pass_complete']:
+                report['pass_complete'] = True
+                break
+        return report
+
+    def _next_chunk(self):
+        """取出本轮下一块素材的检查信息(只在仓库锁内复制记录，I/O在锁外进行)"""
+        repo = self.repository
+        cursor = self._get_state('cursor', '')
+        pass_no = int(self._get_state('pass_number', 0))
+        if self._pass_ids is None:
+            # 锁内只复制ID数据(快照加载的索引只做内存拷贝)，解码和排序在锁外进行，不阻塞前台读取
+            with repo._lock:
+                repo._refresh_if_stale()
+                materials = repo.index['materials']
+                copy_ids = materials.copy_ids() if hasattr(materials, 'copy_ids') else None
+                pass_ids = list(materials) if copy_ids is None else None
+            if copy_ids is not None:
+                pass_ids = copy_ids()
+            else:
+                pass_ids.sort()
+            self._pass_ids = pass_ids
+            if not cursor:
+                self._set_state(pass_started_at=datetime.datetime.now().isoformat())
+        with repo._lock:
+            repo._refresh_if_stale()
+            materials = repo.index['materials']
+            # 快照加载的索引只读解码，不把整轮的记录缓存在内存中
+            lookup = materials.peek if hasattr(materials, 'peek') else materials.get
+            start = bisect.bisect_right(self._pass_ids, cursor)
+            end = start + self.chunk_size
+            chunk = []
+            for material_id in self._pass_ids[start:end]:
+                material = lookup(material_id)
+                if material is not None:
+                    chunk.append({
+                        'id': material_id,
+                        'file_path': material['file_path'],
+                        'file_size': material.get('file_size'),
+                        'content_hash': material.get('content_hash')
+                    })
+            # 本块之后没有剩余素材时last为None，表示本轮结束
+            last = self._pass_ids[end - 1] if end <= len(self._pass_ids) else None
+        return chunk, last, pass_no
+
+    def _scrub_chunk(self) -> Dict:
+        chunk, last, pass_no = self._next_chunk()
+        report = {'checked': 0, 'hashed': 0, 'problems': 0, 'pass': pass_no, 'pass_complete': last is None}
+
+        # 多个素材可能引用同一文件，每个文件只读一次
+        results = {}
+        findings = []
+        for entry in chunk:
+            if self._stop_event.is_set():
+                break
+            expected_hash = entry['content_hash'] if self._should_hash(entry['id'], pass_no) else None
+            key = (entry['file_path'], expected_hash)
+            if key not in results:
+                self._file_limiter.consume(1, self._stop_event)
+                results[key] = self._check_file(entry['file_path'], entry['file_size'], expected_hash)
+                if expected_hash and results[key][0] != 'missing':
+                    report['hashed'] += 1
+            findings.append((entry, results[key]))
+            report['checked'] += 1
+        if self._stop_event.is_set():
+            # 未完成的块不保存进度，下次从块首重新检查
+            report['pass_complete'] = False
+            return report
+        report['problems'] = self._record(findings)
+
+        if last is None:
+            self._pass_ids = None
+            self._set_state(cursor='', pass_number=pass_no + 1,
+                            last_pass_completed_at=datetime.datetime.now().isoformat())
+            logger.info(f"素材巡检第{pass_no + 1}轮完成")
+        else:
+            self._set_state(cursor=last)
+        return report
+
+    def _should_hash(self, material_id: str, pass_no: int) -> bool:
+        """按素材ID和轮次轮换抽样，保证若干轮之后全部素材都被校验过"""
+        if self.hash_sample_rate >= 1:
+            return True
+        if self.hash_sample_rate <= 0:
+            return False
+        period = max(int(round(1 / self.hash_sample_rate)), 1)
+        return (zlib.crc32(material_id.encode()) + pass_no) % period == 0
+
+    def _check_file(self, path: str, expected_size: Optional[int], expected_hash: Optional[str]) -> tuple:
+        """
+        检查单个文件
+
+        Returns:
+            (问题类型或None, 期望值, 实际值)
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 'missing', path, None
+        except OSError as e:
+            return 'unreadable', None, str(e)
+        if expected_size is not None and stat.st_size != expected_size:
+            return 'size_mismatch', str(expected_size), str(stat.st_size)
+        if not expected_hash:
+            return None, None, None
+        try:
+            actual_hash = self._hash_throttled(path)
+        except OSError as e:
+            return 'unreadable', None, str(e)
+        if actual_hash is None:
+            return None, None, None
+        try:
+            # 校验期间文件被改写(例如正在被替换)时不下结论，下一轮重新检查
+            if os.stat(path).st_mtime_ns != stat.st_mtime_ns:
+                return None, None, None
+        except OSError:
+            return None, None, None
+        if actual_hash != expected_hash:
+            return 'hash_mismatch', expected_hash, actual_hash
+        return None, None, None
+
+    def _hash_throttled(self, path: str) -> Optional[str]:
+        """限速计算文件哈希，巡检被停止时返回None"""
+        hasher = new_hasher()
+        with open(path, 'rb') as f:
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            while True:
+                if self._stop_event.is_set():
+                    return None
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                hasher.update(view[:n])
+                self._byte_limiter.consume(n, self._stop_event)
+        return hasher.hexdigest()
+
+    def _record(self, findings: List[tuple]) -> int:
+        """
+        写入修复队列；检查通过的素材如有未处理的记录则标记为已恢复
+
+        素材记录在检查期间被修改(文件被分层存储或重新分布移动)时忽略本次结果
+        """
+        repo = self.repository
+        now = datetime.datetime.now().isoformat()
+        problems, healthy = [], []
+        with repo._lock:
+            materials = repo.index['materials']
+            lookup = materials.peek if hasattr(materials, 'peek') else materials.get
+            for entry, (problem, expected, actual) in findings:
+                current = lookup(entry['id'])
+                if current is None or current['file_path'] != entry['file_path']:
+                    continue
+                if problem is None:
+                    healthy.append((entry['id'],))
+                else:
+                    problems.append((entry['id'], entry['file_path'], problem, expected, actual, now))
+        with self._lock:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(
+                "INSERT INTO repairs(material_id, file_path, problem, expected, actual, detected_at, status) "
+                "VALUES(?, ?, ?, ?, ?, ?, 'open') ON CONFLICT(material_id) DO UPDATE SET "
+                "file_path = excluded.file_path, problem = excluded.problem, expected = excluded.expected, "
+                "actual = excluded.actual, detected_at = excluded.detected_at, status = 'open'",
+                problems
+            )
+            self.conn.executemany(
+                "UPDATE repairs SET status = 'recovered' WHERE material_id = ? AND status = 'open'", healthy
+            )
+            self.conn.execute('COMMIT')
+        for material_id, path, problem, _, _, _ in problems:
+            logger.warning(f"素材巡检发现问题: {material_id}, {problem}, {path}")
+        return len(problems)
+
+    def get_repair_queue(self, status: Optional[str] = 'open', limit: int = 100, offset: int = 0) -> List[Dict]:
+        """
+        查询修复队列
+
+        Args:
+            status: 'open'(待处理)、'recovered'(之后检查恢复正常)、'resolved'(已人工处理)，None表示全部
+            limit: 返回数量
+            offset: 偏移量
+
+        Returns:
+            按发现时间排序的修复记录
+        """
+        sql = 'SELECT material_id, file_path, problem, expected, actual, detected_at, status FROM repairs'
+        params = []
+        if status is not None:
+            sql += ' WHERE status = ?'
+            params.append(status)
+        sql += ' ORDER BY detected_at, material_id LIMIT ? OFFSET ?'
+        params.extend([limit, offset])
+        columns = ('material_id', 'file_path', 'problem', 'expected', 'actual', 'detected_at', 'status')
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def resolve(self, material_id: str) -> bool:
+        """
+        标记修复记录为已处理
+
+        Returns:
+            是否存在该素材的记录
+        """
+        with self._lock:
+            cursor = self.conn.execute("UPDATE repairs SET status = 'resolved' WHERE material_id = ?", (material_id,))
+        return cursor.rowcount > 0
+
+    def get_progress(self) -> Dict:
+        """
+        巡检进度
+
+        Returns:
+            当前轮次、本轮已检查到的素材ID、本轮开始和上一轮完成的时间以及待处理问题数
+        """
+        with self._lock:
+            open_count = self.conn.execute("SELECT COUNT(*) FROM repairs WHERE status = 'open'").fetchone()[0]
+            return {
+                'pass': int(self._get_state('pass_number', 0)),
+                'cursor': self._get_state('cursor', ''),
+                'pass_started_at': self._get_state('pass_started_at'),
+                'last_pass_completed_at': self._get_state('last_pass_completed_at'),
+                'open_repairs': open_count
+            }
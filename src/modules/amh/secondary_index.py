@@ -0,0 +1,354 @@
+"""
+素材元数据的类型化二级索引
+按值排序的数组 + 二分查找，支持范围、前缀和IN查询
+"""
+import bisect
+import datetime
+import logging
+from typing import Any, Collection, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .query_planner import Predicate
+
+logger = logging.getLogger(__name__)
+
+# 表示路径不存在或值无法转换
+MISSING = object()
+
+# 支持的值类型
+VALUE_TYPES = ('number', 'string', 'datetime')
+
+def get_path(data: Dict, path: str) -> Any:
+    """
+    按点分路径读取嵌套字典中的值(例如 "video.duration")
+
+    Returns:
+        路径对应的值，不存在时返回MISSING
+    """
+    current = data
+    for part in path.split('.'):
+        if not isinstance(current, dict) or part not in current:
+            return MISSING
+        current = current[part]
+    return current
+
+
+def is_operator_condition(condition: Any) -> bool:
+    """条件是否为操作符形式，例如 {'$gte': 10, '$lte': 30}"""
+    return (isinstance(condition, dict)
+            and bool(condition)
+            and all(isinstance(k, str) and k.startswith('$') for k in condition))
+
+
+def coerce_value(value: Any, value_type: str) -> Any:
+    """
+    将值转换为索引类型
+
+    Args:
+        value: 原始值
+        value_type: 'number'、'string' 或 'datetime'(转换为时间戳)
+
+    Returns:
+        转换后的值，无法转换时返回MISSING
+    """
+    if value is MISSING or value is None:
+        return MISSING
+    try:
+        if value_type == 'number':
+            if isinstance(value, bool):
+                return MISSING
+            return float(value)
+        elif value_type == 'string':
+            return value if isinstance(value, str) else str(value)
+        elif value_type == 'datetime':
+            if isinstance(value, datetime.datetime):
+                return value.timestamp()
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return float(value)
+            return datetime.datetime.fromisoformat(str(value)).timestamp()
+    except (TypeError, ValueError, OverflowError):
+        return MISSING
+    raise ValueError(f"不支持的索引值类型: {value_type}")
+
+
+def match_condition(value: Any, condition: Any, value_type: Optional[str] = None) -> bool:
+    """
+    判断值是否满足过滤条件
+
+    Args:
+        value: 素材中的值(MISSING表示不存在)
+        condition: 普通值表示相等；操作符字典支持 $eq/$gt/$gte/$lt/$lte/$in/$prefix
+        value_type: 指定时先把两侧的值转换为该类型再比较
+
+    Returns:
+        是否满足
+    """
+    if value is MISSING:
+        return False
+
+    if not is_operator_condition(condition):
+        if value_type:
+            return coerce_value(value, value_type) == coerce_value(condition, value_type)
+        return value == condition
+
+    def convert(v):
+        return coerce_value(v, value_type) if value_type else v
+
+    value = convert(value)
+    if value is MISSING:
+        return False
+
+    try:
+        for op, operand in condition.items():
+            if op == '$eq':
+                ok = value == convert(operand)
+            elif op == '$gt':
+                ok = value > convert(operand)
+            elif op == '$gte':
+                ok = value >= convert(operand)
+            elif op == '$lt':
+                ok = value < convert(operand)
+            elif op == '$lte':
+                ok = value <= convert(operand)
+            elif op == '$in':
+                ok = value in {convert(v) for v in operand}
+            elif op == '$prefix':
+                ok = isinstance(value, str) and value.startswith(operand)
+            else:
+                raise ValueError(f"不支持的查询操作符: {op}")
+            if not ok:
+                return False
+    except TypeError:
+        # 类型不可比较(例如字符串与数字)视为不匹配
+        return False
+    return True
+
+
+# update_many改为过滤后整体排序的素材数量
+_BULK_UPDATE_THRESHOLD = 64
+
+
+class SortedIndex:
+    """有序二级索引：按(值, 素材ID)排序的数组，二分查找定位区间"""
+
+    def __init__(self, path: str, value_type: str = 'number', source: str = 'metadata'):
+        """
+        初始化有序索引
+
+        Args:
+            path: 点分路径
+            value_type: 值类型('number'、'string'、'datetime')
+            source: 'metadata'表示路径相对素材元数据，'record'表示相对素材记录本身(如added_at)
+        """
+        if value_type not in VALUE_TYPES:
+            raise ValueError(f"不支持的索引值类型: {value_type}")
+        self.path = path
+        self.value_type = value_type
+        self.source = source
+
+        self._values = []
+        self._entries = []
+        self._by_id = {}
+
+    def extract(self, material: Dict) -> Any:
+        """从素材记录中提取并转换索引值"""
+        if self.source == 'metadata':
+            data = material.get('metadata') or {}
+        else:
+            data = material
+        return coerce_value(get_path(data, self.path), self.value_type)
+
+    def add(self, material: Dict):
+        """索引素材"""
+        value = self.extract(material)
+        if value is MISSING:
+            return
+        material_id = material['id']
+        if material_id in self._by_id:
+            self._remove_id(material_id)
+        entry = (value, material_id)
+        pos = bisect.bisect_left(self._entries, entry)
+        self._entries.insert(pos, entry)
+        self._values.insert(pos, value)
+        self._by_id[material_id] = value
+
+    def remove(self, material: Dict):
+        """移除素材"""
+        self._remove_id(material['id'])
+
+    def update_many(self, materials: Iterable[Dict]):
+        """
+        按素材记录的当前值重新索引一批素材
+
+        少量素材逐条插入；较多时过滤掉旧条目后整体排序(已有序的前缀加短尾，Timsort近似线性)，
+        避免每条插入都移动整个数组
+        """
+        materials = {material['id']: material for material in materials}
+        if len(materials) < _BULK_UPDATE_THRESHOLD:
+            for material in materials.values():
+                self._remove_id(material['id'])
+                self.add(material)
+            return
+
+        entries = [entry for entry in self._entries if entry[1] not in materials]
+        for material_id, material in materials.items():
+            self._by_id.pop(material_id, None)
+            value = self.extract(material)
+            if value is not MISSING:
+                entries.append((value, material_id))
+                self._by_id[material_id] = value
+        entries.sort()
+        self._entries = entries
+        self._values = [value for value, _ in entries]
+
+    def rebuild(self, materials: Iterable[Dict]):
+        """根据素材记录重建索引(一次排序)"""
+        entries = []
+        for material in materials:
+            value = self.extract(material)
+            if value is not MISSING:
+                entries.append((value, material['id']))
+        entries.sort()
+        self._entries = entries
+        self._values = [value for value, _ in entries]
+        self._by_id = {material_id: value for value, material_id in entries}
+
+    def value_of(self, material_id: str) -> Any:
+        """素材的索引值，未索引时返回MISSING"""
+        return self._by_id.get(material_id, MISSING)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def value_counts(self, restrict: Optional[Collection[str]] = None) -> Dict[Any, int]:
+        """
+        统计每个索引值的素材数量(没有该字段的素材不计入)
+
+        Args:
+            restrict: 只统计这些素材ID，None表示全部
+
+        Returns:
+            值 -> 素材数量
+        """
+        counts = {}
+        if restrict is None:
+            # 相同的值在有序数组中相邻，按值二分跳过
+            values = self._values
+            pos = 0
+            while pos < len(values):
+                end = bisect.bisect_right(values, values[pos], pos)
+                counts[values[pos]] = end - pos
+                pos = end
+        elif len(restrict) < len(self._by_id):
+            for material_id in restrict:
+                value = self._by_id.get(material_id, MISSING)
+                if value is not MISSING:
+                    counts[value] = counts.get(value, 0) + 1
+        else:
+            for value, material_id in self._entries:
+                if material_id in restrict:
+                    counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def as_sets(self) -> Dict[Any, Set[str]]:
+        """转换为 值 -> 素材ID集合，用于一致性比对"""
+        result = {}
+        for value, material_id in self._entries:
+            result.setdefault(value, set()).add(material_id)
+        return result
+
+    def iter_entries(self, reverse: bool = False, after: Optional[Tuple[Any, str]] = None) -> Iterator[Tuple[Any, str]]:
+        """
+        按(值, 素材ID)顺序遍历条目
+
+        Args:
+            reverse: 是否倒序
+            after: 从该条目之后开始(不含)，二分定位起点
+
+        Returns:
+            (值, 素材ID)迭代器
+        """
+        entries = self._entries
+        if not reverse:
+            start = 0 if after is None else bisect.bisect_right(entries, tuple(after))
+            for pos in range(start, len(entries)):
+                yield entries[pos]
+        else:
+            start = len(entries) if after is None else bisect.bisect_left(entries, tuple(after))
+            for pos in range(start - 1, -1, -1):
+                yield entries[pos]
+
+    def predicate(self, condition: Any) -> Predicate:
+        """
+        将过滤条件转换为查询计划中的谓词
+
+        Args:
+            condition: 普通值(相等)或操作符字典
+
+        Returns:
+            谓词，估计值为命中区间内的条目数
+        """
+        spans = self._spans(condition)
+        estimate = sum(hi - lo for lo, hi in spans)
+
+        def ids():
+            for lo, hi in spans:
+                for _, material_id in self._entries[lo:hi]:
+                    if contains(material_id):
+                        yield material_id
+
+        def contains(material_id):
+            value = self._by_id.get(material_id, MISSING)
+            return match_condition(value, condition, self.value_type)
+
+        return Predicate(f"{self.source}:{self.path}", estimate, ids, contains)
+
+    def _spans(self, condition: Any) -> List[Tuple[int, int]]:
+        """条件对应的数组区间列表(左闭右开)，区间内的条目仍需逐条校验"""
+        if not is_operator_condition(condition):
+            condition = {'$eq': condition}
+
+        def point(v):
+            v = coerce_value(v, self.value_type)
+            if v is MISSING:
+                return (0, 0)
+            return (bisect.bisect_left(self._values, v), bisect.bisect_right(self._values, v))
+
+        try:
+            if '$in' in condition:
+                return [point(v) for v in set(condition['$in'])]
+            if '$eq' in condition:
+                return [point(condition['$eq'])]
+            if '$prefix' in condition:
+                prefix = condition['$prefix']
+                if self.value_type != 'string':
+                    raise ValueError(f"前缀查询只支持字符串索引: {self.path}")
+                return [(bisect.bisect_left(self._values, prefix),
+                         bisect.bisect_left(self._values, prefix + '\U0010ffff'))]
+
+            lo, hi = 0, len(self._values)
+            for op in ('$gt', '$gte'):
+                if op in condition:
+                    bound = coerce_value(condition[op], self.value_type)
+                    if bound is MISSING:
+                        return []
+                    find = bisect.bisect_right if op == '$gt' else bisect.bisect_left
+                    lo = max(lo, find(self._values, bound))
+            for op in ('$lt', '$lte'):
+                if op in condition:
+                    bound = coerce_value(condition[op], self.value_type)
+                    if bound is MISSING:
+                        return []
+                    find = bisect.bisect_left if op == '$lt' else bisect.bisect_right
+                    hi = min(hi, find(self._values, bound))
+            return [(lo, hi)] if lo < hi else []
+        except TypeError:
+            return []
+
+    def _remove_id(self, material_id: str):
+        value = self._by_id.pop(material_id, MISSING)
+        if value is MISSING:
+            return
+        pos = bisect.bisect_left(self._entries, (value, material_id))
+        if pos < len(self._entries) and self._entries[pos] == (value, material_id):
+            del self._entries[pos]
+            del self._values[pos]
@@ -0,0 +1,460 @@
+"""
+片段管理器
+片段只记录为源素材上的时间范围(以及关键帧对齐后的起点和字节偏移)，不复制媒体文件；
+需要实际文件时用ffmpeg流复制(不重新编码)生成，并在temp/segments下按LRU缓存
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import datetime
+import threading
+import subprocess
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 物化片段缓存的默认容量(字节)
+DEFAULT_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+# 启动时删除超过这个时间(秒)未修改的未完成片段文件(截取中途崩溃遗留)；
+# 较新的可能是其他进程正在写入的
+STALE_TMP_SECONDS = 3600
+
+# 关键帧时间比较的容差(秒)
+_EPSILON = 1e-3
+
+# 关键帧: (时间戳(秒), 字节偏移或None)
+Keyframe = Tuple[float, Optional[int]]
+
+
+def probe_keyframes(path: str, ffprobe: str = 'ffprobe') -> List[Keyframe]:
+    """
+    用ffprobe读取视频流的关键帧时间和字节偏移
+
+    Args:
+        path: 媒体文件路径
+        ffprobe: ffprobe可执行文件
+
+    Returns:
+        按时间排序的关键帧列表
+    """
+    cmd = [
+        ffprobe, '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+        '-show_entries', 'frame=pts_time,best_effort_timestamp_time,pkt_pos', '-of', 'json', path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"读取关键帧失败: {result.stderr.strip()}")
+
+    keyframes = []
+    for frame in json.loads(result.stdout or '{}').get('frames', []):
+        timestamp = frame.get('pts_time', frame.get('best_effort_timestamp_time'))
+        try:
+            timestamp = float(timestamp)
+        except (TypeError, ValueError):
+            continue
+        position = frame.get('pkt_pos')
+        keyframes.append((timestamp, int(position) if position not in (None, 'N/A') else None))
+    keyframes.sort()
+    return keyframes
+
+
+def align_to_keyframes(keyframes: Sequence[Keyframe], start: float, end: float) -> Dict:
+    """
+    将时间范围对齐到关键帧：流复制只能从关键帧开始，起点取不晚于start的最后一个关键帧
+
+    Args:
+        keyframes: 按时间排序的关键帧
+        start: 起始时间(秒)
+        end: 结束时间(秒)
+
+    Returns:
+        {'aligned_start': 对齐后的起点, 'start_offset': 起点关键帧的字节偏移,
+         'end_offset': 不早于end的第一个关键帧的字节偏移(读取范围的上界，之后没有关键帧时为None)}
+    """
+    aligned = {'aligned_start': start, 'start_offset': None, 'end_offset': None}
+    if not keyframes:
+        return aligned
+
+    previous = None
+    for timestamp, position in keyframes:
+        if timestamp <= start + _EPSILON:
+            previous = (timestamp, position)
+        elif timestamp >= end - _EPSILON:
+            aligned['end_offset'] = position
+            break
+    timestamp, position = previous or keyframes[0]
+    aligned['aligned_start'] = min(timestamp, start)
+    aligned['start_offset'] = position
+    return aligned
+
+
+class SegmentManager:
+    """虚拟片段管理器，片段记录保存在metadata/segments.db"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS segments (
+            id TEXT PRIMARY KEY,
+            source_id TEXT NOT NULL,
+            start REAL NOT NULL,
+            end REAL NOT NULL,
+            aligned_start REAL NOT NULL,
+            start_offset INTEGER,
+            end_offset INTEGER,
+            label TEXT,
+            data TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_segments_source ON segments(source_id, start);
+        CREATE TABLE IF NOT EXISTS keyframes (
+            source_id TEXT PRIMARY KEY,
+            content_hash TEXT,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self,
+                 repository,
+                 cache_dir: str = None,
+                 max_cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 ffmpeg: str = 'ffmpeg',
+                 keyframe_fn: Callable[[str], List[Keyframe]] = None):
+        """
+        初始化片段管理器
+
+        Args:
+            repository: 源素材所在的素材仓库(MaterialRepository)
+            cache_dir: 物化片段的缓存目录，默认为素材库的temp/segments
+            max_cache_bytes: 缓存容量(字节)，超出时删除最久未使用的片段文件
+            ffmpeg: ffmpeg可执行文件
+            keyframe_fn: 关键帧探测函数，参数为源文件路径；默认使用ffprobe，
+                ffprobe不可用时片段不做关键帧对齐
+        """
+        self.repository = repository
+        self.cache_dir = cache_dir or os.path.join(repository.base_dir, 'temp', 'segments')
+        self.max_cache_bytes = max_cache_bytes
+        self.ffmpeg = ffmpeg
+        if keyframe_fn is None and shutil.which('ffprobe'):
+            keyframe_fn = probe_keyframes
+        self.keyframe_fn = keyframe_fn
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(
+            os.path.join(repository.base_dir, 'metadata', 'segments.db'),
+            timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+
+        # 缓存文件 -> 大小，按最近使用排序(最久未使用在前)；启动时按修改时间恢复顺序
+        self._cache = OrderedDict()
+        entries = []
+        stale_before = time.time() - STALE_TMP_SECONDS
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            if '.tmp' not in name:
+                entries.append((stat.st_mtime, path, stat.st_size))
+            elif stat.st_mtime < stale_before:
+                self._evict(path)
+        for _, path, size in sorted(entries):
+            self._cache[path] = size
+
+    def close(self):
+        """释放数据库连接"""
+        try:
+            self.conn.close()
+        except Exception as e:
+            logger.warning(f"关闭片段数据库失败: {str(e)}")
+
+    def _source_material(self, source_id: str) -> Optional[Dict]:
+        """
+        读取源素材记录：不更新访问时间(片段操作不算对源素材的访问，不影响分层存储的冷热判断)，
+        不存在时不记录警告
+        """
+        repo = self.repository
+        with repo._lock:
+            repo._refresh_if_stale()
+            return repo.index['materials'].get(source_id)
+
+    def _keyframes(self, material: Dict) -> List[Keyframe]:
+        """源素材的关键帧(按内容哈希缓存在数据库中)"""
+        if self.keyframe_fn is None:
+            return []
+
+        row = self.conn.execute(
+            'SELECT content_hash, data FROM keyframes WHERE source_id = ?', (material['id'],)
+        ).fetchone()
+        if row is not None and row[0] == material.get('content_hash'):
+            return [tuple(keyframe) for keyframe in json.loads(row[1])]
+
+        try:
+            keyframes = self.keyframe_fn(material['file_path'])
+        except Exception as e:
+            logger.warning(f"读取关键帧失败，片段不做关键帧对齐: {material['id']}, {str(e)}")
+            return []
+        self.conn.execute(
+            'INSERT INTO keyframes(source_id, content_hash, data) VALUES(?, ?, ?) '
+            'ON CONFLICT(source_id) DO UPDATE SET content_hash = excluded.content_hash, data = excluded.data',
+            (material['id'], material.get('content_hash'), json.dumps(keyframes))
+        )
+        return keyframes
+
+    def add_segment(self,
+                    source_id: str,
+                    start: float,
+                    end: float,
+                    label: str = None,
+                    metadata: Dict = None) -> Optional[str]:
+        """
+        记录一个片段(不生成文件)
+
+        Args:
+            source_id: 源素材ID
+            start: 起始时间(秒)
+            end: 结束时间(秒)
+            label: 片段标签
+            metadata: 片段元数据
+
+        Returns:
+            片段ID，源素材不存在时返回None
+        """
+        segment_ids = self.add_segments(source_id, [(start, end, label, metadata)])
+        return segment_ids[0] if segment_ids else None
+
+    def add_segments(self, source_id: str, ranges: Iterable[Tuple]) -> List[str]:
+        """
+        批量记录同一源素材上的片段(关键帧只读取一次，一次事务写入)
+
+        Args:
+            source_id: 源素材ID
+            ranges: (起始时间, 结束时间[, 标签[, 元数据]])
+
+        Returns:
+            片段ID列表，源素材不存在时为空列表
+        """
+        material = self._source_material(source_id)
+        if material is None:
+            logger.warning(f"源素材不存在: {source_id}")
+            return []
+
+        now = datetime.datetime.now().isoformat()
+        rows = []
+        with self._lock:
+            keyframes = self._keyframes(material)
+            for item in ranges:
+                start, end = float(item[0]), float(item[1])
+                label = item[2] if len(item) > 2 else None
+                metadata = item[3] if len(item) > 3 else None
+                if start < 0 or end <= start:
+                    raise ValueError(f"无效的片段时间范围: {start}-{end}")
+                aligned = align_to_keyframes(keyframes, start, end)
+                rows.append((
+                    str(uuid.uuid4()), source_id, start, end, aligned['aligned_start'],
+                    aligned['start_offset'], aligned['end_offset'], label,
+                    json.dumps({'metadata': metadata or {}}, ensure_ascii=False), now
+                ))
+
+            cur = self.conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                cur.executemany('INSERT INTO segments VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                cur.execute('COMMIT')
+            except BaseException:
+                cur.execute('ROLLBACK')
+                raise
+            finally:
+                cur.close()
+
+        logger.info(f"记录片段成功: {source_id}, {len(rows)}个")
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _segment_from_row(row) -> Dict:
+        segment_id, source_id, start, end, aligned_start, start_offset, end_offset, label, data, created_at = row
+        return {
+            'id': segment_id,
+            'source_id': source_id,
+            'start': start,
+            'end': end,
+            'duration': end - start,
+            'aligned_start': aligned_start,
+            'start_offset': start_offset,
+            'end_offset': end_offset,
+            'label': label,
+            'metadata': json.loads(data).get('metadata', {}),
+            'created_at': created_at
+        }
+
+    def get_segment(self, segment_id: str) -> Optional[Dict]:
+        """
+        获取片段记录
+
+        Args:
+            segment_id: 片段ID
+
+        Returns:
+            片段字典，不存在时返回None
+        """
+        row = self.conn.execute('SELECT * FROM segments WHERE id = ?', (segment_id,)).fetchone()
+        return self._segment_from_row(row) if row is not None else None
+
+    def list_segments(self, source_id: str, start: float = None, end: float = None) -> List[Dict]:
+        """
+        列出源素材上的片段，可只返回与[start, end)重叠的片段
+
+        Args:
+            source_id: 源素材ID
+            start: 时间范围起点(秒)
+            end: 时间范围终点(秒)
+
+        Returns:
+            按起始时间排序的片段列表
+        """
+        query = 'SELECT * FROM segments WHERE source_id = ?'
+        params = [source_id]
+        if end is not None:
+            query += ' AND start < ?'
+            params.append(end)
+        if start is not None:
+            query += ' AND end > ?'
+            params.append(start)
+        query += ' ORDER BY start, end'
+        return [self._segment_from_row(row) for row in self.conn.execute(query, params)]
+
+    def delete_segment(self, segment_id: str) -> bool:
+        """
+        删除片段记录及其缓存文件
+
+        Args:
+            segment_id: 片段ID
+
+        Returns:
+            删除是否成功
+        """
+        with self._lock:
+            deleted = self.conn.execute('DELETE FROM segments WHERE id = ?', (segment_id,)).rowcount
+            for path in [p for p in self._cache if os.path.basename(p).startswith(f"{segment_id}_")]:
+                self._evict(path)
+        if not deleted:
+            logger.warning(f"片段不存在: {segment_id}")
+        return bool(deleted)
+
+    def remove_orphans(self) -> int:
+        """
+        删除源素材已不存在的片段记录；已删除但仍可恢复(有墓碑)的素材保留片段，恢复后随之可用
+
+        Returns:
+            删除的片段数量
+        """
+        repo = self.repository
+        with self._lock:
+            source_ids = [row[0] for row in self.conn.execute('SELECT DISTINCT source_id FROM segments')]
+            with repo._lock:
+                repo._refresh_if_stale()
+                orphans = [
+                    sid for sid in source_ids
+                    if sid not in repo.index['materials'] and sid not in repo.index['tombstones']
+                ]
+            removed = 0
+            for source_id in orphans:
+                removed += self.conn.execute('DELETE FROM segments WHERE source_id = ?', (source_id,)).rowcount
+                self.conn.execute('DELETE FROM keyframes WHERE source_id = ?', (source_id,))
+        logger.info(f"清理无源素材的片段: {removed}个")
+        return removed
+
+    def materialize(self, segment_id: str) -> Optional[str]:
+        """
+        获取片段的媒体文件：缓存命中时直接返回，否则用ffmpeg流复制从源文件截取
+
+        截取从对齐后的关键帧起点开始(不重新编码)，因此文件可能比请求的范围稍早开始。
+
+        Args:
+            segment_id: 片段ID
+
+        Returns:
+            缓存中的片段文件路径；片段或源素材不存在、截取失败时返回None
+        """
+        segment = self.get_segment(segment_id)
+        if segment is None:
+            logger.warning(f"片段不存在: {segment_id}")
+            return None
+        material = self._source_material(segment['source_id'])
+        if material is None:
+            logger.warning(f"片段的源素材不存在: {segment['source_id']}")
+            return None
+
+        # 源文件内容变化后缓存键随之变化，旧文件由LRU淘汰
+        version = (material.get('content_hash') or 'nohash')[:12]
+        ext = os.path.splitext(material['file_path'])[1] or '.mp4'
+        path = os.path.join(self.cache_dir, f"{segment_id}_{version}{ext}")
+
+        with self._lock:
+            if path in self._cache and os.path.exists(path):
+                self._cache.move_to_end(path)
+                os.utime(path)
+                return path
+
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp{ext}"
+        cmd = [
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-ss', f"{segment['aligned_start']:.3f}", '-i', material['file_path'],
+            '-t', f"{segment['end'] - segment['aligned_start']:.3f}",
+            '-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero', '-y', tmp_path
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+        except OSError as e:
+            logger.error(f"无法运行ffmpeg: {str(e)}")
+            return None
+        if result.returncode != 0 or not os.path.exists(tmp_path):
+            logger.error(f"截取片段失败: {segment_id}, {result.stderr.strip()}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._cache[path] = os.path.getsize(path)
+            self._cache.move_to_end(path)
+            self._enforce_cache_limit(keep=path)
+        logger.info(f"物化片段成功: {segment_id} -> {path}")
+        return path
+
+    def cache_usage(self) -> Dict:
+        """
+        缓存使用情况
+
+        Returns:
+            {'files': 文件数, 'bytes': 总大小, 'max_bytes': 容量}
+        """
+        with self._lock:
+            return {'files': len(self._cache), 'bytes': sum(self._cache.values()), 'max_bytes': self.max_cache_bytes}
+
+    def _enforce_cache_limit(self, keep: str = None):
+        """删除最久未使用的缓存文件，直到总大小不超过容量(刚生成的文件保留)"""
+        total = sum(self._cache.values())
+        for path in list(self._cache):
+            if total <= self.max_cache_bytes:
+                break
+            if path == keep:
+                continue
+            total -= self._cache[path]
+            self._evict(path)
+
+    def _evict(self, path: str):
+        """从缓存中删除一个文件"""
+        self._cache.pop(path, None)
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"删除片段缓存失败: {path}, {str(e)}")
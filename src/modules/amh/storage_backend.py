@@ -0,0 +1,514 @@
+"""
+素材索引存储后端
+负责素材索引的持久化，提供单行级别的写入接口
+"""
+import os
+import json
+import sqlite3
+import logging
+import tempfile
+import datetime
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 索引元信息字段(除素材和分类之外的顶层字段)
+META_FIELDS = ('version', 'created_at', 'last_updated', 'total_materials', 'secondary_indexes', 'layout')
+
+# SQLite变更日志保留的条数，落后更多的进程需要完整重新加载
+CHANGE_LOG_RETAIN = 10000
+
+
+class StorageBackend:
+    """存储后端基类，定义素材索引的加载和增量持久化接口"""
+
+    name = 'base'
+    # 写入时是否需要完整的索引文档(包含分类成员列表)
+    needs_full_index = False
+
+    def exists(self) -> bool:
+        """存储中是否已有索引数据"""
+        raise NotImplementedError
+
+    def load(self) -> Optional[Dict]:
+        """
+        加载完整索引
+
+        Returns:
+            索引字典，结构与material_index.json一致；存储为空时返回None
+        """
+        raise NotImplementedError
+
+    def load_meta(self) -> Optional[Dict]:
+        """
+        只加载索引元信息(不含素材和分类)
+
+        Returns:
+            元信息字典；后端不支持单独加载或存储为空时返回None
+        """
+        return None
+
+    def change_seq(self) -> Any:
+        """
+        存储的当前变更序号，其他进程写入后会变化
+
+        Returns:
+            可比较是否相等的序号；后端不跟踪变更时返回None
+        """
+        return None
+
+    def load_tombstones(self) -> Optional[Dict]:
+        """
+        只加载素材墓碑(软删除、等待回收的素材)
+
+        Returns:
+            {素材ID: 墓碑}；后端不支持单独加载时返回None
+        """
+        return None
+
+    def changes_since(self, seq: Any) -> Optional[Dict]:
+        """
+        读取某个变更序号之后被修改的素材和分类
+
+        Args:
+            seq: 上次同步时的change_seq()
+
+        Returns:
+            {'seq': 新的序号, 'meta': 元信息, 'materials': {素材ID: 记录或None(已删除)},
+             'categories': {分类名称: 分类属性或None(已删除)}, 'tombstones': {素材ID: 墓碑或None(已回收)}}；
+            无法增量读取(后端不支持、日志已被清理或索引被整体替换)时返回None，调用方需完整重新加载
+        """
+        return None
+
+    def apply(self,
+              index: Dict,
+              materials: Iterable[str] = (),
+              deleted_materials: Iterable[str] = (),
+              categories: Iterable[str] = (),
+              deleted_categories: Iterable[str] = (),
+              tombstones: Iterable[str] = (),
+              deleted_tombstones: Iterable[str] = ()) -> bool:
+        """
+        持久化一组变更
+
+        Args:
+            index: 当前内存中的完整索引
+            materials: 需要写入的素材ID
+            deleted_materials: 需要删除的素材ID
+            categories: 需要写入的分类名称
+            deleted_categories: 需要删除的分类名称
+            tombstones: 需要写入的墓碑(素材ID)
+            deleted_tombstones: 需要删除的墓碑(素材ID)
+
+        Returns:
+            写入是否成功
+        """
+        raise NotImplementedError
+
+    def replace_all(self, index: Dict) -> bool:
+        """用给定索引整体替换存储内容"""
+        raise NotImplementedError
+
+    def close(self):
+        """释放后端持有的资源"""
+        pass
+
+
+class JsonStorageBackend(StorageBackend):
+    """单文件JSON后端(旧格式)，每次变更都重写整个material_index.json"""
+
+    name = 'json'
+    needs_full_index = True
+
+    def __init__(self, index_path: str):
+        """
+        初始化JSON后端
+
+        Args:
+            index_path: material_index.json的路径
+        """
+        self.index_path = index_path
+
+    def exists(self) -> bool:
+        return os.path.exists(self.index_path)
+
+    def load(self) -> Optional[Dict]:
+        if not self.exists():
+            return None
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def change_seq(self) -> Any:
+        # 单文件格式没有变更日志，以文件的修改时间和大小判断是否被其他进程改写
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def apply(self, index, materials=(), deleted_materials=(),
+              categories=(), deleted_categories=(),
+              tombstones=(), deleted_tombstones=()) -> bool:
+        # 单文件格式无法局部更新，只能整体重写
+        return self.replace_all(index)
+
+    def replace_all(self, index: Dict) -> bool:
+        # 先写临时文件再原子替换，崩溃时不会留下截断的索引
+        index_dir = os.path.dirname(self.index_path)
+        fd, tmp_path = tempfile.mkstemp(prefix='.material_index.', suffix='.tmp', dir=index_dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.index_path)
+            return True
+        except Exception as e:
+            logger.error(f"保存素材索引失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+
+class SQLiteStorageBackend(StorageBackend):
+    """SQLite后端(WAL模式)，每个素材/分类占一行，写入只涉及变更的行"""
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS materials (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            category TEXT,
+            added_at TEXT,
+            last_accessed TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_materials_category ON materials(category);
+        CREATE TABLE IF NOT EXISTS categories (
+            name TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tombstones (
+            id TEXT PRIMARY KEY,
+            deleted_at TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str):
+        """
+        初始化SQLite后端
+
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def exists(self) -> bool:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row is not None
+
+    def load_meta(self) -> Optional[Dict]:
+        if not self.exists():
+            return None
+
+        meta = {key: None for key in META_FIELDS}
+        for key, value in self.conn.execute('SELECT key, value FROM meta'):
+            meta[key] = json.loads(value)
+        return meta
+
+    def load(self) -> Optional[Dict]:
+        index = self.load_meta()
+        if index is None:
+            return None
+
+        categories = {}
+        for name, data in self.conn.execute('SELECT name, data FROM categories ORDER BY rowid'):
+            info = json.loads(data)
+            info['count'] = 0
+            info['materials'] = []
+            categories[name] = info
+
+        materials = {}
+        for (data,) in self.conn.execute('SELECT data FROM materials ORDER BY rowid'):
+            material = json.loads(data)
+            materials[material['id']] = material
+
+            # 分类成员关系由素材行推导，不单独存储
+            category = material.get('category')
+            if category:
+                if category not in categories:
+                    categories[category] = {'count': 0, 'materials': []}
+                categories[category]['count'] += 1
+                categories[category]['materials'].append(material['id'])
+
+        index['categories'] = categories
+        index['materials'] = materials
+        index['total_materials'] = len(materials)
+        index['tombstones'] = self.load_tombstones()
+        return index
+
+    def load_tombstones(self) -> Optional[Dict]:
+        return {
+            material_id: json.loads(data)
+            for material_id, data in self.conn.execute('SELECT id, data FROM tombstones ORDER BY rowid')
+        }
+
+    def apply(self, index, materials=(), deleted_materials=(),
+              categories=(), deleted_categories=(),
+              tombstones=(), deleted_tombstones=()) -> bool:
+        try:
+            with self._transaction() as cur:
+                self._write_meta(cur, index)
+                for material_id in deleted_materials:
+                    cur.execute('DELETE FROM materials WHERE id = ?', (material_id,))
+                for material_id in materials:
+                    material = index['materials'].get(material_id)
+                    if material is not None:
+                        self._write_material(cur, material)
+                for name in deleted_categories:
+                    cur.execute('DELETE FROM categories WHERE name = ?', (name,))
+                for name in categories:
+                    info = index['categories'].get(name)
+                    if info is not None:
+                        self._write_category(cur, name, info)
+                for material_id in deleted_tombstones:
+                    cur.execute('DELETE FROM tombstones WHERE id = ?', (material_id,))
+                for material_id in tombstones:
+                    tombstone = index.get('tombstones', {}).get(material_id)
+                    if tombstone is not None:
+                        self._write_tombstone(cur, material_id, tombstone)
+                self._log_changes(cur, [('material', mid) for mid in (*materials, *deleted_materials)]
+                                  + [('category', name) for name in (*categories, *deleted_categories)]
+                                  + [('tombstone', mid) for mid in (*tombstones, *deleted_tombstones)])
+            return True
+        except Exception as e:
+            logger.error(f"保存素材索引失败: {str(e)}")
+            return False
+
+    def replace_all(self, index: Dict) -> bool:
+        try:
+            with self._transaction() as cur:
+                cur.execute('DELETE FROM materials')
+                cur.execute('DELETE FROM categories')
+                self._write_meta(cur, index)
+                for name, info in index.get('categories', {}).items():
+                    self._write_category(cur, name, info)
+                for material in index.get('materials', {}).values():
+                    self._write_material(cur, material)
+                # 不带墓碑的索引(例如旧格式迁移)保留已有墓碑，避免待回收的文件无人清理
+                if 'tombstones' in index:
+                    cur.execute('DELETE FROM tombstones')
+                    for material_id, tombstone in index['tombstones'].items():
+                        self._write_tombstone(cur, material_id, tombstone)
+                # 整体替换后其他进程无法增量同步
+                cur.execute('DELETE FROM changes')
+                self._log_changes(cur, [('reset', '')])
+            return True
+        except Exception as e:
+            logger.error(f"保存素材索引失败: {str(e)}")
+            return False
+
+    def change_seq(self) -> Any:
+        row = self.conn.execute('SELECT MAX(seq) FROM changes').fetchone()
+        return row[0] or 0
+
+    def changes_since(self, seq: Any) -> Optional[Dict]:
+        if seq is None:
+            return None
+
+        # 在同一个读事务中读取日志和对应的行，得到一致的视图
+        cur = self.conn.cursor()
+        cur.execute('BEGIN')
+        try:
+            rows = cur.execute('SELECT seq, kind, key FROM changes WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+            if not rows:
+                return {'seq': seq, 'meta': None, 'materials': {}, 'categories': {}, 'tombstones': {}}
+            oldest = cur.execute('SELECT MIN(seq) FROM changes').fetchone()[0]
+            if oldest > seq + 1 or any(kind == 'reset' for _, kind, _ in rows):
+                return None
+
+            material_ids = list(dict.fromkeys(key for _, kind, key in rows if kind == 'material'))
+            names = list(dict.fromkeys(key for _, kind, key in rows if kind == 'category'))
+            tombstone_ids = list(dict.fromkeys(key for _, kind, key in rows if kind == 'tombstone'))
+            materials = dict.fromkeys(material_ids)
+            categories = dict.fromkeys(names)
+            tombstones = dict.fromkeys(tombstone_ids)
+            for chunk in _chunks(material_ids):
+                query = f"SELECT data FROM materials WHERE id IN ({','.join('?' * len(chunk))})"
+                for (data,) in cur.execute(query, chunk):
+                    material = json.loads(data)
+                    materials[material['id']] = material
+            for chunk in _chunks(names):
+                query = f"SELECT name, data FROM categories WHERE name IN ({','.join('?' * len(chunk))})"
+                for name, data in cur.execute(query, chunk):
+                    categories[name] = json.loads(data)
+            for chunk in _chunks(tombstone_ids):
+                query = f"SELECT id, data FROM tombstones WHERE id IN ({','.join('?' * len(chunk))})"
+                for material_id, data in cur.execute(query, chunk):
+                    tombstones[material_id] = json.loads(data)
+
+            meta = {key: None for key in META_FIELDS}
+            for key, value in cur.execute('SELECT key, value FROM meta'):
+                meta[key] = json.loads(value)
+            return {'seq': rows[-1][0], 'meta': meta, 'materials': materials, 'categories': categories,
+                    'tombstones': tombstones}
+        finally:
+            cur.execute('COMMIT')
+            cur.close()
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception as e:
+            logger.warning(f"关闭索引数据库失败: {str(e)}")
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    @staticmethod
+    def _log_changes(cur, entries):
+        """记录变更日志(没有素材/分类变更时也记一条，元信息变化同样需要同步)，并清理过旧的条目"""
+        entries = entries or [('meta', '')]
+        cur.executemany('INSERT INTO changes(kind, key) VALUES(?, ?)', entries)
+        seq = cur.execute('SELECT MAX(seq) FROM changes').fetchone()[0]
+        # 每跨过1000条清理一次
+        if seq // 1000 != (seq - len(entries)) // 1000:
+            cur.execute('DELETE FROM changes WHERE seq <= ?', (seq - CHANGE_LOG_RETAIN,))
+
+    @staticmethod
+    def _write_meta(cur, index: Dict):
+        cur.executemany(
+            'INSERT INTO meta(key, value) VALUES(?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            [(key, json.dumps(index.get(key), ensure_ascii=False)) for key in META_FIELDS]
+        )
+
+    @staticmethod
+    def _write_material(cur, material: Dict):
+        cur.execute(
+            'INSERT INTO materials(id, type, category, added_at, last_accessed, data) '
+            'VALUES(?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE SET type = excluded.type, category = excluded.category, '
+            'added_at = excluded.added_at, last_accessed = excluded.last_accessed, data = excluded.data',
+            (
+                material['id'],
+                material['type'],
+                material.get('category'),
+                material.get('added_at'),
+                material.get('last_accessed'),
+                json.dumps(material, ensure_ascii=False)
+            )
+        )
+
+    @staticmethod
+    def _write_category(cur, name: str, info: Dict):
+        # 成员列表和计数由素材行推导，这里只保存分类自身的属性
+        data = {k: v for k, v in info.items() if k not in ('count', 'materials')}
+        cur.execute(
+            'INSERT INTO categories(name, data) VALUES(?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET data = excluded.data',
+            (name, json.dumps(data, ensure_ascii=False))
+        )
+
+    @staticmethod
+    def _write_tombstone(cur, material_id: str, tombstone: Dict):
+        cur.execute(
+            'INSERT INTO tombstones(id, deleted_at, data) VALUES(?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE SET deleted_at = excluded.deleted_at, data = excluded.data',
+            (material_id, tombstone.get('deleted_at'), json.dumps(tombstone, ensure_ascii=False))
+        )
+
+
+class _Transaction:
+    """SQLite显式事务上下文，异常时回滚"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.cur = None
+
+    def __enter__(self):
+        self.cur = self.conn.cursor()
+        self.cur.execute('BEGIN IMMEDIATE')
+        return self.cur
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.cur.execute('COMMIT')
+        else:
+            self.cur.execute('ROLLBACK')
+        self.cur.close()
+        return False
+
+
+def _chunks(items, size: int = 500):
+    """按SQLite参数数量上限分批"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def create_backend(backend: str, metadata_dir: str) -> StorageBackend:
+    """
+    按名称创建存储后端
+
+    Args:
+        backend: 后端名称('sqlite' 或 'json')
+        metadata_dir: 素材库的metadata目录
+
+    Returns:
+        存储后端实例
+    """
+    if backend == 'sqlite':
+        return SQLiteStorageBackend(os.path.join(metadata_dir, 'material_index.db'))
+    elif backend == 'json':
+        return JsonStorageBackend(os.path.join(metadata_dir, 'material_index.json'))
+    else:
+        raise ValueError(f"不支持的存储后端: {backend}")
+
+
+def migrate_json_index(json_path: str, db_path: str) -> int:
+    """
+    将旧的material_index.json一次性迁移到SQLite后端
+
+    Args:
+        json_path: 旧索引文件路径
+        db_path: 目标数据库路径
+
+    Returns:
+        迁移的素材数量
+    """
+    if not os.path.exists(json_path):
+        raise FileNotFoundError(f"索引文件不存在: {json_path}")
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+
+    index.setdefault('categories', {})
+    index.setdefault('materials', {})
+    index.setdefault('version', '1.0')
+    index.setdefault('created_at', datetime.datetime.now().isoformat())
+    index['total_materials'] = len(index['materials'])
+
+    backend = SQLiteStorageBackend(db_path)
+    try:
+        if not backend.replace_all(index):
+            raise RuntimeError(f"写入索引数据库失败: {db_path}")
+    finally:
+        backend.close()
+
+    logger.info(f"迁移素材索引成功: {json_path} -> {db_path}, 共{len(index['materials'])}个素材")
+    return len(index['materials'])
@@ -0,0 +1,86 @@
+"""
+素材文件的目录布局
+按素材ID前缀分层存放(例如 videos/ab/cd/<id>.mp4)，避免单个目录中文件过多
+"""
+import os
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 新建素材库的默认布局：两级目录，每级取ID的两个字符(65536个叶子目录)
+DEFAULT_LAYOUT = {'levels': 2, 'width': 2}
+
+# 旧版素材库的平铺布局
+FLAT_LAYOUT = {'levels': 0, 'width': 2}
+
+
+def normalize_layout(layout: Optional[Dict]) -> Dict:
+    """
+    校验并补全布局配置
+
+    Args:
+        layout: {'levels': 目录层数, 'width': 每层使用的ID字符数}，None表示平铺布局
+
+    Returns:
+        布局配置
+    """
+    if not layout:
+        return dict(FLAT_LAYOUT)
+    levels = int(layout.get('levels', DEFAULT_LAYOUT['levels']))
+    width = int(layout.get('width', DEFAULT_LAYOUT['width']))
+    if levels < 0 or width < 1 or levels * width > 16:
+        raise ValueError(f"无效的目录布局: levels={levels}, width={width}")
+    return {'levels': levels, 'width': width}
+
+
+def shard_dirs(material_id: str, layout: Dict) -> List[str]:
+    """
+    素材所在的分层子目录名称
+
+    Args:
+        material_id: 素材ID(UUID，忽略其中的连字符)
+        layout: 布局配置
+
+    Returns:
+        子目录名称列表，平铺布局时为空
+    """
+    key = material_id.replace('-', '').lower()
+    width = layout['width']
+    return [key[i * width:(i + 1) * width] for i in range(layout['levels'])]
+
+
+def material_file_path(type_dir: str, material_id: str, ext: str, layout: Dict) -> str:
+    """
+    素材文件在布局中的路径
+
+    Args:
+        type_dir: 素材类型目录(例如 <素材库>/videos)
+        material_id: 素材ID
+        ext: 文件扩展名(含点)
+        layout: 布局配置
+
+    Returns:
+        文件路径
+    """
+    return os.path.join(type_dir, *shard_dirs(material_id, layout), f"{material_id}{ext}")
+
+
+def relocated_path(base_dir: str, file_path: str, layout: Dict) -> Optional[str]:
+    """
+    已有素材文件在新布局中的路径(保持类型目录和文件名不变)
+
+    Args:
+        base_dir: 素材库目录
+        file_path: 当前文件路径，文件名为 <素材ID><扩展名>
+        layout: 新布局
+
+    Returns:
+        新路径；文件不在素材库的类型目录中时返回None
+    """
+    relative = os.path.relpath(file_path, base_dir)
+    parts = relative.split(os.sep)
+    if len(parts) < 2 or parts[0] in (os.pardir, os.curdir):
+        return None
+    material_id, ext = os.path.splitext(parts[-1])
+    return material_file_path(os.path.join(base_dir, parts[0]), material_id, ext, layout)
@@ -0,0 +1,193 @@
+"""
+素材关键词全文索引
+CJK文本按单字和二元组(bigram)切分，拉丁文字/数字按词及词前缀切分，
+检索时先用n-gram倒排表求候选，再按原有的子串语义逐条校验并打分
+"""
+import re
+import logging
+from typing import Dict, Iterable, List, Mapping, Optional, Set
+
+from .inverted_index import intersect_postings
+
+logger = logging.getLogger(__name__)
+
+# 中日韩文字范围(假名、CJK统一表意文字及扩展A、兼容表意文字、韩文音节)
+_CJK_RANGES = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+
+# 第一组为CJK连续段；第二组为非CJK的字母词或数字串(下划线、标点和字母/数字交界处都会断词)
+_TOKEN_RE = re.compile(rf'([{_CJK_RANGES}]+)|([^\W\d_{_CJK_RANGES}]+|\d+)')
+
+# 拉丁词前缀的最大索引长度，更长的查询词只用前缀检索，再由子串校验过滤
+MAX_PREFIX_LENGTH = 12
+
+# 命中字段的权重
+FIELD_WEIGHTS = {
+    'filename': 3.0,
+    'tag': 2.0,
+    'metadata': 1.0
+}
+
+
+def index_grams(text: str) -> Set[str]:
+    """
+    生成文本的索引n-gram
+
+    Args:
+        text: 已转换为小写的文本
+
+    Returns:
+        n-gram集合
+    """
+    grams = set()
+    for cjk, word in set(_TOKEN_RE.findall(text)):
+        if cjk:
+            grams.update(cjk)
+            grams.update([cjk[i:i + 2] for i in range(len(cjk) - 1)])
+        else:
+            grams.update([word[:i] for i in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1)])
+    return grams
+
+
+def query_grams(query: str) -> Set[str]:
+    """
+    生成查询词的检索n-gram，候选素材必须包含全部n-gram
+
+    Args:
+        query: 已转换为小写的查询词
+
+    Returns:
+        n-gram集合，查询词中没有可索引字符时为空
+    """
+    grams = set()
+    for cjk, word in _TOKEN_RE.findall(query):
+        if cjk:
+            if len(cjk) == 1:
+                grams.add(cjk)
+            else:
+                grams.update(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            grams.add(word[:MAX_PREFIX_LENGTH])
+    return grams
+
+
+def material_texts(material: Dict) -> List[str]:
+    """素材中参与关键词检索的文本：原始文件名、标签和一级字符串元数据"""
+    texts = [material.get('original_filename') or '']
+    texts.extend(material.get('tags') or ())
+    texts.extend(v for v in (material.get('metadata') or {}).values() if isinstance(v, str))
+    return texts
+
+
+def match_score(material: Dict, query_lower: str) -> float:
+    """
+    按子串语义校验素材是否匹配查询词，并计算相关度
+
+    Args:
+        material: 素材记录
+        query_lower: 已转换为小写的查询词
+
+    Returns:
+        相关度分数，不匹配时为0
+    """
+    score = 0.0
+
+    filename = (material.get('original_filename') or '').lower()
+    if query_lower in filename:
+        score += FIELD_WEIGHTS['filename']
+
+    for tag in material.get('tags') or ():
+        tag_lower = tag.lower()
+        if query_lower in tag_lower:
+            # 完全相同的标签额外加分
+            score += FIELD_WEIGHTS['tag'] * (2 if tag_lower == query_lower else 1)
+
+    for value in (material.get('metadata') or {}).values():
+        if isinstance(value, str) and query_lower in value.lower():
+            score += FIELD_WEIGHTS['metadata']
+
+    return score
+
+
+class NGramIndex:
+    """n-gram倒排索引，n-gram -> 素材ID集合"""
+
+    def __init__(self):
+        self._postings = {}
+
+    def add(self, material: Dict):
+        """索引素材的文本字段"""
+        material_id = material['id']
+        postings = self._postings
+        for gram in self._material_grams(material):
+            if gram in postings:
+                postings[gram].add(material_id)
+            else:
+                postings[gram] = {material_id}
+
+    def remove(self, material: Dict):
+        """按素材当前的文本字段移除索引"""
+        material_id = material['id']
+        for gram in self._material_grams(material):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(material_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def clear(self):
+        self._postings.clear()
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    def as_sets(self) -> Dict[str, Set[str]]:
+        """转换为 n-gram -> 集合，用于一致性比对"""
+        return {gram: set(postings) for gram, postings in self._postings.items()}
+
+    def search(self,
+               query: str,
+               materials: Mapping[str, Dict],
+               restrict: Optional[Iterable[str]] = None,
+               score: bool = True) -> Dict[str, float]:
+        """
+        检索匹配查询词的素材
+
+        Args:
+            query: 查询词
+            materials: 素材ID -> 素材记录
+            restrict: 只在这些素材中检索(其他条件的过滤结果)，None表示不限制
+            score: 是否计算相关度；为False时分数均为1.0，且查询词恰好是单个n-gram时跳过逐条校验
+
+        Returns:
+            素材ID -> 相关度分数，只包含通过子串校验的素材
+        """
+        query_lower = query.lower()
+        grams = query_grams(query_lower)
+
+        if grams:
+            postings_list = [self._postings.get(gram, ()) for gram in grams]
+            if restrict is not None:
+                postings_list.append(restrict if isinstance(restrict, (set, dict)) else set(restrict))
+            candidate_ids = intersect_postings(postings_list)
+
+            # 查询词本身就是一个n-gram时，命中倒排表即意味着子串匹配
+            if not score and grams == {query_lower}:
+                return dict.fromkeys(candidate_ids, 1.0)
+        else:
+            # 查询词只有标点等不可索引的字符，退回逐条匹配
+            candidate_ids = materials.keys() if restrict is None else restrict
+
+        scores = {}
+        for material_id in candidate_ids:
+            material = materials.get(material_id)
+            if material is None:
+                continue
+            value = match_score(material, query_lower)
+            if value:
+                scores[material_id] = value if score else 1.0
+        return scores
+
+    @staticmethod
+    def _material_grams(material: Dict) -> Set[str]:
+        # 各字段以换行分隔后一次切分，换行本身会断词
+        return index_grams('\n'.join(material_texts(material)).lower())
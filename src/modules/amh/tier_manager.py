@@ -0,0 +1,389 @@
+"""
+素材文件的冷热分层存储
+热层为素材库目录(本地SSD)，冷层为另一个目录(可以是挂载的对象存储)；
+热层超出容量时按last_accessed把最久未访问的文件降级到冷层，
+访问冷层素材时加入提升队列，由后台线程移回热层。
+移动提交后原层文件保留一段宽限期再删除，已经交给调用方的路径在此期间仍然可以打开；
+待删除的文件记录在metadata/tiering.db中，进程重启后继续按期删除
+"""
+import os
+import time
+import queue
+import shutil
+import sqlite3
+import logging
+import datetime
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 降级时把热层用量降到容量的这个比例以下，避免每次只腾出一个文件
+LOW_WATERMARK = 0.9
+
+# 统计工作集大小的时间窗口(小时)
+WORKING_SET_WINDOWS = {'1h': 1, '24h': 24, '7d': 24 * 7}
+
+
+def _copy_atomic(src: str, dst: str):
+    """复制文件到目标路径(先写临时文件再重命名，中断时不会留下不完整的目标文件)"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp_path = f"{dst}.tiering.tmp"
+    try:
+        try:
+            # 同一文件系统上用硬链接，避免复制数据
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TierManager:
+    """冷热分层管理器，由MaterialRepository按tiers参数创建
+
+    各层用量和文件的最近访问时间取自仓库的文件引用索引(随素材增删和访问增量维护)，
+    降级检查和指标统计不需要在仓库锁内遍历全部素材。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS retired (
+        path TEXT PRIMARY KEY,
+        unlink_after REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_retired_unlink_after ON retired(unlink_after);
+    """
+
+    def __init__(self,
+                 repository,
+                 cold_dir: str,
+                 hot_bytes: int,
+                 cold_bytes: Optional[int] = None,
+                 interval: Optional[float] = 300.0,
+                 unlink_grace: float = 60.0):
+        """
+        初始化分层管理器
+
+        Args:
+            repository: 素材仓库
+            cold_dir: 冷层目录，文件按在素材库中的相对路径存放
+            hot_bytes: 热层容量(字节)
+            cold_bytes: 冷层容量(字节)，None表示不限；冷层已满时不再降级
+            interval: 后台降级检查间隔(秒)，为None或不大于0时不启动后台线程，
+                由调用方执行run_once()和process_promotions()
+            unlink_grace: 移动后原层文件保留的秒数，此前通过get_material_path取得的路径在此期间仍然可以打开
+        """
+        self.repository = repository
+        self.base_dir = os.path.abspath(repository.base_dir)
+        self.cold_dir = os.path.abspath(cold_dir)
+        self.hot_bytes = hot_bytes
+        self.cold_bytes = cold_bytes
+        self.interval = interval
+        self.unlink_grace = unlink_grace
+        os.makedirs(self.cold_dir, exist_ok=True)
+
+        self._db_lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(repository.base_dir, 'metadata', 'tiering.db'),
+            timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+        self._move_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._counters = {
+            'hot_hits': 0,
+            'cold_hits': 0,
+            'promotions': 0,
+            'promoted_bytes': 0,
+            'demotions': 0,
+            'demoted_bytes': 0,
+            'failed_moves': 0,
+            'retired_unlinked': 0
+        }
+        self._counters_lock = threading.Lock()
+
+        self._thread = None
+        if interval and interval > 0:
+            self._thread = threading.Thread(target=self._run, name='amh-tier-manager', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """停止后台线程(未处理的提升请求丢弃，下次访问时重新加入)"""
+        self._stop_event.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._db_lock:
+            self.conn.close()
+
+    def _count(self, name: str, value: int = 1):
+        with self._counters_lock:
+            self._counters[name] += value
+
+    def is_cold(self, file_path: str) -> bool:
+        """文件是否位于冷层"""
+        return os.path.abspath(file_path).startswith(self.cold_dir + os.sep)
+
+    def get_tier(self, material: Dict) -> str:
+        """素材文件所在的层('hot'或'cold')"""
+        return 'cold' if self.is_cold(material['file_path']) else 'hot'
+
+    def _cold_path(self, hot_path: str) -> Optional[str]:
+        relative = os.path.relpath(os.path.abspath(hot_path), self.base_dir)
+        if relative.startswith(os.pardir):
+            return None
+        return os.path.join(self.cold_dir, relative)
+
+    def _hot_path(self, cold_path: str) -> str:
+        return os.path.join(self.base_dir, os.path.relpath(os.path.abspath(cold_path), self.cold_dir))
+
+    def record_access(self, material: Dict):
+        """
+        记录一次素材文件访问：统计命中层，冷层素材加入提升队列
+
+        Args:
+            material: 素材记录
+        """
+        if not self.is_cold(material['file_path']):
+            self._count('hot_hits')
+            return
+        self._count('cold_hits')
+        with self._queued_lock:
+            if material['id'] in self._queued:
+                return
+            self._queued.add(material['id'])
+        self._queue.put(material['id'])
+
+    def _run(self):
+        """后台线程：处理提升队列，按间隔执行降级"""
+        next_check = time.monotonic()
+        while not self._stop_event.is_set():
+            timeout = max(next_check - time.monotonic(), 0)
+            try:
+                material_id = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                material_id = None
+            if self._stop_event.is_set():
+                break
+            try:
+                if material_id is not None:
+                    self._promote(material_id)
+                if time.monotonic() >= next_check:
+                    self.run_once()
+                    next_check = time.monotonic() + self.interval
+            except Exception as e:
+                logger.error(f"分层存储后台任务失败: {str(e)}")
+
+    def process_promotions(self) -> int:
+        """
+        处理提升队列中的全部请求
+
+        Returns:
+            移回热层的文件数
+        """
+        promoted = 0
+        while True:
+            try:
+                material_id = self._queue.get_nowait()
+            except queue.Empty:
+                return promoted
+            if material_id is not None and self._promote(material_id):
+                promoted += 1
+
+    def _promote(self, material_id: str) -> bool:
+        """把素材文件移回热层"""
+        with self._queued_lock:
+            self._queued.discard(material_id)
+        repo = self.repository
+        with repo._lock:
+            material = repo.index['materials'].get(material_id)
+            if material is None or not self.is_cold(material['file_path']):
+                return False
+            cold_path = material['file_path']
+
+        if self._move(cold_path, self._hot_path(cold_path)):
+            self._count('promotions')
+            return True
+        return False
+
+    def _usage(self) -> Tuple[int, int]:
+        """(热层用量, 冷层用量)；文件引用索引在首次调用时构建，之后增量维护"""
+        repo = self.repository
+        with repo._lock:
+            files = repo.indexes.files
+            cold_total = files.bytes_under(self.cold_dir + os.sep)
+            return files.total_bytes - cold_total, cold_total
+
+    def _list_files(self) -> List[Tuple[str, int, str]]:
+        """[(文件路径, 大小, 最近访问时间)]，锁内只复制条目列表"""
+        repo = self.repository
+        with repo._lock:
+            items = list(repo.indexes.files.items())
+        return [(path, entry['size'], entry['last_accessed']) for path, entry in items]
+
+    def run_once(self) -> Dict:
+        """
+        执行一次降级：先删除宽限期已过的原层文件，热层超出容量时按最近访问时间从旧到新降级文件
+
+        Returns:
+            {'demoted': 降级的文件数, 'bytes': 降级的字节数, 'hot_bytes': 降级后的热层用量}
+        """
+        self.purge_retired()
+        hot_total, cold_total = self._usage()
+        report = {'demoted': 0, 'bytes': 0, 'hot_bytes': hot_total}
+        if hot_total <= self.hot_bytes:
+            return report
+
+        target = self.hot_bytes * LOW_WATERMARK
+        hot = [item for item in self._list_files() if not self.is_cold(item[0])]
+        for path, size, _ in sorted(hot, key=lambda item: item[2]):
+            if hot_total <= target:
+                break
+            if self.cold_bytes is not None and cold_total + size > self.cold_bytes:
+                logger.warning(f"冷层容量不足，停止降级: 热层{hot_total}字节, 冷层{cold_total}字节")
+                break
+            cold_path = self._cold_path(path)
+            if cold_path is None or not os.path.exists(path):
+                continue
+            if self._move(path, cold_path):
+                hot_total -= size
+                cold_total += size
+                report['demoted'] += 1
+                report['bytes'] += size
+                self._count('demotions')
+
+        report['hot_bytes'] = hot_total
+        logger.info(f"分层存储降级完成: {report}")
+        return report
+
+    def _move(self, old_path: str, new_path: str) -> bool:
+        """
+        移动素材文件并更新引用它的素材记录
+
+        先复制到新路径，在仓库写锁内确认新文件仍然存在、仍有素材引用旧路径后提交；
+        旧文件登记为待删除，宽限期过后由purge_retired()删除。
+        期间文件被修改或删除时放弃本次移动。
+        """
+        repo = self.repository
+        with self._move_lock:
+            try:
+                size = os.path.getsize(old_path)
+                _copy_atomic(old_path, new_path)
+            except OSError as e:
+                logger.error(f"移动素材文件失败: {old_path}, {str(e)}")
+                self._count('failed_moves')
+                return False
+
+            with repo._write_lock():
+                # 复制期间可能有新的素材引用同一文件；新路径可能是宽限期已过、刚被删除的原层文件
+                current = sorted(repo.indexes.files.get(old_path))
+                committed = False
+                if current and os.path.exists(new_path):
+                    # 提交之前登记旧文件，提交后崩溃也不会遗留无人引用的文件(到期时仍被引用则只取消登记)
+                    self._retire(old_path)
+                    repo._journal(materials=current)
+                    for material_id in current:
+                        material = repo.index['materials'][material_id]
+                        repo.indexes.remove(material)
+                        material['file_path'] = new_path
+                        repo.indexes.add(material)
+                    committed = repo._persist(materials=current)
+                    if not committed:
+                        self._unretire(old_path)
+                if committed:
+                    self._unretire(new_path)
+                elif not repo.indexes.files.get(new_path) and os.path.exists(new_path):
+                    os.remove(new_path)
+            if not committed:
+                return False
+
+        name = 'promoted_bytes' if self.is_cold(old_path) else 'demoted_bytes'
+        self._count(name, size)
+        logger.debug(f"移动素材文件: {old_path} -> {new_path}")
+        return True
+
+    def _retire(self, path: str):
+        """登记宽限期过后删除的原层文件"""
+        with self._db_lock:
+            self.conn.execute(
+                'INSERT INTO retired(path, unlink_after) VALUES(?, ?) '
+                'ON CONFLICT(path) DO UPDATE SET unlink_after = excluded.unlink_after',
+                (path, time.time() + self.unlink_grace)
+            )
+
+    def _unretire(self, path: str):
+        with self._db_lock:
+            self.conn.execute('DELETE FROM retired WHERE path = ?', (path,))
+
+    def purge_retired(self, now: float = None) -> int:
+        """
+        删除宽限期已过的原层文件，期间重新被素材引用的文件(例如降级后又被提升回原路径)只取消登记
+
+        Args:
+            now: 判断是否到期的时间戳，默认为当前时间
+
+        Returns:
+            删除的文件数
+        """
+        now = time.time() if now is None else now
+        with self._db_lock:
+            paths = [row[0] for row in self.conn.execute(
+                'SELECT path FROM retired WHERE unlink_after <= ?', (now,)
+            )]
+        if not paths:
+            return 0
+
+        repo = self.repository
+        unlinked = 0
+        # 在写锁内删除，与_move的提交互斥
+        with repo._write_lock():
+            for path in paths:
+                if not repo.indexes.files.get(path):
+                    try:
+                        os.remove(path)
+                        unlinked += 1
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logger.warning(f"删除原层文件失败，下次重试: {path}, {str(e)}")
+                        continue
+                self._unretire(path)
+        self._count('retired_unlinked', unlinked)
+        return unlinked
+
+    def get_metrics(self) -> Dict:
+        """
+        分层存储指标，用于评估热层容量
+
+        Returns:
+            命中计数和命中率、提升/降级次数和字节数、各层用量和容量、提升队列长度、
+            等待宽限期过后删除的原层文件数，以及各时间窗口内被访问过的文件总大小(working_set，热层至少需要这么大才能全部命中)
+        """
+        with self._counters_lock:
+            metrics = dict(self._counters)
+        hits = metrics['hot_hits'] + metrics['cold_hits']
+        metrics['hit_ratio'] = round(metrics['hot_hits'] / hits, 4) if hits else None
+
+        metrics['hot_bytes'], metrics['cold_bytes'] = self._usage()
+        metrics['hot_budget'] = self.hot_bytes
+        metrics['cold_budget'] = self.cold_bytes
+        metrics['promotion_queue'] = self._queue.qsize()
+        with self._db_lock:
+            metrics['retired_files'] = self.conn.execute('SELECT COUNT(*) FROM retired').fetchone()[0]
+
+        files = self._list_files()
+        now = datetime.datetime.now()
+        metrics['working_set'] = {}
+        for name, hours in WORKING_SET_WINDOWS.items():
+            since = (now - datetime.timedelta(hours=hours)).isoformat()
+            metrics['working_set'][name] = sum(size for _, size, last_accessed in files if last_accessed >= since)
+        return metrics
@@ -0,0 +1,1341 @@
+"""
+素材仓库测试模块
+测试src/modules/amh/material_repository.py中的MaterialRepository
+"""
+import unittest
+import os
+import sys
+import json
+import shutil
+import tempfile
+import io
+import zipfile
+import tarfile
+import time
+import datetime
+import multiprocessing
+
+# 添加项目根目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.modules.amh import archive_export
+from src.modules.amh.asset_indexer import AssetIndexer
+from src.modules.amh.material_repository import MaterialRepository, RevisionConflict
+from src.modules.amh.media_probe import parse_ffprobe
+from src.modules.amh.scrubber import IntegrityScrubber
+from src.modules.amh.segment_manager import SegmentManager
+from src.modules.amh.storage_layout import relocated_path
+
+
+def _concurrent_writer(repo_dir: str, material_id: str, worker: int, rounds: int):
+    """多进程测试的写入进程：合并标签、读改写计数器并导入新素材"""
+    repo = MaterialRepository(repo_dir, access_flush_interval=None)
+    try:
+        for i in range(rounds):
+            repo.update_material_tags(material_id, [f"w{worker}_{i}"])
+            with repo.batch():
+                counter = repo.get_material(material_id)['metadata'].get('counter', 0)
+                repo.update_material_metadata(material_id, {'counter': counter + 1})
+            path = os.path.join(repo_dir, f"incoming_{worker}_{i}.mp4")
+            with open(path, 'wb') as f:
+                f.write(f"{worker}_{i}".encode())
+            repo.add_material(path, 'video', {}, tags=[f"worker{worker}"], move_file=True)
+    finally:
+        repo.close()
+
+
+class MaterialRepositoryTestCase(unittest.TestCase):
+    """素材仓库测试基类，提供临时目录和测试文件"""
+
+    backend = 'sqlite'
+    repo_options = {}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo_dir = os.path.join(self.tmp_dir, 'repo')
+        self.repo = self.open_repo()
+
+    def tearDown(self):
+        self.repo.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_file(self, name: str, content: bytes = b'data') -> str:
+        """在临时目录中创建测试文件"""
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def open_repo(self) -> MaterialRepository:
+        """打开测试用素材仓库"""
+        return MaterialRepository(self.repo_dir, backend=self.backend, **self.repo_options)
+
+    def reopen(self) -> MaterialRepository:
+        """重新打开素材仓库"""
+        self.repo.close()
+        self.repo = self.open_repo()
+        return self.repo
+
+
+class TestSQLiteBackend(MaterialRepositoryTestCase):
+    """测试SQLite存储后端"""
+
+    def test_persist_and_reload(self):
+        """测试素材、分类和关联在重新打开后保持一致"""
+        first = self.repo.add_material(
+            self.make_file('a.mp4'), 'video', {'source': 'douyin'},
+            tags=['美食'], category='产品特写'
+        )
+        second = self.repo.add_material(self.make_file('b.mp4'), 'video', {}, category='产品特写')
+        self.repo.update_material_tags(second, ['测试'])
+        self.repo.link_materials(first, second)
+        self.repo.create_category('空分类', '描述')
+        self.repo.delete_material(first)
+
+        repo = self.reopen()
+        self.assertIsNone(repo.get_material(first))
+        self.assertEqual(repo.get_material(second)['tags'], ['测试'])
+        categories = repo.get_all_categories()
+        self.assertEqual(categories['产品特写']['materials'], [second])
+        self.assertEqual(categories['产品特写']['count'], 1)
+        self.assertEqual(categories['空分类']['description'], '描述')
+        self.assertEqual(repo.get_statistics()['total_materials'], 1)
+
+    def test_migrate_from_json(self):
+        """测试首次打开时从旧JSON索引迁移"""
+        self.repo.close()
+        legacy = MaterialRepository(self.repo_dir, backend='json')
+        material_id = legacy.add_material(self.make_file('a.mp4'), 'video', {}, category='旧分类')
+        legacy.close()
+        os.remove(os.path.join(self.repo_dir, 'metadata', 'material_index.db'))
+
+        repo = self.reopen()
+        self.assertEqual(repo.get_material(material_id)['category'], '旧分类')
+        self.assertEqual(repo.get_all_categories()['旧分类']['materials'], [material_id])
+
+
+class TestJsonBackend(MaterialRepositoryTestCase):
+    """测试旧的JSON存储后端"""
+
+    backend = 'json'
+
+    def test_index_file_written(self):
+        """测试JSON后端仍然写入material_index.json"""
+        material_id = self.repo.add_material(self.make_file('a.mp4'), 'video', {})
+        with open(os.path.join(self.repo_dir, 'metadata', 'material_index.json'), encoding='utf-8') as f:
+            index = json.load(f)
+        self.assertIn(material_id, index['materials'])
+
+
+class TestAccessTracking(MaterialRepositoryTestCase):
+    """测试访问时间的缓冲写入"""
+
+    backend = 'json'
+    repo_options = {'access_flush_interval': None}
+
+    def read_index(self) -> dict:
+        with open(os.path.join(self.repo_dir, 'metadata', 'material_index.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_read_does_not_write_index(self):
+        """测试读取素材不会重写索引文件"""
+        material_id = self.repo.add_material(self.make_file('a.mp4'), 'video', {})
+        index_path = os.path.join(self.repo_dir, 'metadata', 'material_index.json')
+        mtime = os.stat(index_path).st_mtime_ns
+
+        for _ in range(5):
+            material = self.repo.get_material(material_id)
+        self.assertEqual(os.stat(index_path).st_mtime_ns, mtime)
+        self.assertEqual(self.repo.access_tracker.pending_count, 1)
+
+        # 刷新后写入最后一次访问时间
+        self.repo.access_tracker.flush()
+        self.assertEqual(
+            self.read_index()['materials'][material_id]['last_accessed'],
+            material['last_accessed']
+        )
+
+    def test_close_flushes_and_search_uses_access_order(self):
+        """测试关闭时写入访问时间，搜索仍按最近访问排序"""
+        first = self.repo.add_material(self.make_file('a.mp4'), 'video', {})
+        second = self.repo.add_material(self.make_file('b.mp4'), 'video', {})
+        self.repo.get_material(first)
+
+        results, _ = self.repo.search_materials()
+        self.assertEqual([m['id'] for m in results], [first, second])
+
+        accessed_at = self.repo.get_material(first)['last_accessed']
+        repo = self.reopen()
+        self.assertEqual(repo.index['materials'][first]['last_accessed'], accessed_at)
+
+    def test_reads_defer_access_index_updates(self):
+        """测试访问时间索引构建后读取不重排索引，下次按访问时间搜索时批量更新(少量和大量两种路径)"""
+        with self.repo.batch():
+            ids = [self.repo.add_material(self.make_file(f"{i}.mp4", str(i).encode()), 'video', {})
+                   for i in range(100)]
+        self.repo.search_materials(limit=1)
+        index = self.repo.indexes._parts['last_accessed']
+        for touched in (ids[:3], ids[10:90]):
+            entries = list(index._entries)
+            for material_id in touched:
+                self.repo.get_material(material_id)
+            self.assertEqual(index._entries, entries)
+
+            results, _ = self.repo.search_materials(limit=len(touched))
+            self.assertEqual({m['id'] for m in results}, set(touched))
+            self.assertTrue(self.repo.check_indexes()['consistent'])
+
+
+class TestBatch(MaterialRepositoryTestCase):
+    """测试批量模式"""
+
+    backend = 'json'
+
+    def test_batch_commits_once(self):
+        """测试批量模式退出时只写入一次索引"""
+        index_path = os.path.join(self.repo_dir, 'metadata', 'material_index.json')
+        mtime = os.stat(index_path).st_mtime_ns
+
+        with self.repo.batch():
+            material_id = self.repo.add_material(self.make_file('a.mp4'), 'video', {})
+            self.repo.update_material_tags(material_id, ['批量'])
+            self.repo.set_material_category(material_id, '导入')
+            self.assertEqual(os.stat(index_path).st_mtime_ns, mtime)
+
+        repo = self.reopen()
+        self.assertEqual(repo.get_material(material_id)['tags'], ['批量'])
+        self.assertEqual(repo.get_all_categories()['导入']['materials'], [material_id])
+        self.assertEqual(
+            [name for name in os.listdir(os.path.dirname(index_path)) if name.endswith('.tmp')], []
+        )
+
+    def test_transaction_rolls_back_on_error(self):
+        """测试异常时在内存中回滚并撤回已导入的文件"""
+        kept = self.repo.add_material(self.make_file('keep.mp4'), 'video', {}, category='保留')
+        source = self.make_file('new.mp4')
+
+        with self.assertRaises(ValueError):
+            with self.repo.transaction():
+                self.repo.add_material(source, 'video', {}, category='新分类')
+                self.repo.update_material_tags(kept, ['修改'])
+                self.repo.delete_material(kept)
+                raise ValueError('中断导入')
+
+        self.assertTrue(os.path.exists(source))
+        material = self.repo.get_material(kept)
+        self.assertEqual(material['tags'], [])
+        self.assertTrue(os.path.exists(material['file_path']))
+        self.assertEqual(set(self.repo.get_all_categories()), {'保留'})
+        self.assertEqual(self.repo.get_statistics()['total_materials'], 1)
+
+
+class TestInvertedIndexes(MaterialRepositoryTestCase):
+    """测试标签/分类/类型倒排索引"""
+
+    def test_indexes_follow_mutations(self):
+        """测试各种修改之后倒排索引与素材记录保持一致"""
+        first = self.repo.add_material(self.make_file('a.mp4'), 'video', {}, tags=['美食', '探店'], category='A')
+        second = self.repo.add_material(self.make_file('b.jpg'), 'image', {}, tags=['美食'], category='A')
+        third = self.repo.add_material(self.make_file('c.mp4'), 'video', {}, tags=['旅行'])
+        self.repo.update_material_tags(third, ['美食'], replace=True)
+        self.repo.set_material_category(second, 'B')
+        self.repo.delete_material(first)
+
+        self.assertTrue(self.repo.check_indexes()['consistent'])
+        self.assertEqual(set(self.repo.indexes.tags.get('美食')), {second, third})
+        self.assertNotIn('探店', self.repo.indexes.tags)
+        self.assertNotIn('A', self.repo.get_all_categories())
+
+        results, total = self.repo.search_materials(material_type='video', tags=['美食'])
+        self.assertEqual(([m['id'] for m in results], total), ([third], 1))
+        results, total = self.repo.search_materials(category='不存在的分类')
+        self.assertEqual(total, 0)
+
+    def test_repair(self):
+        """测试一致性检查能发现并修复索引偏差"""
+        material_id = self.repo.add_material(self.make_file('a.mp4'), 'video', {}, tags=['美食'])
+        self.repo.indexes.tags.remove('美食', material_id)
+        self.repo.indexes.types.add('image', material_id)
+
+        report = self.repo.check_indexes(repair=True)
+        self.assertFalse(report['consistent'])
+        self.assertTrue(report['repaired'])
+        self.assertIn('tags', report['issues'])
+        self.assertIn('types', report['issues'])
+        self.assertTrue(self.repo.check_indexes()['consistent'])
+
+
+class TestKeywordSearch(MaterialRepositoryTestCase):
+    """测试n-gram全文索引的关键词检索"""
+
+    def search_ids(self, query: str) -> set:
+        results, _ = self.repo.search_materials(query=query)
+        return {m['id'] for m in results}
+
+    def test_cjk_and_latin_queries(self):
+        """测试CJK子串、拉丁词前缀和数字的检索"""
+        first = self.repo.add_material(
+            self.make_file('IMG_2024_unboxing.mp4'), 'video', {'title': '夏季新品美食探店'}, tags=['Food']
+        )
+        second = self.repo.add_material(self.make_file('clip.mp4'), 'video', {'title': '美味食堂'}, tags=['探'])
+
+        self.assertEqual(self.search_ids('食探'), {first})
+        self.assertEqual(self.search_ids('探'), {first, second})
+        self.assertEqual(self.search_ids('UNBOX'), {first})
+        self.assertEqual(self.search_ids('2024'), {first})
+        self.assertEqual(self.search_ids('img_2024'), {first})
+        # 所有二元组都存在但不连续时，由子串校验排除
+        self.assertEqual(self.search_ids('美食堂'), set())
+
+    def test_index_follows_metadata_updates(self):
+        """测试更新元数据和标签后全文索引同步更新"""
+        material_id = self.repo.add_material(self.make_file('a.mp4'), 'video', {'title': '旧标题'})
+        self.repo.update_material_metadata(material_id, {'title': '新标题'})
+        self.repo.update_material_tags(material_id, ['春节'])
+
+        self.assertEqual(self.search_ids('旧标题'), set())
+        self.assertEqual(self.search_ids('新标题'), {material_id})
+        self.assertEqual(self.search_ids('春节'), {material_id})
+        self.assertTrue(self.repo.check_indexes()['consistent'])
+
+
+class TestSecondaryIndexes(MaterialRepositoryTestCase):
+    """测试元数据有序二级索引和范围查询"""
+
+    def add_clip(self, name: str, duration, platform: str, title: str) -> str:
+        return self.repo.add_material(
+            self.make_file(name), 'video',
+            {'video': {'duration': duration}, 'platform': platform, 'title': title}
+        )
+
+    def search_ids(self, **kwargs) -> set:
+        results, _ = self.repo.search_materials(**kwargs)
+        return {m['id'] for m in results}
+
+    def test_range_in_and_prefix_queries(self):
+        """测试索引路径与未索引路径上的范围、IN和前缀条件结果一致"""
+        short = self.add_clip('a.mp4', 5, 'douyin', '春节促销')
+        medium = self.add_clip('b.mp4', 15.5, 'tiktok', '春季上新')
+        long = self.add_clip('c.mp4', '40', 'weibo', '夏季清仓')
+
+        queries = [
+            ({'video.duration': {'$gte': 10, '$lte': 30}}, {medium}),
+            ({'video.duration': {'$gt': 5}}, {medium, long}),
+            ({'platform': {'$in': ['douyin', 'tiktok']}}, {short, medium}),
+            ({'title': {'$prefix': '春'}}, {short, medium}),
+            ({'platform': 'weibo'}, {long}),
+        ]
+        # 未建索引时按元数据逐条过滤(字符串'40'不与数字比较)
+        self.assertEqual(self.search_ids(metadata_filters=queries[1][0]), {medium})
+
+        self.repo.create_metadata_index('video.duration', 'number')
+        self.repo.create_metadata_index('platform', 'string')
+        self.repo.create_metadata_index('title', 'string')
+        for filters, expected in queries:
+            self.assertEqual(self.search_ids(metadata_filters=filters), expected, filters)
+
+        self.assertEqual(
+            self.search_ids(tags=None, metadata_filters={'video.duration': {'$lt': 100}}, material_type='video'),
+            {short, medium, long}
+        )
+        added_at = self.repo.get_material(medium)['added_at']
+        self.assertEqual(self.search_ids(added_after=added_at), {medium, long})
+        self.assertEqual(self.search_ids(added_before=added_at), {short, medium})
+
+    def test_index_definitions_persist(self):
+        """测试索引定义在重新打开后保留，且随素材修改保持一致"""
+        material_id = self.add_clip('a.mp4', 12, 'douyin', '标题')
+        self.assertTrue(self.repo.create_metadata_index('video.duration'))
+        self.assertFalse(self.repo.create_metadata_index('video.duration'))
+
+        repo = self.reopen()
+        self.assertEqual(repo.get_metadata_indexes(), {'video.duration': 'number'})
+        repo.update_material_metadata(material_id, {'video': {'duration': 60}})
+        self.assertEqual(self.search_ids(metadata_filters={'video.duration': {'$gte': 30}}), {material_id})
+        self.assertTrue(repo.check_indexes()['consistent'])
+
+        self.assertTrue(repo.drop_metadata_index('video.duration'))
+        self.assertEqual(self.reopen().get_metadata_indexes(), {})
+
+
+class TestSearchPagination(MaterialRepositoryTestCase):
+    """测试排序和游标分页"""
+
+    def setUp(self):
+        super().setUp()
+        self.ids = []
+        for i in range(25):
+            metadata = {'title': f"素材{i}"}
+            if i % 4:
+                metadata['duration'] = (i * 7) % 10
+            self.ids.append(self.repo.add_material(
+                self.make_file(f"{i}.mp4"), 'video', metadata, tags=['偶数' if i % 2 == 0 else '奇数']
+            ))
+
+    def collect_pages(self, limit: int, **kwargs) -> list:
+        """用游标依次读取全部分页"""
+        collected, cursor = [], None
+        while True:
+            page = self.repo.search_page(limit=limit, cursor=cursor, **kwargs)
+            self.assertLessEqual(len(page['items']), limit)
+            collected.extend(m['id'] for m in page['items'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                return collected
+
+    def test_cursor_pages_match_full_sort(self):
+        """测试各排序字段的游标分页结果与整体排序后切片一致，且没有排序值的素材排在最后"""
+        for material_id in self.ids[::3]:
+            self.repo.get_material(material_id)
+        materials = self.repo.index['materials']
+
+        def duration_key(mid):
+            duration = materials[mid]['metadata'].get('duration')
+            return (duration is not None, duration or 0, mid)
+
+        expectations = {
+            'last_accessed': lambda mid: (materials[mid]['last_accessed'], mid),
+            'added_at': lambda mid: (materials[mid]['added_at'], mid),
+            'duration': duration_key,
+        }
+        for sort_by, key in expectations.items():
+            for tags in (None, ['偶数']):
+                candidates = [mid for mid in self.ids if not tags or tags[0] in materials[mid]['tags']]
+                expected = sorted(candidates, key=key, reverse=True)
+                self.assertEqual(self.collect_pages(4, sort_by=sort_by, tags=tags), expected, (sort_by, tags))
+
+        self.repo.create_metadata_index('duration', 'number')
+        ascending = sorted(self.ids, key=lambda mid: (not duration_key(mid)[0],) + duration_key(mid)[1:])
+        self.assertEqual(self.collect_pages(6, sort_by='duration', descending=False), ascending)
+
+        results, total = self.repo.search_materials(sort_by='added_at', limit=5, offset=20)
+        self.assertEqual(([m['id'] for m in results], total), (self.ids[4::-1], 25))
+
+    def test_relevance_and_invalid_cursor(self):
+        """测试按相关度排序以及游标与排序方式不一致时报错"""
+        exact = self.repo.add_material(self.make_file('x.mp4'), 'video', {}, tags=['新品'])
+        partial = self.repo.add_material(self.make_file('新品_y.mp4'), 'video', {}, tags=['新品发布'])
+        page = self.repo.search_page(query='新品', sort_by='relevance', limit=1)
+        self.assertEqual([m['id'] for m in page['items']], [partial])
+        self.assertEqual(page['total'], 2)
+        page = self.repo.search_page(query='新品', sort_by='relevance', limit=1, cursor=page['next_cursor'])
+        self.assertEqual(([m['id'] for m in page['items']], page['next_cursor']), ([exact], None))
+
+        cursor = self.repo.search_page(limit=1)['next_cursor']
+        with self.assertRaises(ValueError):
+            self.repo.search_page(limit=1, sort_by='added_at', cursor=cursor)
+
+
+class TestStatistics(MaterialRepositoryTestCase):
+    """测试增量维护的统计信息和版本化快照"""
+
+    def test_statistics_follow_mutations(self):
+        """测试统计信息随修改更新，读取不会使快照失效"""
+        first = self.repo.add_material(self.make_file('a.mp4'), 'video', {}, tags=['美食', '探店'], category='A')
+        second = self.repo.add_material(self.make_file('b.jpg'), 'image', {}, tags=['美食'], category='A')
+        third = self.repo.add_material(self.make_file('c.mp4'), 'video', {}, tags=['旅行'])
+        self.repo.delete_material(first)
+        self.repo.update_material_tags(third, ['美食'])
+
+        stats = self.repo.get_statistics()
+        self.assertEqual(stats['total_materials'], 2)
+        self.assertEqual(stats['type_counts'], {'video': 1, 'image': 1})
+        self.assertEqual(stats['category_counts'], {'A': 1})
+        self.assertEqual(list(stats['top_tags'].items())[0], ('美食', 2))
+        self.assertEqual([m['id'] for m in stats['recent_materials']], [third, second])
+
+        snapshot = self.repo.get_statistics_snapshot()
+        self.repo.get_material(second)
+        self.assertIsNone(self.repo.get_statistics_snapshot(known_version=snapshot['version']))
+        self.assertIs(self.repo.get_statistics_snapshot(), snapshot)
+
+        self.repo.set_material_category(third, 'B')
+        updated = self.repo.get_statistics_snapshot(known_version=snapshot['version'])
+        self.assertNotEqual(updated['version'], snapshot['version'])
+        self.assertEqual(updated['statistics']['category_counts'], {'A': 1, 'B': 1})
+
+        # 其他进程对相同的数据给出相同的版本号
+        other = self.open_repo()
+        try:
+            self.assertIsNone(other.get_statistics_snapshot(known_version=updated['version']))
+        finally:
+            other.close()
+
+
+class TestContentDeduplication(MaterialRepositoryTestCase):
+    """测试内容寻址的去重存储"""
+
+    def test_duplicates_share_one_file(self):
+        """测试相同内容只保存一份文件，删除时按引用计数保留文件"""
+        content = b'viral clip' * 100
+        first = self.repo.add_material(self.make_file('douyin.mp4', content), 'video', {'platform': 'douyin'})
+        second = self.repo.add_material(self.make_file('tiktok.mp4', content), 'video', {'platform': 'tiktok'},
+                                        move_file=False)
+        other = self.repo.add_material(self.make_file('other.mp4', b'other'), 'video', {})
+
+        path = self.repo.get_material_path(first)
+        self.assertEqual(self.repo.get_material_path(second), path)
+        self.assertNotEqual(self.repo.get_material_path(other), path)
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(os.path.join(self.repo_dir, 'videos'))), 2)
+        self.assertEqual(len(self.repo.find_materials_by_content(self.repo.get_material(first)['content_hash'])), 2)
+
+        report = self.repo.get_dedup_report()
+        self.assertEqual(report['bytes_saved'], len(content))
+        self.assertEqual(report['duplicate_references'], 1)
+        self.assertEqual(report['unique_files'], 2)
+
+        self.repo.delete_material(first)
+        self.repo.gc.run_once(material_ids=[first])
+        self.assertTrue(os.path.exists(path))
+        self.repo.delete_material(second)
+        self.assertTrue(os.path.exists(path))
+        self.repo.gc.run_once(material_ids=[second])
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(self.repo.check_indexes()['consistent'])
+
+    def test_deduplicate_existing(self):
+        """测试为旧素材补算哈希并合并重复文件"""
+        first = self.repo.add_material(self.make_file('a.mp4', b'same'), 'video', {}, deduplicate=False)
+        second = self.repo.add_material(self.make_file('b.mp4', b'same'), 'video', {}, deduplicate=False)
+        for material_id in (first, second):
+            material = self.repo.index['materials'][material_id]
+            self.repo.indexes.remove(material)
+            del material['content_hash'], material['file_size']
+            self.repo.indexes.add(material)
+        duplicate_path = self.repo.get_material_path(second)
+
+        report = self.repo.deduplicate_existing()
+        self.assertEqual((report['hashed'], report['merged'], report['bytes_saved']), (2, 1, 4))
+        self.assertFalse(os.path.exists(duplicate_path))
+        self.assertEqual(self.reopen().get_material_path(second), self.repo.get_material_path(first))
+
+
+class TestBulkIngest(MaterialRepositoryTestCase):
+    """测试并行批量导入"""
+
+    def test_bulk_ingest_reports_failures(self):
+        """测试批量导入并行处理文件、合并探测元数据，单项失败不影响其他素材"""
+        items = [
+            {'file_path': self.make_file(f"{i}.mp4", f"clip {i}".encode()), 'material_type': 'video',
+             'metadata': {'title': f"素材{i}"}, 'tags': ['批量'], 'category': '导入'}
+            for i in range(6)
+        ]
+        items.insert(2, {'file_path': os.path.join(self.tmp_dir, 'missing.mp4'), 'material_type': 'video'})
+        items.append({'file_path': self.make_file('x.txt'), 'material_type': 'document', 'move_file': False})
+
+        progress = []
+        results = self.repo.add_materials_bulk(
+            items, workers=3,
+            progress_callback=lambda done, total: progress.append((done, total)),
+            probe_fn=lambda path: {'title': '探测标题', 'size': os.path.getsize(path)}
+        )
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual([r['error'] is None for r in results], [True, True, False, True, True, True, True, False])
+        self.assertEqual(progress[-1], (8, 8))
+        material = self.repo.get_material(results[0]['material_id'])
+        self.assertEqual(material['metadata'], {'title': '素材0', 'size': 6})
+        self.assertTrue(os.path.exists(items[-1]['file_path']))
+
+        repo = self.reopen()
+        self.assertEqual(repo.get_statistics()['category_counts'], {'导入': 6})
+        self.assertTrue(repo.check_indexes()['consistent'])
+
+
+class TestIngestStrategies(MaterialRepositoryTestCase):
+    """测试零复制导入策略及其回退"""
+
+    def test_strategies_record_and_preserve_content(self):
+        """测试各策略导入的文件内容和哈希一致，并在素材记录中记录所用策略"""
+        content = os.urandom(300 * 1024)
+        moved = self.repo.add_material(self.make_file('moved.mp4', content), 'video', {}, deduplicate=False)
+        self.assertEqual(self.repo.get_material(moved)['ingest_strategy'], 'rename')
+        expected_hash = self.repo.get_material(moved)['content_hash']
+
+        for strategies in (('copy_file_range', 'buffered'), ('sendfile', 'buffered'), ('buffered',),
+                           ('reflink', 'hardlink', 'buffered')):
+            self.repo.ingest_strategies = strategies
+            source = self.make_file(f"{strategies[0]}.mp4", content)
+            material = self.repo.get_material(
+                self.repo.add_material(source, 'video', {}, move_file=False, deduplicate=False)
+            )
+            self.assertIn(material['ingest_strategy'], strategies)
+            self.assertEqual(material['content_hash'], expected_hash)
+            with open(material['file_path'], 'rb') as f:
+                self.assertEqual(f.read(), content)
+            if material['ingest_strategy'] == 'hardlink':
+                self.assertTrue(os.path.samefile(source, material['file_path']))
+
+        with self.assertRaises(ValueError):
+            MaterialRepository(self.repo_dir, ingest_strategies=('teleport',))
+
+    def test_default_copy_is_independent_of_source(self):
+        """测试默认策略复制导入后修改源文件不影响仓库内的文件"""
+        source = self.make_file('source.mp4', b'a' * 100)
+        material_id = self.repo.add_material(source, 'video', {}, move_file=False)
+        material = self.repo.get_material(material_id)
+        self.assertNotEqual(material['ingest_strategy'], 'hardlink')
+
+        with open(source, 'r+b') as f:
+            f.write(b'b' * 10)
+        with open(material['file_path'], 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 100)
+
+
+class TestStorageLayout(MaterialRepositoryTestCase):
+    """测试分层目录布局和在线迁移"""
+
+    def test_reshard_legacy_flat_repository(self):
+        """测试平铺布局的旧素材库迁移到分层布局，中断后重新执行可继续"""
+        self.repo.close()
+        self.repo_dir = os.path.join(self.tmp_dir, 'legacy')
+        self.repo = MaterialRepository(self.repo_dir, layout={'levels': 0})
+        first = self.repo.add_material(self.make_file('a.mp4', b'a'), 'video', {})
+        second = self.repo.add_material(self.make_file('b.mp4', b'a'), 'video', {})
+        third = self.repo.add_material(self.make_file('c.jpg', b'c'), 'image', {})
+        flat_path = self.repo.get_material_path(third)
+        self.assertEqual(os.path.dirname(flat_path), os.path.join(self.repo_dir, 'images'))
+
+        # 模拟上次迁移中断：新路径的链接已创建但索引未更新
+        layout = {'levels': 2, 'width': 2}
+        stale = relocated_path(self.repo_dir, flat_path, layout)
+        os.makedirs(os.path.dirname(stale))
+        os.link(flat_path, stale)
+
+        progress = []
+        report = self.repo.reshard(layout, batch_size=1, progress_callback=lambda done, total: progress.append(done))
+        self.assertEqual((report['moved'], report['failed']), (2, 0))
+        self.assertEqual(progress, [1, 2])
+
+        repo = self.reopen()
+        self.assertEqual(repo.get_material_path(third), stale)
+        self.assertFalse(os.path.exists(flat_path))
+        self.assertEqual(repo.get_material_path(first), repo.get_material_path(second))
+        self.assertTrue(os.path.exists(repo.get_material_path(first)))
+        self.assertEqual(repo.reshard(layout)['moved'], 0)
+
+        fourth = repo.add_material(self.make_file('d.mp4', b'd'), 'video', {})
+        relative = os.path.relpath(repo.get_material_path(fourth), self.repo_dir).split(os.sep)
+        self.assertEqual(relative[:3], ['videos', fourth[:2], fourth[2:4]])
+
+    def test_import_legacy_export_keeps_layout(self):
+        """测试导入没有layout字段的旧格式导出后沿用当前布局，之后可以继续添加素材"""
+        legacy_path = os.path.join(self.tmp_dir, 'legacy_export.json')
+        with open(legacy_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': '1.0', 'total_count': 0, 'materials': {},
+                       'categories': {'春节': {'count': 0, 'materials': []}}}, f)
+        layout = self.repo.index['layout']
+        self.assertTrue(self.repo.import_index(legacy_path))
+        self.assertEqual(self.repo.index['layout'], layout)
+
+        material_id = self.repo.add_material(self.make_file('a.mp4', b'a'), 'video', {}, category='春节')
+        self.assertTrue(os.path.exists(self.reopen().get_material_path(material_id)))
+        self.assertEqual(self.repo.index['layout'], layout)
+
+
+class TestStreamingExport(MaterialRepositoryTestCase):
+    """测试NDJSON流式导出和导入"""
+
+    def populate(self) -> list:
+        self.repo.create_category('空分类', '描述')
+        self.repo.create_metadata_index('duration')
+        return [
+            self.repo.add_material(self.make_file(f"{i}.mp4", f"{i}".encode()), 'video',
+                                   {'duration': i}, tags=[f"标签{i % 2}"], category='分类')
+            for i in range(5)
+        ]
+
+    def test_round_trip_with_resume(self):
+        """测试gzip流式导出后在新素材库中分批导入，中断后从断点继续"""
+        ids = self.populate()
+        export_path = self.repo.export_index(os.path.join(self.tmp_dir, 'index.ndjson.gz'))
+
+        target = MaterialRepository(os.path.join(self.tmp_dir, 'target'))
+        try:
+            # 第二批提交时模拟中断
+            original = target._import_stream_chunk
+            calls = []
+
+            def failing_chunk(records, policy, report):
+                calls.append(len(records))
+                if len(calls) == 2:
+                    raise KeyboardInterrupt()
+                original(records, policy, report)
+
+            target._import_stream_chunk = failing_chunk
+            with self.assertRaises(KeyboardInterrupt):
+                target.import_ndjson(export_path, batch_size=2)
+            target._import_stream_chunk = original
+
+            report = target.import_ndjson(export_path, batch_size=2)
+            self.assertGreater(report['resumed_from_line'], 0)
+            self.assertTrue(report['complete'])
+            self.assertEqual(target.get_statistics()['total_materials'], 5)
+            self.assertEqual(target.get_all_categories()['空分类']['description'], '描述')
+            self.assertEqual(target.get_metadata_indexes(), {'duration': 'number'})
+            self.assertEqual(target.get_material(ids[3])['tags'], ['标签1'])
+            self.assertTrue(target.check_indexes()['consistent'])
+            self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'target', 'metadata', 'import_state.json')))
+        finally:
+            target.close()
+
+    def test_merge_policies(self):
+        """测试skip、overwrite和replace合并策略"""
+        ids = self.populate()
+        export_path = self.repo.export_ndjson(os.path.join(self.tmp_dir, 'index.ndjson'))
+        self.repo.update_material_tags(ids[0], ['本地修改'], replace=True)
+
+        report = self.repo.import_ndjson(export_path, merge_policy='skip')
+        self.assertEqual((report['imported'], report['skipped']), (0, 5))
+        self.assertEqual(self.repo.get_material(ids[0])['tags'], ['本地修改'])
+
+        report = self.repo.import_ndjson(export_path, merge_policy='overwrite')
+        self.assertEqual(report['updated'], 5)
+        self.assertEqual(self.repo.get_material(ids[0])['tags'], ['标签0'])
+
+        extra = self.repo.add_material(self.make_file('extra.mp4', b'extra'), 'video', {})
+        self.assertTrue(self.repo.import_index(export_path))
+        self.assertIsNone(self.repo.get_material(extra))
+        self.assertEqual(self.repo.get_statistics()['total_materials'], 5)
+        self.assertTrue(self.repo.check_indexes()['consistent'])
+
+
+class TestIndexSnapshot(MaterialRepositoryTestCase):
+    """测试二进制索引快照和按需解码"""
+
+    def test_lazy_startup_from_snapshot(self):
+        """测试从快照启动时按需解码素材记录，索引在首次使用时构建且与完整加载一致"""
+        ids = [
+            self.repo.add_material(self.make_file(f"{i}.mp4", f"{i}".encode()), 'video',
+                                   {'title': f"春节素材{i}", 'duration': i}, tags=[f"标签{i % 2}"], category='分类')
+            for i in range(6)
+        ]
+        self.repo.create_metadata_index('duration')
+
+        repo = self.reopen()
+        materials = repo.index['materials']
+        self.assertIsNotNone(repo._snapshot)
+        self.assertEqual((len(materials), materials.loaded_count()), (6, 0))
+        self.assertFalse(repo.indexes.is_built('tags'))
+
+        self.assertEqual(repo.get_material(ids[0])['metadata']['title'], '春节素材0')
+        results, total = repo.search_materials(tags=['标签1'], sort_by='added_at', limit=2)
+        self.assertEqual(([m['id'] for m in results], total), ([ids[5], ids[3]], 3))
+        self.assertEqual(materials.loaded_count(), 3)
+        self.assertEqual(repo.search_materials(query='春节')[1], 6)
+        self.assertEqual(repo.search_materials(metadata_filters={'duration': {'$gte': 4}})[1], 2)
+
+        repo.delete_material(ids[1])
+        new_id = repo.add_material(self.make_file('new.mp4', b'new'), 'video', {}, tags=['标签1'])
+        self.assertEqual(repo.get_statistics()['total_materials'], 6)
+        self.assertEqual(materials.copy_ids()(), sorted(materials))
+        self.assertTrue(repo.check_indexes()['consistent'])
+
+        repo = self.reopen()
+        self.assertIsNotNone(repo._snapshot)
+        self.assertIn(new_id, repo.index['materials'])
+        self.assertNotIn(ids[1], repo.index['materials'])
+        self.assertTrue(repo.check_indexes()['consistent'])
+
+        # 墓碑不写入快照header，由存储后端加载，仍然可以恢复
+        self.assertNotIn('tombstones', repo._snapshot.meta)
+        self.assertIn(ids[1], repo.index['tombstones'])
+        self.assertTrue(repo.undelete_material(ids[1]))
+
+    def test_stale_snapshot_falls_back_to_full_load(self):
+        """测试快照之后的修改未写入快照(例如进程崩溃)时完整加载"""
+        self.repo.add_material(self.make_file('a.mp4', b'a'), 'video', {})
+        repo = self.reopen()
+        material_id = repo.add_material(self.make_file('b.mp4', b'b'), 'video', {})
+
+        # 模拟未正常关闭：不写快照
+        repo.access_tracker.close()
+        repo.backend.close()
+        repo._snapshot.close()
+        self.repo = self.open_repo()
+        self.assertIsNone(self.repo._snapshot)
+        self.assertIsNotNone(self.repo.get_material(material_id))
+
+
+class TestMultiProcess(MaterialRepositoryTestCase):
+    """测试多个进程同时打开同一素材库"""
+
+    def test_concurrent_writers_lose_no_updates(self):
+        """测试多个进程并发读改写同一素材时不丢失修改，其他进程只同步变更的记录"""
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest('需要fork启动方式')
+        material_id = self.repo.add_material(self.make_file('shared.mp4'), 'video', {})
+        self.repo.get_statistics()
+
+        workers, rounds = 4, 15
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=_concurrent_writer, args=(self.repo_dir, material_id, n, rounds))
+            for n in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            self.assertEqual(process.exitcode, 0)
+
+        # 已打开的仓库增量同步
+        self.assertEqual(self.repo.refresh(), 1 + workers * rounds)
+        material = self.repo.get_material(material_id)
+        self.assertEqual(len(material['tags']), workers * rounds)
+        self.assertEqual(material['metadata']['counter'], workers * rounds)
+        self.assertEqual(self.repo.search_materials(tags=[f"worker{workers - 1}"])[1], rounds)
+        self.assertEqual(self.repo.get_statistics()['total_materials'], 1 + workers * rounds)
+        self.assertTrue(self.repo.check_indexes()['consistent'])
+
+        repo = self.reopen()
+        self.assertEqual(repo.get_material(material_id)['metadata']['counter'], workers * rounds)
+        self.assertEqual(repo.get_statistics()['total_materials'], 1 + workers * rounds)
+
+    def test_reads_throttle_change_checks(self):
+        """测试节流时间内的重复读取不查询存储，超过后同步其他进程的修改"""
+        material_id = self.repo.add_material(self.make_file('a.mp4'), 'video', {})
+        other = self.open_repo()
+        try:
+            other.update_material_tags(material_id, ['其他进程'])
+        finally:
+            other.close()
+
+        queries = []
+        change_seq = self.repo.backend.change_seq
+        self.repo.backend.change_seq = lambda: queries.append(1) or change_seq()
+        self.repo.refresh_interval = 60
+        self.repo._refreshed_at = time.monotonic()
+        for _ in range(100):
+            self.assertEqual(self.repo.get_material(material_id)['tags'], [])
+        self.repo.get_all_categories()
+        self.assertEqual(queries, [])
+
+        self.repo._refreshed_at -= 60
+        self.assertEqual(self.repo.get_material(material_id)['tags'], ['其他进程'])
+        self.assertEqual(len(queries), 1)
+
+    def test_revision_conflict(self):
+        """测试修改时的乐观版本检查"""
+        material_id = self.repo.add_material(self.make_file('a.mp4'), 'video', {})
+        revision = self.repo.get_material(material_id)['revision']
+
+        other = self.open_repo()
+        try:
+            self.assertTrue(other.update_material_tags(material_id, ['其他进程'], expected_revision=revision))
+        finally:
+            other.close()
+
+        with self.assertRaises(RevisionConflict):
+            self.repo.update_material_metadata(material_id, {'title': '旧版本'}, expected_revision=revision)
+        material = self.repo.get_material(material_id)
+        self.assertEqual(material['tags'], ['其他进程'])
+        self.assertTrue(self.repo.update_material_metadata(
+            material_id, {'title': '新版本'}, expected_revision=material['revision']
+        ))
+
+
+class TestRelationGraph(MaterialRepositoryTestCase):
+    """测试素材关系图"""
+
+    def test_related_queries_and_cleanup(self):
+        """测试多跳查询、反向查询、批量关联以及删除素材时清理指向它的关联"""
+        a, b, c, d = (self.repo.add_material(self.make_file(f"{n}.mp4", n.encode()), 'video', {}) for n in 'abcd')
+        report = self.repo.link_materials_bulk([(a, b, 'remix'), (b, c, 'remix'), (c, a), (a, d, 'source'), (a, 'x')])
+        self.assertEqual(report, {'linked': 4, 'updated': 0, 'failed': 1})
+        self.assertTrue(self.repo.link_materials(a, d, 'remix'))
+
+        related = self.repo.get_related(a, depth=3)
+        self.assertEqual([(r['id'], r['depth']) for r in related], [(b, 1), (d, 1), (c, 2)])
+        self.assertEqual(related[2]['via'], b)
+        self.assertEqual([r['id'] for r in self.repo.get_related(c, depth=2, direction='in')], [b, a])
+        self.assertEqual([r['id'] for r in self.repo.get_related(b, types=['related'], direction='both')], [])
+        self.assertEqual([r['id'] for r in self.repo.get_related(c, types=['related'])], [a])
+
+        self.assertTrue(self.repo.delete_material(b))
+        self.assertEqual([r['id'] for r in self.repo.get_related(a, depth=3)], [d])
+        self.assertEqual([rel['id'] for rel in self.repo.get_material(a)['related_materials']], [d])
+        self.assertTrue(self.repo.unlink_materials(a, d))
+        self.assertTrue(self.repo.check_indexes()['consistent'])
+
+        repo = self.reopen()
+        self.assertEqual([r['id'] for r in repo.get_related(a, depth=5, direction='both')], [c])
+
+
+class TestSegmentManager(MaterialRepositoryTestCase):
+    """测试虚拟片段"""
+
+    def make_fake_ffmpeg(self) -> str:
+        """生成把输入文件复制到输出路径并记录调用参数的假ffmpeg"""
+        path = os.path.join(self.tmp_dir, 'ffmpeg')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"#!{sys.executable}\n"
+                    "import sys, shutil\n"
+                    "args = sys.argv[1:]\n"
+                    "shutil.copyfile(args[args.index('-i') + 1], args[-1])\n"
+                    f"open({os.path.join(self.tmp_dir, 'ffmpeg.log')!r}, 'a').write(' '.join(args) + '\\n')\n")
+        os.chmod(path, 0o755)
+        return path
+
+    def test_segments_and_clip_cache(self):
+        """测试片段按关键帧对齐记录、按需截取以及LRU缓存淘汰"""
+        source_id = self.repo.add_material(self.make_file('source.mp4', b'x' * 100), 'video', {})
+        last_accessed = self.repo.index['materials'][source_id]['last_accessed']
+        manager = SegmentManager(
+            self.repo, max_cache_bytes=150, ffmpeg=self.make_fake_ffmpeg(),
+            keyframe_fn=lambda path: [(0.0, 0), (2.0, 40), (4.0, 80)]
+        )
+        try:
+            first, second, third = manager.add_segments(source_id, [(2.5, 3.5, '开头'), (0.0, 1.0), (4.5, 6.0)])
+            segment = manager.get_segment(first)
+            self.assertEqual((segment['aligned_start'], segment['start_offset'], segment['end_offset']), (2.0, 40, 80))
+            self.assertEqual(manager.get_segment(third)['end_offset'], None)
+            self.assertEqual([s['id'] for s in manager.list_segments(source_id, start=1.0, end=5.0)], [first, third])
+
+            path = manager.materialize(first)
+            self.assertEqual(manager.materialize(first), path)
+            with open(os.path.join(self.tmp_dir, 'ffmpeg.log'), encoding='utf-8') as f:
+                calls = f.read().splitlines()
+            self.assertEqual(len(calls), 1)
+            self.assertIn('-ss 2.000', calls[0])
+            self.assertIn('-c copy', calls[0])
+
+            # 容量只能容纳一个片段文件，最久未使用的被淘汰
+            other = manager.materialize(second)
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(manager.cache_usage()['files'], 1)
+
+            self.assertTrue(manager.delete_segment(second))
+            self.assertFalse(os.path.exists(other))
+
+            # 片段操作不更新源素材的访问时间
+            self.assertEqual(self.repo.index['materials'][source_id]['last_accessed'], last_accessed)
+        finally:
+            manager.close()
+
+    def test_orphans_keep_restorable_sources(self):
+        """测试可恢复的已删除素材保留片段，回收后才清理；启动时删除遗留的未完成片段文件"""
+        source_id = self.repo.add_material(self.make_file('source.mp4', b'x' * 100), 'video', {})
+        manager = SegmentManager(self.repo, ffmpeg=self.make_fake_ffmpeg(), keyframe_fn=lambda path: [])
+        try:
+            segment_id = manager.add_segment(source_id, 0.0, 1.0)
+            self.repo.delete_material(source_id)
+            self.assertEqual(manager.remove_orphans(), 0)
+            self.assertIsNone(manager.materialize(segment_id))
+
+            self.assertTrue(self.repo.undelete_material(source_id))
+            self.assertIsNotNone(manager.materialize(segment_id))
+            self.repo.delete_material(source_id)
+            self.repo.gc.run_once(material_ids=[source_id])
+            self.assertEqual(manager.remove_orphans(), 1)
+        finally:
+            manager.close()
+
+        stale = os.path.join(manager.cache_dir, 'a_0.mp4.0123.tmp.mp4')
+        fresh = os.path.join(manager.cache_dir, 'b_0.mp4.4567.tmp.mp4')
+        for path in (stale, fresh):
+            with open(path, 'wb') as f:
+                f.write(b'partial')
+        os.utime(stale, (time.time() - 7200, time.time() - 7200))
+        SegmentManager(self.repo, keyframe_fn=lambda path: []).close()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+
+
+class TestTieredStorage(MaterialRepositoryTestCase):
+    """测试冷热分层存储"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo_dir = os.path.join(self.tmp_dir, 'repo')
+        self.cold_dir = os.path.join(self.tmp_dir, 'cold')
+        self.repo_options = {'tiers': {'cold_dir': self.cold_dir, 'hot_bytes': 250, 'interval': None}}
+        self.repo = self.open_repo()
+
+    def test_demote_and_promote(self):
+        """测试按最近访问时间降级、访问冷层素材后提升以及命中统计"""
+        a, b, c = (self.repo.add_material(self.make_file(f"{n}.mp4", n.encode() * 100), 'video', {}) for n in 'abc')
+        self.repo.get_material(a)
+
+        report = self.repo.tiers.run_once()
+        self.assertEqual((report['demoted'], report['hot_bytes']), (1, 200))
+        cold_path = self.repo.get_material(b)['file_path']
+        self.assertTrue(cold_path.startswith(self.cold_dir))
+        self.assertTrue(os.path.exists(cold_path))
+        # 降级后热层原文件在宽限期内保留
+        self.assertEqual(len([f for _, _, files in os.walk(os.path.join(self.repo_dir, 'videos')) for f in files]), 3)
+        self.assertEqual(self.repo.tiers.get_metrics()['retired_files'], 1)
+
+        # 冷层路径可以直接读取，同时加入提升队列
+        self.assertEqual(self.repo.get_material_path(b), cold_path)
+        self.assertEqual(self.repo.get_material_path(a), self.repo.get_material(a)['file_path'])
+        self.assertEqual(self.repo.tiers.process_promotions(), 1)
+        hot_path = self.repo.get_material_path(b)
+        self.assertTrue(hot_path.startswith(self.repo_dir))
+        with open(hot_path, 'rb') as f:
+            self.assertEqual(f.read(), b'b' * 100)
+
+        # 提升之前取得的冷层路径在宽限期内仍然可以打开
+        with open(cold_path, 'rb') as f:
+            self.assertEqual(f.read(), b'b' * 100)
+        self.assertEqual(self.repo.tiers.purge_retired(), 0)
+        # 降级时登记的热层原路径已被提升重新引用，到期时只取消登记
+        self.assertEqual(self.repo.tiers.purge_retired(now=time.time() + 61), 1)
+        self.assertFalse(os.path.exists(cold_path))
+        self.assertTrue(os.path.exists(hot_path))
+
+        metrics = self.repo.tiers.get_metrics()
+        self.assertEqual((metrics['hot_hits'], metrics['cold_hits'], metrics['promotions']), (2, 1, 1))
+        self.assertEqual((metrics['demotions'], metrics['hot_bytes'], metrics['working_set']['1h']), (1, 300, 300))
+        self.assertEqual((metrics['cold_bytes'], metrics['retired_files']), (0, 0))
+
+        # 各层用量随素材删除增量更新
+        self.repo.delete_material(c)
+        self.assertEqual(self.repo.tiers.get_metrics()['hot_bytes'], 200)
+        self.assertTrue(self.repo.check_indexes()['consistent'])
+
+        repo = self.reopen()
+        self.assertEqual(repo.get_material(b)['file_path'], hot_path)
+
+
+class TestAssetIndexer(MaterialRepositoryTestCase):
+    """测试投放目录索引器"""
+
+    def setUp(self):
+        super().setUp()
+        self.drop_dir = os.path.join(self.tmp_dir, 'drop')
+        os.makedirs(os.path.join(self.drop_dir, 'nested'))
+
+    def drop(self, relative: str, content: bytes) -> str:
+        path = os.path.join(self.drop_dir, relative)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_incremental_copy_with_checkpoint(self):
+        """测试复制模式下的导入、跳过临时文件以及重启后不重复导入"""
+        self.drop('a.mp4', b'a' * 10)
+        self.drop('nested/b.jpg', b'b' * 10)
+        self.drop('c.mp4.part', b'c')
+        self.drop('notes.txt', b'x')
+        indexer = AssetIndexer(self.repo, [self.drop_dir], move_file=False, settle_seconds=0, use_inotify=False)
+        self.assertEqual(indexer.run_once(), {'ingested': 2, 'failed': 0, 'pending': 0})
+        self.assertEqual(self.repo.get_statistics()['total_materials'], 2)
+        self.assertEqual(self.repo.search_materials(material_type='image')[0][0]['metadata']['source_path'],
+                         os.path.join(self.drop_dir, 'nested', 'b.jpg'))
+        indexer.stop()
+
+        # 重启后目录未变化时不重新列出
+        indexer = AssetIndexer(self.repo, [self.drop_dir], move_file=False, settle_seconds=0, use_inotify=False)
+        self.assertEqual(indexer.run_once()['ingested'], 0)
+        self.assertEqual((indexer.stats['scanned_dirs'], indexer.stats['skipped_dirs']), (0, 2))
+
+        self.drop('nested/d.png', b'd' * 10)
+        self.assertEqual(indexer.run_once()['ingested'], 1)
+        self.assertEqual(indexer.stats['scanned_dirs'], 1)
+        indexer.stop()
+
+    def test_debounce_and_move(self):
+        """测试文件写完之前不导入，移动模式下导入后离开投放目录"""
+        path = self.drop('a.mp4', b'a')
+        indexer = AssetIndexer(self.repo, {self.drop_dir: {'tags': ['inbox']}}, settle_seconds=60, use_inotify=False)
+        self.assertEqual(indexer.run_once(), {'ingested': 0, 'failed': 0, 'pending': 1})
+
+        indexer.settle_seconds = 0
+        self.assertEqual(indexer.run_once()['ingested'], 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.repo.search_materials(tags=['inbox'])[1], 1)
+        indexer.stop()
+
+    def test_watcher_thread(self):
+        """测试后台线程发现新文件(inotify不可用时为轮询)"""
+        indexer = AssetIndexer(self.repo, [self.drop_dir], settle_seconds=0.1, poll_interval=0.2)
+        indexer.start()
+        try:
+            for n in range(20):
+                self.drop(f"nested/{n}.mp4", str(n).encode())
+            deadline = time.time() + 10
+            while indexer.get_status()['ingested'] < 20 and time.time() < deadline:
+                time.sleep(0.1)
+        finally:
+            indexer.stop()
+        self.assertEqual(self.repo.get_statistics()['total_materials'], 20)
+
+
+class TestIntegrityScrubber(MaterialRepositoryTestCase):
+    """测试素材文件完整性巡检"""
+
+    def test_scrub_resume_and_repair_queue(self):
+        """测试发现缺失、大小和内容不一致，中断后继续以及恢复后的状态"""
+        ids = {self.repo.add_material(self.make_file(f"{n}.mp4", n.encode() * 10), 'video', {}): n for n in 'abcd'}
+        paths = {mid: self.repo.get_material(mid)['file_path'] for mid in ids}
+        missing, truncated, corrupted, healthy = sorted(ids)
+        os.remove(paths[missing])
+        with open(paths[truncated], 'wb') as f:
+            f.write(b'x')
+        with open(paths[corrupted], 'r+b') as f:
+            f.write(b'z')
+
+        options = {'chunk_size': 2, 'hash_sample_rate': 1, 'max_bytes_per_second': None}
+        scrubber = IntegrityScrubber(self.repo, **options)
+        report = scrubber.run_once(max_chunks=1)
+        self.assertEqual((report['checked'], report['problems'], report['pass_complete']), (2, 2, False))
+        self.assertEqual(scrubber.get_progress()['cursor'], truncated)
+        scrubber.close()
+
+        # 重新创建后从上次位置继续
+        scrubber = IntegrityScrubber(self.repo, **options)
+        report = scrubber.run_once()
+        self.assertEqual((report['checked'], report['hashed'], report['pass_complete']), (2, 2, True))
+        queue = {entry['material_id']: entry['problem'] for entry in scrubber.get_repair_queue()}
+        self.assertEqual(queue, {missing: 'missing', truncated: 'size_mismatch', corrupted: 'hash_mismatch'})
+        self.assertEqual(scrubber.get_progress()['pass'], 1)
+
+        with open(paths[corrupted], 'r+b') as f:
+            f.write(ids[corrupted].encode())
+        self.assertTrue(scrubber.resolve(truncated))
+        self.assertEqual(len(scrubber.get_repair_queue('resolved')), 1)
+        # 问题仍然存在时重新打开
+        scrubber.run_once()
+        self.assertEqual({entry['material_id'] for entry in scrubber.get_repair_queue()}, {missing, truncated})
+        self.assertEqual([entry['material_id'] for entry in scrubber.get_repair_queue('recovered')], [corrupted])
+        scrubber.close()
+
+
+class TestMediaProbe(MaterialRepositoryTestCase):
+    """测试导入时的媒体信息探测和探测缓存"""
+
+    PROBE_OUTPUT = {
+        'format': {'duration': '12.5', 'bit_rate': '800000', 'format_name': 'mov,mp4,m4a'},
+        'streams': [
+            {'codec_type': 'video', 'codec_name': 'h264', 'width': 1080, 'height': 1920, 'avg_frame_rate': '30000/1001'},
+            {'codec_type': 'audio', 'codec_name': 'aac', 'sample_rate': '44100', 'channels': 2}
+        ]
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo_dir = os.path.join(self.tmp_dir, 'repo')
+        # 假ffprobe输出固定结果并记录调用次数
+        ffprobe = os.path.join(self.tmp_dir, 'ffprobe')
+        with open(ffprobe, 'w', encoding='utf-8') as f:
+            f.write(f"#!{sys.executable}\n"
+                    f"open({os.path.join(self.tmp_dir, 'ffprobe.log')!r}, 'a').write('x')\n"
+                    f"print({json.dumps(self.PROBE_OUTPUT)!r})\n")
+        os.chmod(ffprobe, 0o755)
+        self.repo_options = {'media_probe': {'backend': 'ffprobe', 'ffprobe': ffprobe}}
+        self.repo = self.open_repo()
+
+    def probe_calls(self) -> int:
+        with open(os.path.join(self.tmp_dir, 'ffprobe.log')) as f:
+            return len(f.read())
+
+    def test_parse_ffprobe(self):
+        """测试ffprobe输出的解析"""
+        self.assertEqual(parse_ffprobe(self.PROBE_OUTPUT), {
+            'duration': 12.5, 'bitrate': 800000, 'container': 'mov', 'width': 1080, 'height': 1920,
+            'fps': 29.97, 'video_codec': 'h264', 'audio_codec': 'aac', 'sample_rate': 44100, 'channels': 2,
+            'resolution': '1080x1920'
+        })
+
+    def test_probe_on_ingest_and_cache(self):
+        """测试导入时写入类型化元数据、显式元数据优先以及按文件缓存"""
+        results = self.repo.add_materials_bulk([
+            {'file_path': self.make_file(f"{n}.mp4", n.encode()), 'material_type': 'video', 'metadata': {'fps': 25}}
+            for n in 'ab'
+        ])
+        material = self.repo.get_material(results[0]['material_id'])
+        self.assertEqual((material['metadata']['duration'], material['metadata']['height']), (12.5, 1920))
+        self.assertEqual(material['metadata']['fps'], 25)
+        self.assertEqual(self.repo.search_materials(metadata_filters={'duration': {'$gte': 10}})[1], 2)
+        self.assertEqual(self.probe_calls(), 2)
+
+        # 同一文件(inode、大小、修改时间不变)不再探测
+        self.repo.update_material_metadata(material['id'], {'title': 'a'}, merge=False)
+        report = self.repo.probe_materials()
+        self.assertEqual((report['probed'], self.probe_calls()), (1, 2))
+        self.assertEqual(self.reopen().get_material(material['id'])['metadata']['duration'], 12.5)
+
+
+class TestArchiveExport(MaterialRepositoryTestCase):
+    """测试素材打包导出"""
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [
+            self.repo.add_material(self.make_file(f"{n}.mp4", n.encode() * 3000), 'video', {'n': n}, category='春节')
+            for n in 'abc'
+        ]
+        self.repo.add_material(self.make_file('d.jpg', b'd'), 'image', {}, category='其他')
+
+    def test_zip_and_tar_round_trip(self):
+        """测试ZIP和TAR可以被标准库读取，清单与文件内容一致"""
+        for fmt, opener in (('zip', zipfile.ZipFile), ('tar', tarfile.open)):
+            path = os.path.join(self.tmp_dir, f"out.{fmt}")
+            report = self.repo.export_archive(path, category='春节')
+            self.assertEqual((report['count'], report['size']), (3, os.path.getsize(path)))
+            with opener(path) as archive:
+                read = archive.read if fmt == 'zip' else (lambda name: archive.extractfile(name).read())
+                manifest = json.loads(read('manifest.json'))
+                self.assertEqual([m['id'] for m in manifest['materials']], self.ids)
+                for record in manifest['materials']:
+                    self.assertEqual(read(record['path']), record['metadata']['n'].encode() * 3000)
+                if fmt == 'zip':
+                    self.assertIsNone(archive.testzip())
+
+    def test_ranges_and_resume(self):
+        """测试任意字节范围与完整归档一致(新实例通过CRC缓存生成尾部)，以及中断后续写"""
+        full = b''.join(self.repo.build_archive('zip', search={'material_type': 'video'}).iter_bytes())
+        archive = self.repo.build_archive('zip', search={'material_type': 'video'})
+        self.assertEqual(archive.size, len(full))
+        for start, end in ((0, 10), (100, 5000), (len(full) - 200, len(full)), (3000, None)):
+            self.assertEqual(b''.join(archive.iter_bytes(start, end)), full[start:end])
+        self.assertEqual(archive_export.parse_range('bytes=-200', archive.size), (len(full) - 200, len(full)))
+
+        path = os.path.join(self.tmp_dir, 'partial.zip')
+        with open(path, 'wb') as f:
+            f.write(full[:4000])
+        with open(f"{path}.etag", 'w') as f:
+            f.write(archive.etag)
+        report = self.repo.export_archive(path, search={'material_type': 'video'})
+        self.assertEqual(report['resumed_from'], 4000)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), full)
+
+    def test_zip64_layout(self):
+        """测试ZIP64扩展字段和结束记录(降低阈值模拟大文件)"""
+        limit = archive_export._ZIP64_LIMIT
+        archive_export._ZIP64_LIMIT = 1000
+        try:
+            data = b''.join(self.repo.build_archive('zip', category='春节').iter_bytes())
+        finally:
+            archive_export._ZIP64_LIMIT = limit
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(len(archive.namelist()), 4)
+            self.assertIsNone(archive.testzip())
+
+
+class TestTombstones(MaterialRepositoryTestCase):
+    """测试软删除、恢复和垃圾回收"""
+
+    repo_options = {'gc': False}
+
+    def test_delete_and_undelete(self):
+        """测试删除后立即不可见，重新打开后仍可恢复记录、分类和关联"""
+        target = self.repo.add_material(self.make_file('a.mp4', b'a'), 'video', {}, tags=['春节'], category='节日')
+        source = self.repo.add_material(self.make_file('b.mp4', b'b'), 'video', {})
+        self.repo.link_materials(source, target, 'derived')
+        path = self.repo.get_material(target)['file_path']
+
+        self.assertTrue(self.repo.delete_material(target))
+        self.assertIsNone(self.repo.get_material(target))
+        self.assertEqual(self.repo.search_materials(tags=['春节'])[1], 0)
+        self.assertNotIn('节日', self.repo.get_all_categories())
+        self.assertEqual(self.repo.get_related(source), [])
+        self.assertTrue(os.path.exists(path))
+
+        self.reopen()
+        self.assertEqual([t['id'] for t in self.repo.get_deleted_materials()], [target])
+        self.assertTrue(self.repo.undelete_material(target))
+        self.assertFalse(self.repo.undelete_material(target))
+        self.assertEqual(self.repo.search_materials(tags=['春节'])[1], 1)
+        self.assertEqual(self.repo.get_all_categories()['节日']['materials'], [target])
+        self.assertEqual([m['id'] for m in self.repo.get_related(source)], [target])
+        self.assertEqual(self.reopen().get_deleted_materials(), [])
+
+    def test_gc_after_window_and_resume(self):
+        """测试恢复期内不回收，到期后删除文件；标记回收中后崩溃，下次打开时继续且不可恢复"""
+        ids = [self.repo.add_material(self.make_file(f"{n}.mp4", n.encode() * 10), 'video', {}) for n in 'abc']
+        paths = [self.repo.get_material(mid)['file_path'] for mid in ids]
+        for mid in ids:
+            self.repo.delete_material(mid)
+
+        self.assertEqual(self.repo.gc.run_once()['purged'], 0)
+        later = datetime.datetime.now() + datetime.timedelta(days=8)
+        self.repo.gc._claim(later.isoformat(), {ids[0]}, set())
+        self.assertFalse(self.reopen().undelete_material(ids[0]))
+        self.assertEqual(self.repo.gc.get_metrics()['purging'], 1)
+
+        report = self.repo.gc.run_once(now=later)
+        self.assertEqual((report['purged'], report['unlinked'], report['bytes_freed']), (3, 3, 30))
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        self.assertEqual(self.repo.get_deleted_materials(), [])
+        self.assertFalse(self.repo.undelete_material(ids[1]))
+
+    def test_gc_respects_references(self):
+        """测试仍被现有素材引用的文件保留；有其他硬链接时只删除仓库内路径且不计入释放空间"""
+        content = b'shared' * 10
+        first = self.repo.add_material(self.make_file('a.mp4', content), 'video', {})
+        second = self.repo.add_material(self.make_file('b.mp4', content), 'video', {})
+        linked = self.repo.add_material(self.make_file('c.mp4', b'linked'), 'video', {})
+        shared_path = self.repo.get_material(first)['file_path']
+        linked_path = self.repo.get_material(linked)['file_path']
+        outside = os.path.join(self.tmp_dir, 'outside.mp4')
+        os.link(linked_path, outside)
+
+        self.repo.delete_material(first)
+        self.repo.delete_material(linked)
+        report = self.repo.gc.run_once(material_ids=[first, linked])
+        self.assertEqual((report['purged'], report['kept_shared'], report['unlinked']), (2, 1, 1))
+        self.assertEqual(report['bytes_freed'], 0)
+        self.assertTrue(os.path.exists(shared_path))
+        self.assertFalse(os.path.exists(linked_path))
+        self.assertTrue(os.path.exists(outside))
+        self.assertEqual(self.repo.get_material(second)['file_path'], shared_path)
+
+
+class TestFacetCounts(MaterialRepositoryTestCase):
+    """测试分面计数"""
+
+    def setUp(self):
+        super().setUp()
+        self.repo.create_metadata_index('platform', 'string')
+        specs = [
+            ('video', '春节', ['热门', '促销'], 'douyin', 1080),
+            ('video', '春节', ['热门'], 'douyin', 720),
+            ('video', '日常', ['促销'], 'tiktok', 1080),
+            ('image', '春节', ['热门'], 'douyin', None),
+            ('segment', '日常', [], 'weibo', 720),
+        ]
+        for i, (material_type, category, tags, platform, height) in enumerate(specs):
+            metadata = {'platform': platform, 'title': f"clip {i}"}
+            if height:
+                metadata['video'] = {'height': height}
+            self.repo.add_material(self.make_file(f"{i}.bin", str(i).encode()), material_type, metadata,
+                                   tags=tags, category=category)
+
+    def counts(self, result, facet):
+        return {item['value']: item['count'] for item in result['facets'][facet]}
+
+    def test_counts_without_filters(self):
+        """测试没有过滤条件时的各分面计数"""
+        result = self.repo.facet_counts(facets=['type', 'category', 'tags', 'metadata.platform'])
+        self.assertEqual(result['total'], 5)
+        self.assertEqual(result['facets']['type'][0], {'value': 'video', 'count': 3})
+        self.assertEqual(self.counts(result, 'type'), {'video': 3, 'image': 1, 'segment': 1})
+        self.assertEqual(self.counts(result, 'category'), {'春节': 3, '日常': 2})
+        self.assertEqual(self.counts(result, 'tags'), {'热门': 3, '促销': 2})
+        self.assertEqual(self.counts(result, 'metadata.platform'), {'douyin': 3, 'tiktok': 1, 'weibo': 1})
+
+    def test_counts_match_search(self):
+        """测试过滤后的计数与搜索结果一致，未声明索引的元数据路径和limit"""
+        filters = {'category': '春节', 'metadata_filters': {'platform': 'douyin'}}
+        result = self.repo.facet_counts(filters, facets=['type', 'tags', 'metadata.video.height'], limit=1)
+        items, total = self.repo.search_materials(**filters, limit=100)
+        self.assertEqual(result['total'], total)
+        self.assertEqual(result['facets']['type'], [{'value': 'video', 'count': 2}])
+        self.assertEqual(result['facets']['tags'], [{'value': '热门', 'count': 3}])
+        self.assertEqual(self.counts(self.repo.facet_counts(filters, ['metadata.video.height']),
+                                     'metadata.video.height'), {1080: 1, 720: 1})
+
+        result = self.repo.facet_counts({'query': 'clip', 'material_type': 'video'}, ['metadata.platform'])
+        self.assertEqual(self.counts(result, 'metadata.platform'), {'douyin': 2, 'tiktok': 1})
+        with self.assertRaises(ValueError):
+            self.repo.facet_counts(facets=['owner'])
+
+
+if __name__ == "__main__":
+    unittest.main()